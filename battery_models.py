@@ -12,62 +12,31 @@ Other models of charging and discharging the battery?
     would battery become "empty" because little solar production (cloudy)
    OR
    determine how many days of off-grid capacity (no import)
+   -- see outage.py for hours of autonomy from every start hour
 
 """
 
 import numpy as np
 
+import profiling
 
-def maximize_self_consumption(data):
-    """ Maximize self-consumption and calculate the SOC, based on 
-    battery size, reserve, and charging rate.  
-
-    Parameters
-    ----------
-    data : dict of 1-d numpy arrays
-        Container to hold data of production, consumption.
-        Also holds battery parameters to pass to the model.
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it the kernel runs as a plain-Python loop
+    njit = None
 
-    Returns
-    -------
-    data : dict of 1-d numpy arrays
-        Data container with added calculated self-consumption, import and 
-        export energy.
-    
-    Start the battery model(s) with equation from
-    https://github.com/abdullah2891/solar_energy_calculator
-    More specifically from 
-    https://github.com/abdullah2891/solar_energy_calculator/blob/master/lib/solar.py
-    See the Class Batteries function solve_nonlinear algorithm
-    
-    TODO 
-    3. other models of charging and discharging the battery?
-    4. determine when (or how many times) over a 2- or 3-day period SOC 
-    would dip below DOD because of no productivity (little solar)
-       OR
-       determine how many days of off-grid capacity (no import allowed when no production)
-    """
-    N = len(data['dt'])
-    # default fill SOC data with ones (for now) 
-    data['SOC'] = np.array(np.ones((N,), dtype=float))
-    
-    # all units of energy in kWh
-    data['self_consumption'] = np.array(np.zeros((N,), dtype=float))
-    data['from_battery'] = np.array(np.zeros((N,), dtype=float))
-    data['import'] = np.array(np.zeros((N,), dtype=float))
-    data['export'] = np.array(np.zeros((N,), dtype=float))
 
-    # used to scale SOC with battery reserve
-    xSOC = np.linspace(0,1,100)
-    ySOC = np.linspace(data['battery_reserve'],1.0,100)
+def _self_consumption_loop(production, consumption, usable_capacity, c_rate,
+                           SOC, soc_out, self_consumption_out, from_battery_out,
+                           import_out, export_out):
+    """ Hour-by-hour recurrence of maximize_self_consumption.
 
-    # e.g. useable capacity of 12kWh battery with 20% reserve is 
-    # 12kW * 0.80 = 9.6 kW
-    usable_capacity = data['battery_capacity']*data['depth_of_discharge']
-    # initial state of charge at beginning of time series: 100%
-    SOC = 1.0
-    
-    # Integrate SOC for each time point (hour by hour)
+    Integrates the (unscaled, 0..1 of usable capacity) SOC starting from
+    SOC and writes the results into the preallocated output sequences.
+    Returns the SOC at the end of the series.
+    """
+    N = len(production)
     for i in range(N):
         # reset these each hour : kWh
         self_consumption = 0.0
@@ -75,57 +44,48 @@ def maximize_self_consumption(data):
         to_battery = 0.0
         imported = 0.0
         exported = 0.0
-        
+
         # available energy in battery: kWh
-        # available = SOC * data['battery_capacity']
         available = SOC * usable_capacity
         # PV energy generated during this hour: kWh
-        generated = data['production'][i]
+        generated = production[i]
         # Energy consumed by loads during this hour: kWh
-        consumed = data['consumption'][i]
+        consumed = consumption[i]
 
         # Discharge to meet any load after self-consumption until the 
         # battery is empty. This occurs when load > generation. 
         if consumed >= generated:
             # use from battery if available
-            if consumed-generated <= available:
+            if consumed - generated <= available:
                 from_battery = consumed - generated
-                imported = 0                
             else:
                 # use from battery what is available then import what's needed
-                from_battery = available 
+                from_battery = available
                 imported = consumed - generated - available
-            # 
             self_consumption = from_battery + generated
-        
+
         # Charge from any excess solar generation remaining after offsetting 
         # the load until the battery is full. This occurs when generation > load.
         if generated > consumed:
             # adjust what is needed by charging rate depending on SOC
-            # for now just use 0.8
-            need = (usable_capacity - available)*data['battery_c_rate']
+            # for now just use the constant C-rate
+            need = (usable_capacity - available)*c_rate
             # if SOC < 0.8:
             #     need = (usable_capacity - available)*0.5
             # else:
             #     need = (usable_capacity - available)*0.2
-            #                
             if generated - consumed > need:
-                self_consumption = consumed
                 to_battery = need
                 exported = generated - consumed - to_battery
             else:
-                # 
                 to_battery = generated - consumed
-            # 
             self_consumption = consumed
 
             # Adjust how much charged to battery depending on charging rate of LFP
             # lithium batteryes: (LFP and NMC) 0.5C to 1.0C
             # lead-acid: 0.2C to 0.5C
             # https://www.power-sonic.com/blog/how-to-charge-lithium-iron-phosphate-lifepo4-batteries/
-            #
-            # 
-            
+
         # Base SOC calculation: kWh / kWh -> percentage
         if usable_capacity > 0:
             SOC = (available + to_battery - from_battery) / usable_capacity
@@ -138,14 +98,125 @@ def maximize_self_consumption(data):
         elif SOC <= 0.0:
             SOC = 0.0
 
-        # scale SOC with reserve
-        data['SOC'][i] = np.interp(SOC, xSOC, ySOC)
+        soc_out[i] = SOC
+        self_consumption_out[i] = self_consumption
+        from_battery_out[i] = from_battery
+        import_out[i] = imported
+        export_out[i] = exported
+    return SOC
+
+
+if njit is not None:
+    _self_consumption_jit = njit(cache=True, nogil=True)(_self_consumption_loop)
+else:
+    _self_consumption_jit = None
+
+
+def _self_consumption_kernel(production, consumption, usable_capacity, c_rate,
+                             SOC, soc_out, self_consumption_out,
+                             from_battery_out, import_out, export_out):
+    """ Run the self-consumption recurrence, compiled when numba is installed.
+
+    Inputs are contiguous float arrays, outputs are preallocated float
+    arrays of the same length filled in place. Returns the final SOC.
+    """
+    if _self_consumption_jit is not None:
+        return _self_consumption_jit(production, consumption,
+                                     usable_capacity, c_rate, SOC, soc_out,
+                                     self_consumption_out, from_battery_out,
+                                     import_out, export_out)
+    # plain Python floats and lists are much faster to index than numpy
+    # scalars, so convert once and copy back at the end
+    N = len(production)
+    outs = [[0.0]*N for k in range(5)]
+    SOC = _self_consumption_loop(production.tolist(), consumption.tolist(),
+                                 usable_capacity, c_rate, SOC, *outs)
+    for out, values in zip((soc_out, self_consumption_out, from_battery_out,
+                            import_out, export_out), outs):
+        out[:] = values
+    return SOC
+
+
+def step_c_rate(battery_c_rate, interval_hours=1.0):
+    """ Fraction of the remaining capacity charged in one time step.
+
+    battery_c_rate is the fraction charged in one hour.  Compounding it
+    over the step length makes 4 quarter-hour steps charge exactly as
+    much as one hourly step, so results do not depend on the interval.
+    C-rates of 1 or more fill the battery within any step, at any interval.
+    """
+    c_rate = np.minimum(battery_c_rate, 1.0)
+    if interval_hours == 1.0:
+        return c_rate
+    return 1.0 - (1.0 - c_rate)**interval_hours
+
+
+@profiling.profiled('maximize_self_consumption', rows=lambda data: len(data['dt']))
+def maximize_self_consumption(data):
+    """ Maximize self-consumption and calculate the SOC, based on 
+    battery size, reserve, and charging rate.  
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Container to hold data of production, consumption.
+        Also holds battery parameters to pass to the model.
+        The optional 'interval_hours' (default 1.0) is the length of each
+        sample and scales the hourly battery_c_rate to each step.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        Data container with added calculated self-consumption, import and 
+        export energy.
+    
+    Start the battery model(s) with equation from
+    https://github.com/abdullah2891/solar_energy_calculator
+    More specifically from 
+    https://github.com/abdullah2891/solar_energy_calculator/blob/master/lib/solar.py
+    See the Class Batteries function solve_nonlinear algorithm
+    
+    TODO 
+    3. other models of charging and discharging the battery?
+    4. determine when (or how many times) over a 2- or 3-day period SOC 
+    would dip below DOD because of no productivity (little solar)
+       OR
+       determine how many days of off-grid capacity (no import allowed when no production)
+       -- see outage.outage_autonomy
+    """
+    N = len(data['dt'])
+    # pull parameters out of the container once instead of on every hour
+    production = np.ascontiguousarray(data['production'], dtype=float)
+    consumption = np.ascontiguousarray(data['consumption'], dtype=float)
+    # e.g. useable capacity of 12kWh battery with 20% reserve is 
+    # 12kW * 0.80 = 9.6 kW
+    usable_capacity = float(data['battery_capacity']*data['depth_of_discharge'])
+    # C-rate is per hour, scale it to the interval of the data
+    c_rate = float(step_c_rate(data['battery_c_rate'],
+                               data.get('interval_hours', 1.0)))
+    reserve = float(data['battery_reserve'])
+
+    # all units of energy in kWh
+    data['SOC'] = np.ones((N,), dtype=float)
+    data['self_consumption'] = np.zeros((N,), dtype=float)
+    data['from_battery'] = np.zeros((N,), dtype=float)
+    data['import'] = np.zeros((N,), dtype=float)
+    data['export'] = np.zeros((N,), dtype=float)
+
+    # initial state of charge at beginning of time series: 100%
+    _self_consumption_kernel(production, consumption, usable_capacity, c_rate,
+                             1.0, data['SOC'], data['self_consumption'],
+                             data['from_battery'], data['import'],
+                             data['export'])
 
-        data['self_consumption'][i] = self_consumption
-        data['from_battery'][i] = from_battery
-        data['import'][i] = imported
-        data['export'][i] = exported
-        #
+    if profiling.enabled():
+        # steps the battery was clamped empty or full
+        profiling.count('soc_empty', np.count_nonzero(data['SOC'] == 0.0))
+        profiling.count('soc_full', np.count_nonzero(data['SOC'] == 1.0))
+
+    # scale SOC with reserve, closed form of the linear map 0..1 -> reserve..1
+    data['SOC'] *= (1.0 - reserve)
+    data['SOC'] += reserve
     return data
 
 def only_solar(data):
@@ -172,4 +243,238 @@ def only_solar(data):
     data['battery_reserve'] = 0.00 # reserve factor (0.2 = 20% reserve)
     data = maximize_self_consumption(data)
 
-    return data
\ No newline at end of file
+    return data
+
+# names of the per-config totals returned by sweep_self_consumption, in the
+# column order used by the batch kernels
+SWEEP_TOTALS = ('self_consumption', 'from_battery', 'import', 'export',
+                'empty_hours', 'full_hours')
+# names of the per-config series kept in the result cube
+SWEEP_SERIES = ('SOC', 'self_consumption', 'from_battery', 'import', 'export')
+
+
+def _self_consumption_batch_loop(production, consumption, usable_capacity,
+                                 c_rate, soc, totals, cube):
+    """ Advance K battery configurations through the time series together.
+
+    production and consumption are (P, N) with P either 1 (shared by all
+    configs) or K (one row per config). usable_capacity, c_rate and soc are
+    (K,) and soc is updated in place to the end-of-series state. totals is
+    (K, 6) and accumulated in place in SWEEP_TOTALS order. cube is either
+    (5, K, N) filled with the SWEEP_SERIES (unscaled SOC) or (5, 0, 0) to
+    keep totals only.
+    """
+    K = len(soc)
+    P, N = production.shape
+    keep = cube.shape[1] > 0
+    for i in range(N):
+        for k in range(K):
+            p = k if P > 1 else 0
+            usable = usable_capacity[k]
+            self_consumption = 0.0
+            from_battery = 0.0
+            to_battery = 0.0
+            imported = 0.0
+            exported = 0.0
+
+            available = soc[k] * usable
+            generated = production[p, i]
+            consumed = consumption[p, i]
+
+            if consumed >= generated:
+                if consumed - generated <= available:
+                    from_battery = consumed - generated
+                else:
+                    from_battery = available
+                    imported = consumed - generated - available
+                self_consumption = from_battery + generated
+
+            if generated > consumed:
+                need = (usable - available)*c_rate[k]
+                if generated - consumed > need:
+                    to_battery = need
+                    exported = generated - consumed - to_battery
+                else:
+                    to_battery = generated - consumed
+                self_consumption = consumed
+
+            if usable > 0:
+                SOC = (available + to_battery - from_battery) / usable
+            else:
+                SOC = 0.0
+            if SOC >= 1.0:
+                SOC = 1.0
+            elif SOC <= 0.0:
+                SOC = 0.0
+            soc[k] = SOC
+
+            totals[k, 0] += self_consumption
+            totals[k, 1] += from_battery
+            totals[k, 2] += imported
+            totals[k, 3] += exported
+            if SOC == 0.0:
+                totals[k, 4] += 1.0
+            elif SOC == 1.0:
+                totals[k, 5] += 1.0
+            if keep:
+                cube[0, k, i] = SOC
+                cube[1, k, i] = self_consumption
+                cube[2, k, i] = from_battery
+                cube[3, k, i] = imported
+                cube[4, k, i] = exported
+
+
+def _self_consumption_batch_numpy(production, consumption, usable_capacity,
+                                  c_rate, soc, totals, cube):
+    """ Same contract as _self_consumption_batch_loop, vectorized over the
+    configurations with numpy for when numba is not installed."""
+    P, N = production.shape
+    keep = cube.shape[1] > 0
+    has_capacity = usable_capacity > 0
+    safe_capacity = np.where(has_capacity, usable_capacity, 1.0)
+    for i in range(N):
+        available = soc * usable_capacity
+        generated = production[:, i]
+        consumed = consumption[:, i]
+
+        # NaN consumption falls in neither branch, as in the scalar loop
+        discharge = consumed >= generated
+        charge = generated > consumed
+        deficit = np.where(discharge, consumed - generated, 0.0)
+        from_battery = np.minimum(deficit, available)
+        imported = np.where(deficit > available,
+                            consumed - generated - available, 0.0)
+
+        surplus = np.where(charge, generated - consumed, 0.0)
+        need = (usable_capacity - available)*c_rate
+        to_battery = np.minimum(surplus, need)
+        exported = np.where(surplus > need, surplus - to_battery, 0.0)
+
+        self_consumption = np.where(discharge, from_battery + generated,
+                                    np.where(charge, consumed, 0.0))
+
+        SOC = np.where(has_capacity,
+                       (available + to_battery - from_battery)/safe_capacity,
+                       0.0)
+        np.clip(SOC, 0.0, 1.0, out=soc)
+
+        totals[:, 0] += self_consumption
+        totals[:, 1] += from_battery
+        totals[:, 2] += imported
+        totals[:, 3] += exported
+        totals[:, 4] += soc == 0.0
+        totals[:, 5] += soc == 1.0
+        if keep:
+            cube[0, :, i] = soc
+            cube[1, :, i] = self_consumption
+            cube[2, :, i] = from_battery
+            cube[3, :, i] = imported
+            cube[4, :, i] = exported
+
+
+if njit is not None:
+    _self_consumption_batch = njit(cache=True, nogil=True)(
+        _self_consumption_batch_loop)
+else:
+    _self_consumption_batch = _self_consumption_batch_numpy
+
+
+def parameter_grid(battery_capacity, battery_reserve, battery_c_rate):
+    """ All combinations of the given battery parameters as flat arrays.
+
+    Parameters
+    ----------
+    battery_capacity, battery_reserve, battery_c_rate : scalar or 1-d array
+        Values to combine, e.g. np.arange(0, 41, 2.5) for capacity.
+
+    Returns
+    -------
+    grid : dict of 1-d numpy arrays
+        'battery_capacity', 'battery_reserve' and 'battery_c_rate' with one
+        entry per combination, ready for sweep_self_consumption.
+    """
+    mesh = np.meshgrid(np.atleast_1d(battery_capacity),
+                       np.atleast_1d(battery_reserve),
+                       np.atleast_1d(battery_c_rate), indexing='ij')
+    return {'battery_capacity': mesh[0].ravel().astype(float),
+            'battery_reserve': mesh[1].ravel().astype(float),
+            'battery_c_rate': mesh[2].ravel().astype(float)}
+
+
+@profiling.profiled('sweep_self_consumption')
+def sweep_self_consumption(data, battery_capacity, battery_reserve,
+                           battery_c_rate, keep_series=False, SOC=1.0):
+    """ Run maximize_self_consumption for many battery configurations at once.
+
+    All configurations are advanced through the time series together, so
+    a grid of hundreds of configurations costs about as much as a few
+    single runs. Each configuration gives the same totals as calling
+    maximize_self_consumption with those parameters.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Container with production and consumption (kWh), and optional
+        'interval_hours' as in maximize_self_consumption.
+    battery_capacity, battery_reserve, battery_c_rate : scalar or 1-d array
+        Parameters of each configuration, broadcast against each other
+        (see parameter_grid to build all combinations).
+    keep_series : bool
+        Also return the (config x time) result cube as float32 arrays.
+    SOC : scalar or 1-d array
+        Initial state of charge (0..1 of usable capacity), default full.
+
+    Returns
+    -------
+    result : dict of numpy arrays
+        The broadcast parameters, per-config totals (kWh, and hours with
+        the battery empty or full) named as in SWEEP_TOTALS, 'self_consumption_pct'
+        and the end-of-series 'final_SOC' (unscaled). With keep_series, the
+        SWEEP_SERIES are added as (config, time) arrays under 'series',
+        with SOC scaled by reserve as in maximize_self_consumption.
+    """
+    capacity, reserve, c_rate, soc = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(battery_capacity, dtype=float)),
+        np.atleast_1d(np.asarray(battery_reserve, dtype=float)),
+        np.atleast_1d(np.asarray(battery_c_rate, dtype=float)),
+        np.atleast_1d(np.asarray(SOC, dtype=float)))
+    K = len(capacity)
+    production = np.atleast_2d(data['production'])
+    consumption = np.atleast_2d(data['consumption'])
+    # float32 rows (e.g. of a fleet store) are run as they are, not copied
+    dtype = np.float32 if production.dtype == consumption.dtype == np.float32 else float
+    production = np.ascontiguousarray(production, dtype=dtype)
+    consumption = np.ascontiguousarray(consumption, dtype=dtype)
+    N = production.shape[1]
+
+    usable_capacity = np.ascontiguousarray(capacity*(1.0 - reserve))
+    soc = np.array(soc)
+    totals = np.zeros((K, len(SWEEP_TOTALS)), dtype=float)
+    if keep_series:
+        cube = np.zeros((len(SWEEP_SERIES), K, N), dtype=np.float32)
+    else:
+        cube = np.zeros((len(SWEEP_SERIES), 0, 0), dtype=np.float32)
+
+    interval_hours = data.get('interval_hours', 1.0)
+    _self_consumption_batch(production, consumption, usable_capacity,
+                            np.ascontiguousarray(step_c_rate(c_rate, interval_hours)),
+                            soc, totals, cube)
+    profiling.count('sweep_steps', K*N)
+    profiling.count('soc_empty', totals[:, 4].sum())
+    profiling.count('soc_full', totals[:, 5].sum())
+    # count of empty and full steps -> hours
+    totals[:, 4:] *= interval_hours
+
+    result = {'battery_capacity': np.array(capacity),
+              'battery_reserve': np.array(reserve),
+              'battery_c_rate': np.array(c_rate),
+              'final_SOC': soc}
+    for j, name in enumerate(SWEEP_TOTALS):
+        result[name] = totals[:, j]
+    total_consumption = np.nansum(consumption, axis=1, dtype=float)
+    result['self_consumption_pct'] = 100*result['self_consumption']/total_consumption
+    if keep_series:
+        cube[0] *= (1.0 - reserve[:, None])
+        cube[0] += reserve[:, None]
+        result['series'] = dict(zip(SWEEP_SERIES, cube))
+    return result
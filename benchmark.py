@@ -0,0 +1,355 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the data pipeline on synthetic SolarEdge exports.
+
+synthetic_exports writes exports in the same format as the site's
+'Export CSV hourly ....csv' files, one file per year and one directory per
+home: PV production from the sun's elevation with seasonal day length and
+day-to-day cloudiness, and a noisy household load with morning and evening
+peaks and more use in winter and summer.  run_benchmarks times each step of
+the pipeline separately and reports throughput (rows/s) and peak memory,
+and appends the results to a JSON file so versions can be compared.
+
+Example
+-------
+    python benchmark.py --years 1 5 --interval hourly "15 min" --homes 2
+    python benchmark.py --years 3 --compare
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from read_data import (get_data, get_filenames, load_data, parse_data_regexp,
+                       INTERVAL_HOURS)
+from battery_models import maximize_self_consumption, only_solar
+from run_plot import build_frames
+
+HEADER = ('Time,Consumption Meter E (Wh),Consumption Meter P (W),'
+          'Inv1 Eac (Wh),Inv1 Pac (W)\n')
+
+
+def synthetic_series(years=1, interval='hourly', seed=0, start='2022-01-01',
+                     pv_kw=6.21, latitude=35.0, load_kwh_per_day=20.0):
+    """
+    Synthetic production and consumption of one home.
+
+    Parameters
+    ----------
+    years : int
+        Length of the series in years.
+    interval : str
+        Export interval, a key of INTERVAL_HOURS.
+    seed : int
+        Seed of the random number generator, the same seed gives the same
+        series.
+    pv_kw : float
+        Size of the PV system (kW).
+    latitude : float
+        Latitude (degrees) for the day length and height of the sun.
+    load_kwh_per_day : float
+        Mean household consumption.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        'dt' (datetime64), 'consumption' and 'production' (kWh per
+        interval), and 'daylight' where the sun is up.
+    """
+    rng = np.random.default_rng(seed)
+    interval_hours = INTERVAL_HOURS[interval]
+    t0 = pd.Timestamp(start)
+    dt = pd.date_range(t0, t0 + pd.DateOffset(years=years),
+                       freq=pd.Timedelta(hours=interval_hours),
+                       inclusive='left').values
+    N = len(dt)
+    day = (dt - dt[0]).astype('timedelta64[s]').astype(float)/86400
+    doy = pd.DatetimeIndex(dt).dayofyear.values
+    # middle of the interval, in hours of the day
+    hour = 24*(day % 1) + interval_hours/2
+    n_days = int(np.ceil(day[-1])) + 1
+    iday = day.astype(int)
+
+    # height of the sun from declination and hour angle
+    phi = np.radians(latitude)
+    decl = np.radians(23.45)*np.sin(2*np.pi*(284 + doy)/365)
+    hour_angle = np.radians(15*(hour - 12))
+    sin_elev = (np.sin(phi)*np.sin(decl) +
+                np.cos(phi)*np.cos(decl)*np.cos(hour_angle))
+    # clear-sky fraction of the day, 0.3..1: mostly sunny, about one day in
+    # eight within 5% of clear sky and one in twenty below half
+    clouds = 0.3 + 0.7*rng.beta(2.5, 1.0, n_days)
+    power = pv_kw*0.85*np.clip(sin_elev, 0, None)**1.2*clouds[iday]
+    power *= np.clip(1 + rng.normal(0, 0.08, N), 0, None)
+
+    # household load: base, morning and evening peaks, heating and cooling
+    season = 1 + 0.35*np.cos(2*np.pi*(doy - 15)/365)**2
+    profile = (0.5 + 0.6*np.exp(-0.5*((hour - 7.5)/1.2)**2) +
+               1.0*np.exp(-0.5*((hour - 19)/2.0)**2))
+    profile *= load_kwh_per_day/24/profile.mean()
+    load = profile*season*rng.lognormal(0, 0.3, N)
+
+    return {'dt': dt, 'consumption': load*interval_hours,
+            'production': power*interval_hours, 'daylight': sin_elev > -0.1}
+
+
+def write_export(fn, data):
+    """ Write data (see synthetic_series) as a SolarEdge CSV export.
+    Production is empty at night as in the real exports."""
+    ts = pd.DatetimeIndex(data['dt']).strftime('%m/%d/%Y %H:%M')
+    interval_hours = (data['dt'][1] - data['dt'][0])/np.timedelta64(1, 'h')
+    cons = 1000*data['consumption']
+    prod = 1000*data['production']
+    lines = []
+    for t, c, p, day in zip(ts, cons, prod, data['daylight']):
+        if day:
+            lines.append('%s,"%d","%.4f","%d","%.4f"\n' %
+                         (t, c, c/interval_hours, p, p/interval_hours))
+        else:
+            lines.append('%s,"%d","%.4f","",""\n' % (t, c, c/interval_hours))
+    with open(fn, 'w') as f:
+        f.write(HEADER)
+        f.writelines(lines)
+
+
+def synthetic_exports(outdir, years=1, interval='hourly', homes=1, seed=0,
+                      **kwargs):
+    """
+    Write synthetic exports of one or more homes, one file per year in one
+    directory per home (outdir/home0, outdir/home1, ...).  kwargs are passed
+    to synthetic_series.
+
+    Returns
+    -------
+    indirs : list of str
+        Directory of each home, to use with get_data.
+    """
+    indirs = []
+    for home in range(homes):
+        indir = os.path.join(outdir, 'home%d' % home)
+        os.makedirs(indir, exist_ok=True)
+        data = synthetic_series(years, interval, seed=seed+home, **kwargs)
+        year = pd.DatetimeIndex(data['dt']).year.values
+        for y in np.unique(year):
+            part = {k: v[year == y] for k, v in data.items()}
+            write_export(os.path.join(indir, 'Export CSV %s %d-01-01.csv' %
+                                      (interval, y)), part)
+        indirs.append(indir)
+    return indirs
+
+
+def measure(func, *args, repeat=3, rows=1):
+    """
+    Time func(*args), the best of repeat calls, and its peak memory from
+    one more call under tracemalloc (kept apart from the timing since
+    tracing slows allocations down).
+
+    Returns
+    -------
+    result : dict
+        'rows', 'seconds', 'rows_per_s' and 'peak_mb'.
+    """
+    seconds = np.inf
+    for i in range(repeat):
+        t0 = time.perf_counter()
+        func(*args)
+        seconds = min(seconds, time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        func(*args)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return {'rows': rows, 'seconds': seconds,
+            'rows_per_s': rows/seconds if seconds > 0 else np.inf,
+            'peak_mb': peak/2**20}
+
+
+def _model_input(data, battery_capacity=20.0, battery_reserve=0.20,
+                 battery_c_rate=0.80):
+    """ Fresh copy of the model inputs with the battery parameters, as
+    set by run_plot.run_model"""
+    run = {k: data[k] for k in ('dt', 'interval_hours')}
+    run['production'] = data['production'].copy()
+    run['consumption'] = data['consumption'].copy()
+    run['battery_capacity'] = battery_capacity
+    run['battery_reserve'] = battery_reserve
+    run['battery_c_rate'] = battery_c_rate
+    run['depth_of_discharge'] = 1-battery_reserve
+    return run
+
+
+def benchmark_home(indir, interval='hourly', repeat=3, regexp=True):
+    """
+    Time the pipeline steps on the exports of one directory.
+
+    Returns
+    -------
+    steps : dict of dict
+        measure results of each step: 'parse_data_regexp', 'get_data'
+        (no cache), 'get_data_cached' (warm cache), 'maximize_self_consumption',
+        'only_solar' and 'build_frames' (resampling and summation).
+    """
+    steps = {}
+    if regexp:
+        lines = []
+        for fn in get_filenames(indir, interval):
+            lines.extend(load_data(fn))
+        steps['parse_data_regexp'] = measure(
+            lambda: parse_data_regexp(lines, {}), repeat=1, rows=len(lines))
+        del lines
+
+    data = get_data(indir, interval, {}, cache=False)
+    N = len(data['dt'])
+    steps['get_data'] = measure(lambda: get_data(indir, interval, {}, cache=False),
+                                repeat=repeat, rows=N)
+    get_data(indir, interval, {}, cache=True)
+    steps['get_data_cached'] = measure(lambda: get_data(indir, interval, {}),
+                                       repeat=repeat, rows=N)
+
+    # first call compiles the numba kernel, keep that out of the timing
+    maximize_self_consumption(_model_input(data))
+    steps['maximize_self_consumption'] = measure(
+        lambda: maximize_self_consumption(_model_input(data)), repeat=repeat,
+        rows=N)
+    steps['only_solar'] = measure(
+        lambda: only_solar(_model_input(data, 0.0)), repeat=repeat, rows=N)
+    run = maximize_self_consumption(_model_input(data))
+    steps['build_frames'] = measure(lambda: build_frames(run), repeat=repeat,
+                                    rows=N)
+    return steps
+
+
+def _revision():
+    """ Short git revision of this tree, None outside a git checkout"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmarks(years=(1,), intervals=('hourly',), homes=1, repeat=3,
+                   regexp=True, workdir=None, seed=0):
+    """
+    Generate synthetic exports for every combination of years and interval
+    and benchmark each home.
+
+    Returns
+    -------
+    run : dict
+        'revision', 'time', 'python', 'numpy', 'pandas', 'platform' and
+        'results', a list with one row (dict) per data set, home and step.
+    """
+    results = []
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        for interval in intervals:
+            for n_years in years:
+                outdir = os.path.join(tmp, '%s_%dy' % (interval.replace(' ', ''),
+                                                       n_years))
+                indirs = synthetic_exports(outdir, n_years, interval, homes,
+                                           seed=seed)
+                for home, indir in enumerate(indirs):
+                    steps = benchmark_home(indir, interval, repeat, regexp)
+                    for step, m in steps.items():
+                        results.append(dict(interval=interval, years=n_years,
+                                            home=home, step=step,
+                                            **m))
+                        print('%-8s %2dy home%d %-26s %8.4f s %12.0f rows/s %8.1f MB'
+                              % (interval, n_years, home, step, m['seconds'],
+                                 m['rows_per_s'], m['peak_mb']))
+    return {'revision': _revision(),
+            'time': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__,
+            'pandas': pd.__version__, 'platform': platform.platform(),
+            'results': results}
+
+
+def load_runs(fn):
+    """ Benchmark runs saved in fn, an empty list if there are none"""
+    if not os.path.exists(fn):
+        return []
+    with open(fn) as f:
+        return json.load(f)
+
+
+def save_run(fn, run):
+    """ Append a run to the JSON file fn"""
+    runs = load_runs(fn)
+    runs.append(run)
+    with open(fn, 'w') as f:
+        json.dump(runs, f, indent=1)
+
+
+def compare_runs(previous, current, threshold=0.20):
+    """
+    Steps that got slower by more than threshold (0.2 = 20%) between two
+    runs, matched on interval, years, home and step.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        Seconds of both runs and the ratio, only for the slower steps.
+    """
+    keys = ['interval', 'years', 'home', 'step']
+    before = pd.DataFrame(previous['results'])
+    after = pd.DataFrame(current['results'])
+    if before.empty or after.empty:
+        return pd.DataFrame()
+    table = before[keys+['seconds']].merge(after[keys+['seconds']], on=keys,
+                                           suffixes=('_before', '_after'))
+    table['ratio'] = table['seconds_after']/table['seconds_before']
+    return table[table['ratio'] > 1+threshold]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the pipeline on synthetic SolarEdge exports.')
+    parser.add_argument('--years', nargs='+', type=int, default=[1],
+                        help='years of data of each data set')
+    parser.add_argument('--interval', nargs='+', default=['hourly'],
+                        choices=['hourly', '15 min'],
+                        help='export intervals')
+    parser.add_argument('--homes', type=int, default=1,
+                        help='number of homes of each data set')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='time the best of this many calls')
+    parser.add_argument('--no-regexp', action='store_true',
+                        help='skip the (slow) parse_data_regexp step')
+    parser.add_argument('--output', default='bench_results.json',
+                        help='JSON file the results are appended to')
+    parser.add_argument('--compare', action='store_true',
+                        help='list steps slower than the previous run')
+    parser.add_argument('--threshold', type=float, default=0.20,
+                        help='slow-down reported by --compare (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    run = run_benchmarks(args.years, args.interval, args.homes, args.repeat,
+                         not args.no_regexp)
+    previous = load_runs(args.output)
+    save_run(args.output, run)
+    print('Saved results to %s' % args.output)
+    if args.compare and previous:
+        slower = compare_runs(previous[-1], run, args.threshold)
+        if len(slower):
+            print('Slower than revision %s:' % previous[-1]['revision'])
+            print(slower.to_string(index=False))
+        else:
+            print('No step slower than revision %s by more than %g%%'
+                  % (previous[-1]['revision'], 100*args.threshold))
+        return 1 if len(slower) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Typed containers for the data, battery parameters and model results, as a
+compact alternative to one dict holding inputs, parameters and results.
+
+* Dataset: datetime64[ns] timestamps and contiguous float64 production and
+  consumption, 24 bytes a row.
+* BatteryConfig: the battery parameters in a __slots__ object, kept apart
+  from the data.
+* ModelResult: the five result series in one contiguous (5, N) block that
+  the kernel fills in place.  The series are views of its rows, and
+  to_frame() hands the block to pandas without a copy.
+
+as_dict() of a result gives the dict layout used by build_frames,
+EnergyIndex, outage and the plots, with views instead of copies.
+
+Example
+-------
+    dataset = Dataset.load('./data', 'hourly')
+    result = simulate(dataset, BatteryConfig(20.0, 0.20, 0.80))
+    df = result.to_frame()
+    frames = build_frames(result.as_dict())
+"""
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from read_data import get_data, find_gaps, INTERVAL_HOURS
+from battery_models import _self_consumption_kernel, step_c_rate
+
+# rows of the ModelResult block
+RESULT_SERIES = ('SOC', 'self_consumption', 'from_battery', 'import',
+                 'export')
+
+
+class BatteryConfig:
+    """ Battery parameters of one model run.
+
+    Parameters
+    ----------
+    battery_capacity : float
+        Capacity (kWh).
+    battery_reserve : float
+        Reserve factor (0.2 = 20% reserve).
+    battery_c_rate : float
+        Fraction of the capacity charged in one hour.
+    """
+    __slots__ = ('battery_capacity', 'battery_reserve', 'battery_c_rate')
+
+    def __init__(self, battery_capacity=20.0, battery_reserve=0.20,
+                 battery_c_rate=0.80):
+        self.battery_capacity = float(battery_capacity)
+        self.battery_reserve = float(battery_reserve)
+        self.battery_c_rate = float(battery_c_rate)
+
+    @property
+    def depth_of_discharge(self):
+        return 1 - self.battery_reserve
+
+    @property
+    def usable_capacity(self):
+        return self.battery_capacity*self.depth_of_discharge
+
+    @property
+    def battery_model(self):
+        if self.battery_capacity > 0.0:
+            return 'Maximize Self-Consumption'
+        return 'Only Solar, NO BATTERY'
+
+    def as_tuple(self):
+        return (self.battery_capacity, self.battery_reserve,
+                self.battery_c_rate)
+
+    def as_dict(self):
+        return {'battery_capacity': self.battery_capacity,
+                'battery_reserve': self.battery_reserve,
+                'battery_c_rate': self.battery_c_rate,
+                'depth_of_discharge': self.depth_of_discharge,
+                'battery_model': self.battery_model}
+
+    def __repr__(self):
+        return 'BatteryConfig(%g, %g, %g)' % self.as_tuple()
+
+    def __eq__(self, other):
+        return isinstance(other, BatteryConfig) and \
+               self.as_tuple() == other.as_tuple()
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+
+class Dataset:
+    """ Production and consumption (kWh) of each interval.
+
+    Arrays given as datetime64[ns] and contiguous float64 are used as they
+    are, anything else is converted once here.
+    """
+    __slots__ = ('dt', 'production', 'consumption', 'interval',
+                 'interval_hours', 'gaps')
+
+    def __init__(self, dt, production, consumption, interval='hourly',
+                 gaps=None):
+        self.dt = np.ascontiguousarray(dt, dtype='datetime64[ns]')
+        self.production = np.ascontiguousarray(production, dtype=float)
+        self.consumption = np.ascontiguousarray(consumption, dtype=float)
+        self.interval = interval
+        self.interval_hours = INTERVAL_HOURS[interval]
+        if gaps is None:
+            gaps = find_gaps(self.dt, self.interval_hours)
+        self.gaps = gaps
+
+    @classmethod
+    def from_dict(cls, data):
+        """ Dataset of the arrays of a get_data dict, without copies"""
+        return cls(data['dt'], data['production'], data['consumption'],
+                   data.get('interval', 'hourly'), data.get('gaps'))
+
+    @classmethod
+    def load(cls, indir='./data', interval='hourly', **kwargs):
+        """ Dataset of the exports in indir, kwargs are passed to get_data
+        (cache, start, end)."""
+        return cls.from_dict(get_data(indir, interval, {}, **kwargs))
+
+    def __len__(self):
+        return len(self.dt)
+
+    @property
+    def nbytes(self):
+        return self.dt.nbytes + self.production.nbytes + self.consumption.nbytes
+
+    def as_dict(self):
+        """ The arrays (not copies) in the dict layout of get_data"""
+        return {'dt': self.dt, 'production': self.production,
+                'consumption': self.consumption, 'interval': self.interval,
+                'interval_hours': self.interval_hours, 'gaps': self.gaps}
+
+    def to_frame(self):
+        """ production and consumption as a DataFrame indexed by time"""
+        return pd.DataFrame({'production': self.production,
+                             'consumption': self.consumption},
+                            index=pd.DatetimeIndex(self.dt, name='Datetime'),
+                            copy=False)
+
+
+class ModelResult:
+    """ Results of one model run: the dataset, the config and the
+    RESULT_SERIES as rows of one (5, N) float64 block."""
+    __slots__ = ('dataset', 'config', 'block')
+
+    def __init__(self, dataset, config, block):
+        self.dataset = dataset
+        self.config = config
+        self.block = block
+
+    def __len__(self):
+        return self.block.shape[1]
+
+    def __getitem__(self, name):
+        """ Row of a RESULT_SERIES, or a dataset array, as a view"""
+        if name in RESULT_SERIES:
+            return self.block[RESULT_SERIES.index(name)]
+        return getattr(self.dataset, name)
+
+    @property
+    def nbytes(self):
+        return self.dataset.nbytes + self.block.nbytes
+
+    def totals(self):
+        """ Sums of the energy series (kWh)"""
+        totals = {name: float(np.nansum(self[name])) for name in
+                  ('production', 'consumption') + RESULT_SERIES[1:]}
+        totals['self_consumption_pct'] = 100*totals['self_consumption']/totals['consumption']
+        return totals
+
+    def as_dict(self):
+        """ Data, parameters and results in the dict layout of run_model,
+        every array a view."""
+        data = self.dataset.as_dict()
+        data.update(self.config.as_dict())
+        if self.config.battery_capacity <= 0.0:
+            # as only_solar
+            data['battery_reserve'] = 0.0
+        for j, name in enumerate(RESULT_SERIES):
+            data[name] = self.block[j]
+        return data
+
+    def to_frame(self):
+        """ Data and results as a DataFrame indexed by time.  The columns
+        are the arrays themselves (no copy): changing one changes the other."""
+        columns = {'production': self.dataset.production,
+                   'consumption': self.dataset.consumption}
+        for j, name in enumerate(RESULT_SERIES):
+            columns[name] = self.block[j]
+        return pd.DataFrame(columns, copy=False,
+                            index=pd.DatetimeIndex(self.dataset.dt,
+                                                   name='Datetime'))
+
+
+@profiling.profiled('simulate', rows=len)
+def simulate(dataset, config, SOC=1.0):
+    """
+    Run maximize_self_consumption (or only_solar for zero capacity) on a
+    Dataset, the kernel writing straight into the result block.
+
+    Returns
+    -------
+    result : ModelResult
+        SOC is scaled with the reserve as in maximize_self_consumption.
+    """
+    N = len(dataset)
+    block = np.zeros((len(RESULT_SERIES), N), dtype=float)
+    if config.battery_capacity > 0.0:
+        usable_capacity, reserve = config.usable_capacity, config.battery_reserve
+    else:
+        # only_solar: no battery and no reserve
+        usable_capacity, reserve = 0.0, 0.0
+    c_rate = float(step_c_rate(config.battery_c_rate, dataset.interval_hours))
+    _self_consumption_kernel(dataset.production, dataset.consumption,
+                             usable_capacity, c_rate, SOC, *block)
+    if profiling.enabled():
+        profiling.count('soc_empty', np.count_nonzero(block[0] == 0.0))
+        profiling.count('soc_full', np.count_nonzero(block[0] == 1.0))
+    block[0] *= (1.0 - reserve)
+    block[0] += reserve
+    return ModelResult(dataset, config, block)
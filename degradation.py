@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""
+Battery degradation: capacity fade from calendar and cycle aging over the
+lifetime of the battery, fed back into the battery model year by year.
+
+Cycles are counted on the SOC trace with the rainflow method (ASTM E1049)
+in one pass over its turning points, O(n) with a stack.  Each cycle of
+depth d (fraction of capacity) wears the battery by
+
+    eol_fade/cycle_life * (d/cycle_dod)**dod_exponent
+
+so cycle_life cycles of depth cycle_dod fade the battery by eol_fade.
+Calendar aging after t years is
+
+    calendar_fade * (1 + soc_stress*(mean SOC - 0.5)) * t**calendar_exponent
+
+and the two are added.  The data is taken as a typical year: wear over the
+data is scaled to one year by the length of the data.
+
+run_lifetime runs every battery configuration of a sweep together (one
+sweep_self_consumption per year of life), each with its own faded
+capacity, so a lifetime sweep costs about one sweep per year plus the
+cycle counts.
+
+Example
+-------
+    data = get_data()
+    result = run_lifetime(data, battery_capacity=[10., 20.], years=15)
+    table = lifetime_table(result, k=1)
+"""
+
+import numpy as np
+import pandas as pd
+
+from battery_models import sweep_self_consumption
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it the cycle count runs in plain Python
+    njit = None
+
+# LFP home battery: 6000 cycles of 80% depth to 80% of capacity, and about
+# 1.5% calendar fade after one year falling off with the square root of time
+LFP = {'cycle_life': 6000.0, 'cycle_dod': 0.8, 'eol_fade': 0.2,
+       'dod_exponent': 1.3, 'calendar_fade': 0.015,
+       'calendar_exponent': 0.5, 'soc_stress': 0.5}
+
+
+def turning_points(x):
+    """ Local extremes of a series, with the first and last values; flat
+    stretches count once."""
+    x = np.asarray(x, dtype=float)
+    x = x[~np.isnan(x)]
+    if len(x) < 3:
+        return x
+    # drop repeated values, then keep points where the slope changes sign
+    x = x[np.append(True, np.diff(x) != 0)]
+    if len(x) < 3:
+        return x
+    slope = np.sign(np.diff(x))
+    turn = np.flatnonzero(slope[1:] != slope[:-1]) + 1
+    return np.concatenate([x[:1], x[turn], x[-1:]])
+
+
+def _rainflow_loop(reversals, depth_out, mean_out, count_out):
+    """ Rainflow count of the turning points, cycles written to the outputs
+    (at least len(reversals) long); returns the number of cycles."""
+    n = len(reversals)
+    stack = np.empty(n)
+    top = 0
+    m = 0
+    for i in range(n):
+        stack[top] = reversals[i]
+        top += 1
+        while top >= 3:
+            X = abs(stack[top-1] - stack[top-2])
+            Y = abs(stack[top-2] - stack[top-3])
+            if X < Y:
+                break
+            depth_out[m] = Y
+            mean_out[m] = 0.5*(stack[top-2] + stack[top-3])
+            if top == 3:
+                # range includes the start: half cycle, drop the start
+                count_out[m] = 0.5
+                stack[0] = stack[1]
+                stack[1] = stack[2]
+                top = 2
+            else:
+                count_out[m] = 1.0
+                stack[top-3] = stack[top-1]
+                top -= 2
+            m += 1
+    # what is left are half cycles
+    for j in range(top-1):
+        depth_out[m] = abs(stack[j+1] - stack[j])
+        mean_out[m] = 0.5*(stack[j+1] + stack[j])
+        count_out[m] = 0.5
+        m += 1
+    return m
+
+
+if njit is not None:
+    _rainflow = njit(cache=True, nogil=True)(_rainflow_loop)
+else:
+    _rainflow = _rainflow_loop
+
+
+def rainflow(soc):
+    """
+    Rainflow cycle count of a SOC trace.
+
+    Returns
+    -------
+    cycles : dict of 1-d numpy arrays
+        'depth' (range of SOC), 'mean' (SOC at the middle of the range) and
+        'count' (1 for a full cycle, 0.5 for a half cycle) of each cycle.
+    """
+    reversals = turning_points(soc)
+    n = len(reversals)
+    depth = np.zeros((n,))
+    mean = np.zeros((n,))
+    count = np.zeros((n,))
+    m = _rainflow(reversals, depth, mean, count)
+    return {'depth': depth[:m], 'mean': mean[:m], 'count': count[:m]}
+
+
+def cycle_fade(cycles, params=LFP):
+    """ Fraction of capacity lost to the counted cycles"""
+    per_cycle = params['eol_fade']/params['cycle_life']
+    stress = (cycles['depth']/params['cycle_dod'])**params['dod_exponent']
+    return per_cycle*float(np.sum(cycles['count']*stress))
+
+
+def calendar_fade(years, mean_soc=0.5, params=LFP):
+    """ Fraction of capacity lost to calendar aging after years (scalar or
+    array) held at mean_soc"""
+    stress = 1 + params['soc_stress']*(np.asarray(mean_soc) - 0.5)
+    years = np.asarray(years, dtype=float)
+    return params['calendar_fade']*stress*years**params['calendar_exponent']
+
+
+def run_lifetime(data, battery_capacity=20.0, battery_reserve=0.20,
+                 battery_c_rate=0.80, years=15, params=LFP, SOC=1.0):
+    """
+    Run the battery model for each year of the battery's life with the
+    capacity left after the aging of the years before.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        A typical year (or more) of production and consumption.
+    battery_capacity, battery_reserve, battery_c_rate : scalar or 1-d array
+        New battery of each configuration, broadcast as in
+        sweep_self_consumption.
+    years : int
+        Years of life.
+    params : dict
+        Aging parameters, see LFP.
+    SOC : float
+        SOC (0..1 of usable capacity) at the start of the first year, later
+        years start where the year before ended.
+
+    Returns
+    -------
+    result : dict of numpy arrays
+        The new battery parameters (config,) and (year, config) arrays of
+        'capacity' (at the start of the year), 'cycle_fade' and
+        'calendar_fade' (total fade at the end of the year), 'fade',
+        'equivalent_full_cycles' and the model totals per year
+        'self_consumption', 'import', 'export' and 'self_consumption_pct'.
+    """
+    capacity, reserve, c_rate = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(battery_capacity, dtype=float)),
+        np.atleast_1d(np.asarray(battery_reserve, dtype=float)),
+        np.atleast_1d(np.asarray(battery_c_rate, dtype=float)))
+    K = len(capacity)
+    span = len(data['production'])*data.get('interval_hours', 1.0)/8760
+    names = ('capacity', 'cycle_fade', 'calendar_fade', 'fade',
+             'equivalent_full_cycles', 'self_consumption', 'import', 'export',
+             'self_consumption_pct')
+    result = {name: np.zeros((years, K)) for name in names}
+
+    soc = np.broadcast_to(np.asarray(SOC, dtype=float), (K,))
+    cycled = np.zeros((K,))
+    for year in range(years):
+        fade = np.minimum(result['fade'][year-1] if year else np.zeros((K,)),
+                          1.0)
+        result['capacity'][year] = capacity*(1 - fade)
+        out = sweep_self_consumption(data, result['capacity'][year], reserve,
+                                     c_rate, keep_series=True, SOC=soc)
+        soc = out['final_SOC']
+        for name in ('self_consumption', 'import', 'export'):
+            result[name][year] = out[name]/span
+        result['self_consumption_pct'][year] = out['self_consumption_pct']
+
+        # SOC of the nameplate capacity, with the reserve, for aging
+        trace = out['series']['SOC']
+        mean_soc = np.nanmean(trace, axis=1)
+        for k in range(K):
+            if result['capacity'][year, k] <= 0:
+                continue
+            cycles = rainflow(trace[k])
+            cycled[k] += cycle_fade(cycles, params)/span
+            result['equivalent_full_cycles'][year, k] = \
+                np.sum(cycles['count']*cycles['depth'])/span
+        result['cycle_fade'][year] = cycled
+        result['calendar_fade'][year] = calendar_fade(year + 1, mean_soc,
+                                                      params)
+        result['fade'][year] = result['cycle_fade'][year] + \
+                               result['calendar_fade'][year]
+        del out, trace
+
+    result['battery_capacity'] = np.array(capacity)
+    result['battery_reserve'] = np.array(reserve)
+    result['battery_c_rate'] = np.array(c_rate)
+    return result
+
+
+def lifetime_table(result, k=0):
+    """ Year by year results of configuration k of run_lifetime as a table"""
+    columns = ('capacity', 'fade', 'cycle_fade', 'calendar_fade',
+               'equivalent_full_cycles', 'self_consumption', 'import',
+               'export', 'self_consumption_pct')
+    years = np.arange(1, len(result['capacity']) + 1)
+    table = pd.DataFrame({name: result[name][:, k] for name in columns},
+                         index=pd.Index(years, name='year'))
+    return table
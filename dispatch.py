@@ -0,0 +1,499 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of battery dispatch models sharing one batched kernel interface.
+
+Every model is a kernel that advances K battery configurations through
+the time series together, arrays in and arrays out:
+
+    kernel(production, consumption, period, params, soc, totals, cube)
+
+    production, consumption  (P, N) kWh per step, P = 1 or K
+    period                   (N,) int8 TOU period of each step, 0 off-peak,
+                             1 mid-peak, 2 peak
+    params                   (K, len(KERNEL_PARAMS)) per-step parameters
+    soc                      (K,) SOC (0..1 of usable capacity), updated in
+                             place to the end-of-series state
+    totals                   (K, len(DISPATCH_TOTALS)) accumulated in place
+    cube                     (len(DISPATCH_SERIES), K, N) filled with the
+                             series (unscaled SOC), or (.., 0, 0)
+
+run_dispatch turns the model parameters into KERNEL_PARAMS (per step of
+the data), runs the kernel and returns totals as sweep_self_consumption,
+so changing the model never leaves the batched path.  The built-in models
+are presets of one kernel (compiled with numba when installed, else
+vectorized over the configurations with numpy):
+
+* charge and discharge capped by the inverter (max_charge_kw,
+  max_discharge_kw), energies on the AC side
+* round-trip losses, split evenly between charge and discharge, and
+  standby losses (fraction of the stored energy per hour)
+* SOC-tapered charging: above taper_soc the battery charges at
+  taper_c_rate instead of battery_c_rate
+* strategies: 'self_consumption' (discharge to any load, charge from
+  excess solar), 'tou_arbitrage' (also charge from the grid off-peak up to
+  target_soc, discharge only at peak) and 'backup_reserve' (keep
+  backup_soc of the usable capacity for outages, refilled from the grid)
+
+With the default parameters 'maximize_self_consumption' gives the same
+results as battery_models.maximize_self_consumption.  register_model adds
+presets of these, or a new kernel with the interface above.
+
+Example
+-------
+    data = get_data()
+    result = run_dispatch(data, 'power_limited', battery_capacity=[10., 20.])
+    result = run_dispatch(data, 'tou_arbitrage', tariff=tou_tariff(0.25, 0.5))
+    data = dispatch_model(dict(data, battery_capacity=13.5), 'backup_reserve')
+"""
+
+import numpy as np
+
+import profiling
+from battery_models import step_c_rate
+from tariff import rate_table, calendar_slots
+
+try:
+    from numba import njit
+except ImportError:
+    # numba is optional, without it the kernel is vectorized with numpy
+    njit = None
+
+# strategy codes of the built-in kernel
+STRATEGIES = {'self_consumption': 0, 'tou_arbitrage': 1, 'backup_reserve': 2}
+
+# model parameters and their defaults (hourly rates, kW and fractions)
+MODEL_PARAMS = {'battery_capacity': 20.0,        # kWh
+                'battery_reserve': 0.20,         # fraction kept unused
+                'battery_c_rate': 0.80,          # fraction of room per hour
+                'max_charge_kw': np.inf,
+                'max_discharge_kw': np.inf,
+                'round_trip_efficiency': 1.0,
+                'standby_loss': 0.0,             # fraction per hour
+                'taper_soc': 1.0,                # SOC where the taper starts
+                'taper_c_rate': 0.20,            # C-rate above taper_soc
+                'grid_charge_kw': 0.0,
+                'target_soc': 1.0,               # grid charge target, TOU
+                'backup_soc': 0.0}               # kept for outages
+
+# per-step parameters of the kernels, columns of params
+KERNEL_PARAMS = ('usable_capacity', 'c_rate', 'taper_soc', 'taper_c_rate',
+                 'charge_max', 'discharge_max', 'charge_efficiency',
+                 'discharge_efficiency', 'standby_keep', 'strategy',
+                 'grid_charge_max', 'target_soc', 'backup_soc')
+
+# per-config totals, the SWEEP_TOTALS followed by the energy charged (from
+# solar and grid), the part of it from the grid and the energy lost
+DISPATCH_TOTALS = ('self_consumption', 'from_battery', 'import', 'export',
+                   'empty_hours', 'full_hours', 'to_battery', 'grid_charge',
+                   'losses')
+DISPATCH_SERIES = ('SOC', 'self_consumption', 'from_battery', 'import',
+                   'export', 'to_battery')
+
+# parameters of a power-limited battery with losses, e.g. a 5 kW inverter
+LIMITED = {'max_charge_kw': 5.0, 'max_discharge_kw': 5.0,
+           'round_trip_efficiency': 0.90, 'standby_loss': 0.0005,
+           'taper_soc': 0.8, 'taper_c_rate': 0.2}
+
+MODELS = {}
+
+
+def register_model(name, kernel=None, strategy='self_consumption',
+                   label=None, needs_period=False, fixed=None, **defaults):
+    """
+    Add a dispatch model to MODELS.
+
+    Parameters
+    ----------
+    name : str
+        Name of the model in run_dispatch.
+    kernel : callable, optional
+        Batched kernel with the interface of the module notes, the built-in
+        kernel by default.
+    strategy : str
+        Key of STRATEGIES, for the built-in kernel.
+    label : str, optional
+        Name shown in plots and reports.
+    needs_period : bool
+        The model uses the TOU period, run_dispatch then needs a tariff.
+    fixed : dict, optional
+        Parameters that override the caller's (e.g. no capacity).
+    defaults
+        Model parameters differing from MODEL_PARAMS.
+    """
+    unknown = set(defaults) | set(fixed or ())
+    unknown -= set(MODEL_PARAMS)
+    if unknown:
+        raise ValueError('unknown model parameters %s' % sorted(unknown))
+    MODELS[name] = {'kernel': kernel if kernel is not None else _dispatch,
+                    'strategy': STRATEGIES[strategy],
+                    'label': label or name,
+                    'needs_period': needs_period,
+                    'fixed': dict(fixed or {}),
+                    'defaults': defaults}
+
+
+def _dispatch_loop(production, consumption, period, params, soc, totals,
+                   cube):
+    """ Built-in kernel, step by step for every configuration (numba)."""
+    K = len(soc)
+    P, N = production.shape
+    keep = cube.shape[1] > 0
+    # columns used every step, with the divisions done once
+    usable_capacity = params[:, 0].copy()
+    c_rate = params[:, 1]/params[:, 6]
+    taper_c_rate = params[:, 3]/params[:, 6]
+    draw = 1.0/params[:, 7]
+    for i in range(N):
+        for k in range(K):
+            p = k if P > 1 else 0
+            usable = usable_capacity[k]
+            strategy = params[k, 9]
+            eta_c = params[k, 6]
+            eta_d = params[k, 7]
+            self_consumption = 0.0
+            from_battery = 0.0
+            to_battery = 0.0
+            grid = 0.0
+            imported = 0.0
+            exported = 0.0
+
+            available = soc[k] * usable
+            lost = available*(1.0 - params[k, 8])
+            available = available*params[k, 8]
+            floor = params[k, 12]*usable
+            generated = production[p, i]
+            consumed = consumption[p, i]
+
+            if consumed >= generated:
+                deficit = consumed - generated
+                # TOU arbitrage keeps the battery for the peak
+                if strategy != 1 or period[i] == 2:
+                    from_battery = (available - floor)*eta_d
+                    if from_battery < 0.0:
+                        from_battery = 0.0
+                    if from_battery > params[k, 5]:
+                        from_battery = params[k, 5]
+                    if deficit <= from_battery:
+                        from_battery = deficit
+                imported = deficit - from_battery
+                self_consumption = from_battery + generated
+
+            if generated > consumed:
+                surplus = generated - consumed
+                if soc[k] >= params[k, 2]:
+                    need = (usable - available)*taper_c_rate[k]
+                else:
+                    need = (usable - available)*c_rate[k]
+                if need > params[k, 4]:
+                    need = params[k, 4]
+                if surplus > need:
+                    to_battery = need
+                else:
+                    to_battery = surplus
+                exported = surplus - to_battery
+                self_consumption = consumed
+
+            # grid charging up to the TOU target off-peak, or the backup
+            if (strategy == 1 and period[i] == 0) or strategy == 2:
+                if strategy == 1:
+                    target = params[k, 11]*usable
+                else:
+                    target = floor
+                stored = available + to_battery*eta_c - from_battery*draw[k]
+                grid = (target - stored)/eta_c
+                if grid > params[k, 10]:
+                    grid = params[k, 10]
+                if grid > params[k, 4] - to_battery:
+                    grid = params[k, 4] - to_battery
+                if grid < 0.0:
+                    grid = 0.0
+                imported += grid
+
+            lost += (to_battery + grid)*(1.0 - eta_c) + \
+                    from_battery*(draw[k] - 1.0)
+            if usable > 0:
+                SOC = (available + (to_battery + grid)*eta_c -
+                       from_battery*draw[k]) / usable
+            else:
+                SOC = 0.0
+            if SOC >= 1.0:
+                SOC = 1.0
+            elif SOC <= 0.0:
+                SOC = 0.0
+            soc[k] = SOC
+
+            totals[k, 0] += self_consumption
+            totals[k, 1] += from_battery
+            totals[k, 2] += imported
+            totals[k, 3] += exported
+            if SOC == 0.0:
+                totals[k, 4] += 1.0
+            elif SOC == 1.0:
+                totals[k, 5] += 1.0
+            totals[k, 6] += to_battery + grid
+            totals[k, 7] += grid
+            totals[k, 8] += lost
+            if keep:
+                cube[0, k, i] = SOC
+                cube[1, k, i] = self_consumption
+                cube[2, k, i] = from_battery
+                cube[3, k, i] = imported
+                cube[4, k, i] = exported
+                cube[5, k, i] = to_battery + grid
+
+
+def _dispatch_numpy(production, consumption, period, params, soc, totals,
+                    cube):
+    """ Same contract as _dispatch_loop, vectorized over the configurations
+    with numpy for when numba is not installed."""
+    P, N = production.shape
+    keep = cube.shape[1] > 0
+    (usable, c_rate, taper_soc, taper_c_rate, charge_max, discharge_max,
+     eta_c, eta_d, standby_keep, strategy, grid_max, target_soc,
+     backup_soc) = params.T
+    has_capacity = usable > 0
+    safe_capacity = np.where(has_capacity, usable, 1.0)
+    floor = backup_soc*usable
+    tou = strategy == 1
+    backup = strategy == 2
+    c_rate = c_rate/eta_c
+    taper_c_rate = taper_c_rate/eta_c
+    draw = 1.0/eta_d
+    for i in range(N):
+        available = soc*usable
+        lost = available*(1.0 - standby_keep)
+        available = available*standby_keep
+        generated = production[:, i]
+        consumed = consumption[:, i]
+
+        # NaN consumption falls in neither branch, as in the loop
+        discharge = consumed >= generated
+        charge = generated > consumed
+        deficit = np.where(discharge, consumed - generated, 0.0)
+        can = np.clip((available - floor)*eta_d, 0.0, discharge_max)
+        if period[i] != 2:
+            can = np.where(tou, 0.0, can)
+        from_battery = np.minimum(deficit, can)
+        imported = deficit - from_battery
+
+        surplus = np.where(charge, generated - consumed, 0.0)
+        rate = np.where(soc >= taper_soc, taper_c_rate, c_rate)
+        need = np.minimum((usable - available)*rate, charge_max)
+        to_battery = np.minimum(surplus, need)
+        exported = surplus - to_battery
+
+        self_consumption = np.where(discharge, from_battery + generated,
+                                    np.where(charge, consumed, 0.0))
+
+        target = np.where(tou, target_soc*usable, floor)
+        stored = available + to_battery*eta_c - from_battery*draw
+        grid = np.clip(np.minimum(np.minimum((target - stored)/eta_c,
+                                             grid_max),
+                                  charge_max - to_battery), 0.0, None)
+        grid = np.where(backup | (tou & (period[i] == 0)), grid, 0.0)
+        imported = imported + grid
+
+        lost += (to_battery + grid)*(1.0 - eta_c) + \
+                from_battery*(draw - 1.0)
+        SOC = np.where(has_capacity,
+                       (available + (to_battery + grid)*eta_c -
+                        from_battery*draw)/safe_capacity, 0.0)
+        np.clip(SOC, 0.0, 1.0, out=soc)
+
+        totals[:, 0] += self_consumption
+        totals[:, 1] += from_battery
+        totals[:, 2] += imported
+        totals[:, 3] += exported
+        totals[:, 4] += soc == 0.0
+        totals[:, 5] += soc == 1.0
+        totals[:, 6] += to_battery + grid
+        totals[:, 7] += grid
+        totals[:, 8] += lost
+        if keep:
+            cube[0, :, i] = soc
+            cube[1, :, i] = self_consumption
+            cube[2, :, i] = from_battery
+            cube[3, :, i] = imported
+            cube[4, :, i] = exported
+            cube[5, :, i] = to_battery + grid
+
+
+if njit is not None:
+    _dispatch = njit(cache=True, nogil=True)(_dispatch_loop)
+else:
+    _dispatch = _dispatch_numpy
+
+
+register_model('maximize_self_consumption', label='Maximize Self-Consumption')
+register_model('only_solar', label='Only Solar, NO BATTERY',
+               fixed={'battery_capacity': 0.0, 'battery_reserve': 0.0})
+register_model('power_limited', label='Power-Limited Self-Consumption',
+               **LIMITED)
+register_model('tou_arbitrage', strategy='tou_arbitrage',
+               label='TOU Arbitrage', needs_period=True, grid_charge_kw=3.0,
+               **LIMITED)
+register_model('backup_reserve', strategy='backup_reserve',
+               label='Backup Reserve', backup_soc=0.5, grid_charge_kw=3.0,
+               **LIMITED)
+
+
+def tou_periods(dt, tariff, holidays=()):
+    """
+    TOU period of each timestamp from the import rates of a tariff: 0 at
+    the lowest rate of the day (month and day type), 2 at the highest and
+    1 in between.
+    """
+    table = rate_table(tariff['import_rate'], tariff.get('seasons'))
+    low = table.min(axis=2, keepdims=True)
+    high = table.max(axis=2, keepdims=True)
+    period = np.where(table == low, 0, np.where(table == high, 2, 1))
+    return period.astype(np.int8).ravel()[calendar_slots(dt, holidays)]
+
+
+def kernel_params(values, interval_hours=1.0):
+    """ (K, len(KERNEL_PARAMS)) per-step parameters of broadcast model
+    parameters (dict of (K,) arrays) and a strategy code"""
+    h = interval_hours
+    eta = np.sqrt(values['round_trip_efficiency'])
+    columns = {'usable_capacity': values['battery_capacity'] *
+                                  (1.0 - values['battery_reserve']),
+               'c_rate': step_c_rate(values['battery_c_rate'], h),
+               'taper_soc': values['taper_soc'],
+               'taper_c_rate': step_c_rate(values['taper_c_rate'], h),
+               'charge_max': values['max_charge_kw']*h,
+               'discharge_max': values['max_discharge_kw']*h,
+               'charge_efficiency': eta,
+               'discharge_efficiency': eta,
+               'standby_keep': (1.0 - values['standby_loss'])**h,
+               'strategy': values['strategy'],
+               'grid_charge_max': values['grid_charge_kw']*h,
+               'target_soc': values['target_soc'],
+               'backup_soc': values['backup_soc']}
+    K = len(values['battery_capacity'])
+    return np.ascontiguousarray(np.stack(
+        [np.broadcast_to(np.asarray(columns[name], dtype=float), (K,))
+         for name in KERNEL_PARAMS], axis=1))
+
+
+@profiling.profiled('run_dispatch')
+def run_dispatch(data, model='maximize_self_consumption', keep_series=False,
+                 SOC=1.0, tariff=None, holidays=(), series_dtype=np.float32,
+                 **params):
+    """
+    Run a dispatch model for many battery configurations at once.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        dt, production and consumption (kWh), and optional 'interval_hours'.
+        production and consumption may also be (K, N), one row per config.
+    model : str
+        Name of a model in MODELS.
+    keep_series : bool
+        Also return the (config, time) DISPATCH_SERIES under 'series'.
+    SOC : scalar or 1-d array
+        Initial state of charge (0..1 of usable capacity), default full.
+    tariff : dict, optional
+        Tariff (see tariff.py) giving the TOU periods, needed by models
+        using them.
+    holidays : sequence of dates
+        Days with the weekend periods of the tariff.
+    series_dtype : numpy dtype
+        dtype of the series.
+    params
+        Model parameters (see MODEL_PARAMS), scalars or 1-d arrays
+        broadcast against each other; the model's defaults otherwise.
+
+    Returns
+    -------
+    result : dict of numpy arrays
+        'model', the broadcast parameters, the per-config DISPATCH_TOTALS
+        (kWh, and hours with the battery empty or full),
+        'self_consumption_pct' and 'final_SOC'.  With keep_series, the
+        series with SOC scaled by the reserve as in maximize_self_consumption.
+    """
+    entry = MODELS[model]
+    unknown = set(params) - set(MODEL_PARAMS)
+    if unknown:
+        raise ValueError('unknown model parameters %s' % sorted(unknown))
+    values = dict(MODEL_PARAMS, **entry['defaults'])
+    values.update(params)
+    values.update(entry['fixed'])
+    names = list(MODEL_PARAMS)
+    arrays = np.broadcast_arrays(*[np.atleast_1d(np.asarray(values[name],
+                                                            dtype=float))
+                                   for name in names] +
+                                 [np.atleast_1d(np.asarray(SOC, dtype=float))])
+    values = dict(zip(names, arrays[:-1]))
+    values['strategy'] = entry['strategy']
+    soc = np.array(arrays[-1])
+    K = len(soc)
+
+    production = np.atleast_2d(data['production'])
+    consumption = np.atleast_2d(data['consumption'])
+    # float32 rows (e.g. of a fleet store) are run as they are, not copied
+    dtype = np.float32 if production.dtype == consumption.dtype == np.float32 else float
+    production = np.ascontiguousarray(production, dtype=dtype)
+    consumption = np.ascontiguousarray(consumption, dtype=dtype)
+    N = production.shape[1]
+
+    if tariff is not None:
+        period = tou_periods(data['dt'], tariff, holidays)
+    elif entry['needs_period']:
+        raise ValueError('model %s needs a tariff for the TOU periods' % model)
+    else:
+        period = np.zeros((N,), dtype=np.int8)
+
+    interval_hours = data.get('interval_hours', 1.0)
+    totals = np.zeros((K, len(DISPATCH_TOTALS)), dtype=float)
+    if keep_series:
+        cube = np.zeros((len(DISPATCH_SERIES), K, N), dtype=series_dtype)
+    else:
+        cube = np.zeros((len(DISPATCH_SERIES), 0, 0), dtype=series_dtype)
+    entry['kernel'](production, consumption, period,
+                    kernel_params(values, interval_hours), soc, totals, cube)
+    profiling.count('dispatch_steps', K*N)
+    # count of empty and full steps -> hours
+    totals[:, 4:6] *= interval_hours
+
+    result = {name: np.array(values[name]) for name in names}
+    result['model'] = model
+    result['final_SOC'] = soc
+    for j, name in enumerate(DISPATCH_TOTALS):
+        result[name] = totals[:, j]
+    total_consumption = np.nansum(consumption, axis=1, dtype=float)
+    result['self_consumption_pct'] = 100*result['self_consumption']/total_consumption
+    if keep_series:
+        reserve = values['battery_reserve']
+        cube[0] *= (1.0 - reserve[:, None])
+        cube[0] += reserve[:, None]
+        result['series'] = dict(zip(DISPATCH_SERIES, cube))
+    return result
+
+
+def dispatch_model(data, model='maximize_self_consumption', tariff=None,
+                   holidays=()):
+    """
+    Run a dispatch model on one configuration in the layout of
+    maximize_self_consumption: the model parameters found in data are
+    used (the model's defaults for the others), the series are added to it.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        Data with the SOC, self_consumption, from_battery, import, export
+        and to_battery series, 'battery_model' (the label of the model) and
+        'model_params', all parameters of the run.
+    """
+    params = {name: data[name] for name in MODEL_PARAMS if name in data}
+    result = run_dispatch(data, model, keep_series=True, tariff=tariff,
+                          holidays=holidays, series_dtype=float, **params)
+    data['model_params'] = {name: float(result[name][0]) for name in
+                            MODEL_PARAMS}
+    for name in ('battery_capacity', 'battery_reserve', 'battery_c_rate'):
+        data[name] = data['model_params'][name]
+    data['depth_of_discharge'] = 1 - data['battery_reserve']
+    data['battery_model'] = MODELS[model]['label']
+    for name in DISPATCH_SERIES:
+        data[name] = result['series'][name][0]
+    return data
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Prefix-sum (cumulative sum) index over the energy columns of the model
+results.  With the cumulative sums and a timestamp-to-offset lookup, the
+total of any column over any date range is two lookups and a subtraction,
+and the hourly, daily, weekly and monthly views are differences of the
+cumulative sums at the bin edges instead of separate resamples.
+
+Example
+-------
+    index = EnergyIndex(data['dt'], data)
+    sums = index.sums('2023-06-01', '2023-07-01')
+    df_daily = index.resample('D')
+"""
+
+import numpy as np
+import pandas as pd
+
+# energy columns (kWh) summed over ranges
+ENERGY_COLUMNS = ('production', 'consumption', 'self_consumption',
+                  'from_battery', 'import', 'export')
+# state columns averaged (not summed) over bins
+MEAN_COLUMNS = ('SOC',)
+
+
+class EnergyIndex:
+    """ Cumulative sums of the energy columns of a time-sorted data set.
+
+    Parameters
+    ----------
+    dt : 1-d array of datetime
+        Sample times, sorted.
+    data : dict of 1-d numpy arrays
+        Container with the ENERGY_COLUMNS and optionally MEAN_COLUMNS.
+        NaN values count as zero, as with pandas sum().
+    """
+    __slots__ = ('dt', 'columns', 'csum')
+
+    def __init__(self, dt, data, columns=ENERGY_COLUMNS, means=MEAN_COLUMNS):
+        self.dt = np.asarray(pd.DatetimeIndex(dt).values, dtype='datetime64[ns]')
+        self.columns = tuple(c for c in tuple(columns)+tuple(means) if c in data)
+        N = len(self.dt)
+        # leading zero so the sum over [i, j) is csum[:, j] - csum[:, i]
+        self.csum = np.zeros((len(self.columns), N+1), dtype=float)
+        for j, column in enumerate(self.columns):
+            values = np.asarray(data[column], dtype=float)
+            np.cumsum(np.where(np.isnan(values), 0.0, values),
+                      out=self.csum[j, 1:])
+
+    def offset(self, t):
+        """ Index of the first sample at or after t (scalar or array)"""
+        t = np.asarray(pd.DatetimeIndex(np.atleast_1d(t)).values,
+                       dtype='datetime64[ns]')
+        return np.searchsorted(self.dt, t, side='left')
+
+    def sums(self, start, end):
+        """ Totals of every column over samples in [start, end) as a dict"""
+        i, j = self.offset([start, end])
+        totals = dict(zip(self.columns, self.csum[:, j] - self.csum[:, i]))
+        totals['samples'] = int(j - i)
+        return totals
+
+    def self_consumption_pct(self, start, end):
+        """ Self-consumption as percent of consumption over [start, end)"""
+        totals = self.sums(start, end)
+        return 100*totals['self_consumption']/totals['consumption']
+
+    def bin_edges(self, freq):
+        """
+        Bin edges and labels covering the data for freq, matching the
+        bins and labels of pandas resample.
+
+        freq : 'h' (hourly), 'D' (daily), 'W' (weeks ending Sunday,
+        labelled by the Sunday), 'M' (months labelled by the month end) or
+        'Y' (years labelled by Dec 31).
+        """
+        first = pd.Timestamp(self.dt[0])
+        last = pd.Timestamp(self.dt[-1])
+        if freq in ('h', 'H', 'D'):
+            step = pd.Timedelta(hours=1) if freq != 'D' else pd.Timedelta(days=1)
+            start = first.floor(step)
+            edges = pd.date_range(start, last.floor(step)+step, freq=step)
+            labels = edges[:-1]
+        elif freq in ('W', 'W-SUN'):
+            start = first.floor('D') - pd.Timedelta(days=first.weekday())
+            n = (last - start).days//7 + 2
+            edges = pd.date_range(start, periods=n, freq='7D')
+            labels = edges[1:] - pd.Timedelta(days=1)
+        elif freq in ('M', 'ME', 'MS'):
+            start = first.floor('D').replace(day=1)
+            end = last.floor('D').replace(day=1) + pd.DateOffset(months=1)
+            edges = pd.date_range(start, end, freq='MS')
+            labels = edges[1:] - pd.Timedelta(days=1)
+        elif freq in ('Y', 'YE', 'YS'):
+            start = pd.Timestamp(year=first.year, month=1, day=1)
+            end = pd.Timestamp(year=last.year+1, month=1, day=1)
+            edges = pd.date_range(start, end, freq='YS')
+            labels = edges[1:] - pd.Timedelta(days=1)
+        else:
+            raise ValueError('Unsupported frequency: %s' % freq)
+        return edges, labels
+
+    def resample(self, freq):
+        """
+        Sums of the energy columns (and means of MEAN_COLUMNS) per bin,
+        the same as DataFrame.resample(freq).sum() on the energy columns.
+
+        Returns
+        -------
+        df : pandas.DataFrame
+            One row per bin, indexed by the bin label.
+        """
+        edges, labels = self.bin_edges(freq)
+        offsets = self.offset(edges)
+        sums = np.diff(self.csum[:, offsets], axis=1)
+        counts = np.diff(offsets)
+        df = pd.DataFrame(dict(zip(self.columns, sums)), index=labels)
+        for column in MEAN_COLUMNS:
+            if column in self.columns:
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    df[column] = df[column]/counts
+        df.index.name = 'Datetime'
+        return df
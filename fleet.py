@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""
+Fleet mode: the battery model for many customer sites at once.
+
+All sites are put on one common time axis in a compact (site x time)
+float32 store on disk, read back as memory maps.  run_fleet runs the
+self-consumption dispatch for a chunk of sites at a time, one site per row
+of the batch kernel (see sweep_self_consumption), so a fleet larger than
+memory is run out-of-core with only one chunk of rows in memory at a time.
+Intervals missing from a site's exports are NaN consumption and zero
+production, which leave the battery unchanged as in the single-site model
+(but count towards empty_hours or full_hours while the battery sits empty
+or full; 'samples' is the number of intervals a site has data for).
+
+Store layout
+------------
+    fleet.json          site names, first timestamp, interval, row count
+    production.f4       float32 (site, time), kWh per interval
+    consumption.f4      float32 (site, time), kWh per interval
+
+Example
+-------
+    build_store('./fleet', ['./sites/a', './sites/b'], interval='hourly')
+    result = run_fleet(open_store('./fleet'), battery_capacity=20.0)
+    table = fleet_table(result)
+"""
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+from read_data import get_data, INTERVAL_HOURS
+from battery_models import sweep_self_consumption, SWEEP_TOTALS
+
+STORE_FILE = 'fleet.json'
+STORE_COLUMNS = ('production', 'consumption')
+
+
+def create_store(store_dir, sites, start, n_times, interval='hourly'):
+    """
+    Create an empty store: NaN consumption and zero production for every
+    site and time.
+
+    Returns
+    -------
+    store : dict
+        See open_store, with the arrays open for writing.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    meta = {'sites': [str(site) for site in sites],
+            'start': str(np.datetime64(start, 'ns')),
+            'n_times': int(n_times), 'interval': interval}
+    shape = (len(meta['sites']), meta['n_times'])
+    for column in STORE_COLUMNS:
+        arr = np.memmap(os.path.join(store_dir, column+'.f4'),
+                        dtype=np.float32, mode='w+', shape=shape)
+        arr[:] = np.nan if column == 'consumption' else 0.0
+        arr.flush()
+        del arr
+    with open(os.path.join(store_dir, STORE_FILE), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return open_store(store_dir, mode='r+')
+
+
+def open_store(store_dir, mode='r'):
+    """
+    Open a store as memory maps.
+
+    Returns
+    -------
+    store : dict
+        'sites' (list of names), 'dt' (datetime64[ns] of the time axis),
+        'interval', 'interval_hours', and 'production' and 'consumption' as
+        float32 (site, time) memory maps.
+    """
+    with open(os.path.join(store_dir, STORE_FILE), 'r') as f:
+        meta = json.load(f)
+    interval_hours = INTERVAL_HOURS[meta['interval']]
+    step = np.timedelta64(int(round(interval_hours*3600)), 's')
+    store = {'sites': meta['sites'], 'interval': meta['interval'],
+             'interval_hours': interval_hours,
+             'dt': np.datetime64(meta['start'], 'ns') +
+                   np.arange(meta['n_times'])*step}
+    shape = (len(meta['sites']), meta['n_times'])
+    for column in STORE_COLUMNS:
+        store[column] = np.memmap(os.path.join(store_dir, column+'.f4'),
+                                  dtype=np.float32, mode=mode, shape=shape)
+    return store
+
+
+def time_offsets(store, dt):
+    """ Row offsets in the store time axis of timestamps dt, -1 where dt is
+    not on the axis."""
+    dt = np.asarray(dt, dtype='datetime64[ns]')
+    step = np.timedelta64(int(round(store['interval_hours']*3600)), 's')
+    offset = (dt - store['dt'][0])//step
+    on_axis = ((dt - store['dt'][0]) % step == np.timedelta64(0, 'ns')) & \
+              (offset >= 0) & (offset < len(store['dt']))
+    return np.where(on_axis, offset, -1)
+
+
+def write_site(store, i, data):
+    """ Put the production and consumption of one site (dict as from
+    get_data) in row i of the store."""
+    offset = time_offsets(store, data['dt'])
+    ok = offset >= 0
+    for column in STORE_COLUMNS:
+        store[column][i, offset[ok]] = np.asarray(data[column])[ok]
+
+
+def build_store(store_dir, indirs, interval='hourly', sites=None, cache=True):
+    """
+    Read the exports of every site and write them to a new store.
+
+    Each site is read with get_data twice (once for the time range of the
+    fleet, once to fill its row), so with cache only the first pass parses
+    the exports and at most one site is in memory at a time.
+
+    Parameters
+    ----------
+    store_dir : str
+        Directory of the store.
+    indirs : list of str
+        Export directory of each site.
+    interval : str
+        Export interval, 'hourly' or '15 min'.
+    sites : list of str, optional
+        Site names, default the directory names.
+
+    Returns
+    -------
+    store : dict
+        See open_store.
+    """
+    if sites is None:
+        sites = [os.path.basename(os.path.normpath(indir)) for indir in indirs]
+    first, last = None, None
+    for indir in indirs:
+        dt = get_data(indir, interval, {}, cache=cache)['dt']
+        if len(dt):
+            first = dt[0] if first is None else min(first, dt[0])
+            last = dt[-1] if last is None else max(last, dt[-1])
+    if first is None:
+        raise ValueError('No exports found for the fleet')
+    step = np.timedelta64(int(round(INTERVAL_HOURS[interval]*3600)), 's')
+    n_times = int((last - first)//step) + 1
+
+    store = create_store(store_dir, sites, first, n_times, interval)
+    for i, indir in enumerate(indirs):
+        write_site(store, i, get_data(indir, interval, {}, cache=cache))
+    for column in STORE_COLUMNS:
+        store[column].flush()
+    return open_store(store_dir)
+
+
+def run_fleet(store, battery_capacity=20.0, battery_reserve=0.20,
+              battery_c_rate=0.80, SOC=1.0, chunk_sites=256,
+              aggregate_series=False):
+    """
+    Run maximize_self_consumption for every site, a chunk of sites at a time.
+
+    Parameters
+    ----------
+    store : dict
+        Store as from open_store (or any dict with (site, time) production
+        and consumption arrays and interval_hours).
+    battery_capacity, battery_reserve, battery_c_rate, SOC : scalar or 1-d array
+        Battery of every site, or one value per site.
+    chunk_sites : int
+        Sites run together; memory use is about 8*chunk_sites*time bytes,
+        plus 20*chunk_sites*time with aggregate_series.
+    aggregate_series : bool
+        Also sum the SWEEP_SERIES energies (and stored energy, kWh) over the
+        fleet for each time, e.g. for the fleet's import profile.
+
+    Returns
+    -------
+    result : dict of numpy arrays
+        Per-site 'sites', parameters, totals named as in SWEEP_TOTALS,
+        'production', 'consumption', 'samples', 'self_consumption_pct' and
+        'final_SOC';
+        'aggregate', the fleet totals as a dict; and with aggregate_series,
+        'series' as a dict of 1-d arrays over time.
+    """
+    production = store['production']
+    consumption = store['consumption']
+    S, N = production.shape
+    params = {name: np.broadcast_to(np.asarray(value, dtype=float), (S,))
+              for name, value in (('battery_capacity', battery_capacity),
+                                  ('battery_reserve', battery_reserve),
+                                  ('battery_c_rate', battery_c_rate),
+                                  ('SOC', SOC))}
+    names = SWEEP_TOTALS + ('production', 'consumption', 'samples',
+                            'final_SOC')
+    result = {name: np.zeros((S,)) for name in names}
+    if aggregate_series:
+        series = {name: np.zeros((N,)) for name in
+                  ('stored', 'self_consumption', 'from_battery', 'import',
+                   'export')}
+
+    for a in range(0, S, chunk_sites):
+        b = min(a + chunk_sites, S)
+        chunk = {'production': np.asarray(production[a:b]),
+                 'consumption': np.asarray(consumption[a:b]),
+                 'interval_hours': store.get('interval_hours', 1.0)}
+        out = sweep_self_consumption(
+            chunk, params['battery_capacity'][a:b],
+            params['battery_reserve'][a:b], params['battery_c_rate'][a:b],
+            keep_series=aggregate_series, SOC=params['SOC'][a:b])
+        for name in SWEEP_TOTALS + ('final_SOC',):
+            result[name][a:b] = out[name]
+        result['production'][a:b] = np.nansum(chunk['production'], axis=1,
+                                              dtype=float)
+        result['consumption'][a:b] = np.nansum(chunk['consumption'], axis=1,
+                                               dtype=float)
+        result['samples'][a:b] = (~np.isnan(chunk['consumption'])).sum(axis=1)
+        if aggregate_series:
+            capacity = params['battery_capacity'][a:b, None]
+            series['stored'] += (out['series']['SOC']*capacity).sum(axis=0)
+            for name in ('self_consumption', 'from_battery', 'import',
+                         'export'):
+                series[name] += out['series'][name].sum(axis=0)
+        del chunk, out
+
+    result['sites'] = list(store.get('sites', range(S)))
+    for name in ('battery_capacity', 'battery_reserve', 'battery_c_rate'):
+        result[name] = np.array(params[name])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        result['self_consumption_pct'] = 100*result['self_consumption']/result['consumption']
+    aggregate = {name: float(result[name].sum()) for name in
+                 ('production', 'consumption') + SWEEP_TOTALS}
+    aggregate['sites'] = S
+    with np.errstate(invalid='ignore', divide='ignore'):
+        aggregate['self_consumption_pct'] = float(
+            100*np.float64(aggregate['self_consumption']) /
+            aggregate['consumption'])
+    result['aggregate'] = aggregate
+    if aggregate_series:
+        series['dt'] = store.get('dt')
+        result['series'] = series
+    return result
+
+
+def fleet_table(result):
+    """ Per-site totals of run_fleet as a table indexed by site"""
+    columns = ('battery_capacity', 'battery_reserve', 'battery_c_rate',
+               'production', 'consumption', 'samples') + SWEEP_TOTALS + \
+              ('self_consumption_pct', 'final_SOC')
+    table = pd.DataFrame({name: result[name] for name in columns},
+                         index=pd.Index(result['sites'], name='site'))
+    return table
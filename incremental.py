@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental (append) mode for the battery model.  A checkpoint directory
+holds the end-of-series state of each battery configuration (last SOC and
+running energy totals) and the model results computed so far.  When new
+exports are dropped in ./data only the rows after the checkpoint are read
+(through the coverage index of read_data) and run, starting from the saved
+SOC instead of a full battery, and appended to the saved results, so a
+refresh costs about as much as the new data.
+
+Checkpoint layout
+-----------------
+    state.json          last timestamp, row count, interval, parameters,
+                        SOC, totals
+    dt.i8               timestamps (datetime64[ns] as int64) of all rows
+    {k}_{series}.f4     float32 SWEEP_SERIES of configuration k
+
+Example
+-------
+    result = update('./data', 'hourly', './checkpoint',
+                    battery_capacity=[10., 20.])
+    series = load_series('./checkpoint', k=1)
+"""
+
+import os
+import json
+
+import numpy as np
+
+from read_data import get_data
+from battery_models import sweep_self_consumption, SWEEP_TOTALS, SWEEP_SERIES
+
+STATE_FILE = 'state.json'
+PARAMETERS = ('battery_capacity', 'battery_reserve', 'battery_c_rate')
+
+
+def load_checkpoint(state_dir):
+    """ Saved state in state_dir as a dict, or None if there is none"""
+    fn = os.path.join(state_dir, STATE_FILE)
+    if not os.path.exists(fn):
+        return None
+    with open(fn, 'r') as f:
+        state = json.load(f)
+    for key in PARAMETERS + SWEEP_TOTALS + ('final_SOC',):
+        state[key] = np.array(state[key], dtype=float)
+    return state
+
+
+def save_checkpoint(state, state_dir):
+    """ Write the state atomically so an interrupted save keeps the old one"""
+    os.makedirs(state_dir, exist_ok=True)
+    out = {}
+    for key, value in state.items():
+        out[key] = value.tolist() if isinstance(value, np.ndarray) else value
+    fn = os.path.join(state_dir, STATE_FILE)
+    with open(fn+'.tmp', 'w') as f:
+        json.dump(out, f, indent=1)
+    os.replace(fn+'.tmp', fn)
+
+
+def _append(fn, values, rows_before):
+    """ Append values to a raw binary column holding rows_before rows.
+
+    Anything past rows_before (left by an interrupted update) is dropped
+    first, so the column always matches the checkpoint.
+    """
+    values = np.ascontiguousarray(values)
+    with open(fn, 'ab') as f:
+        f.truncate(rows_before*values.itemsize)
+        f.seek(0, os.SEEK_END)
+        values.tofile(f)
+
+
+def run_incremental(data, state_dir, battery_capacity=20.0,
+                    battery_reserve=0.20, battery_c_rate=0.80,
+                    keep_series=True):
+    """ Run the model only on rows after the checkpoint and extend it.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Time-sorted container with dt, production and consumption (kWh),
+        and 'interval_hours', which must match the checkpoint.
+    state_dir : str
+        Checkpoint directory, created on the first run.
+    battery_capacity, battery_reserve, battery_c_rate : scalar or 1-d array
+        Battery configurations as in sweep_self_consumption.  They must be
+        the same as when the checkpoint was started.
+    keep_series : bool
+        Append the per-hour results of each configuration to the checkpoint.
+
+    Returns
+    -------
+    state : dict
+        Updated checkpoint: running totals over all rows so far, the last
+        SOC of each configuration, 'rows' in total and 'new_rows' this run.
+    """
+    params = dict(zip(PARAMETERS, np.broadcast_arrays(
+        np.atleast_1d(np.asarray(battery_capacity, dtype=float)),
+        np.atleast_1d(np.asarray(battery_reserve, dtype=float)),
+        np.atleast_1d(np.asarray(battery_c_rate, dtype=float)))))
+    K = len(params['battery_capacity'])
+    dt = np.asarray(data['dt'], dtype='datetime64[ns]')
+    interval_hours = data.get('interval_hours', 1.0)
+
+    state = load_checkpoint(state_dir)
+    if state is None:
+        state = {key: np.array(value) for key, value in params.items()}
+        state.update({key: np.zeros((K,)) for key in SWEEP_TOTALS})
+        # initial state of charge at beginning of time series: 100%
+        state['final_SOC'] = np.ones((K,))
+        state['rows'] = 0
+        state['last_dt'] = None
+        state['keep_series'] = keep_series
+        state['interval_hours'] = interval_hours
+        start = 0
+    else:
+        for key in PARAMETERS:
+            if not np.array_equal(state[key], params[key]):
+                raise ValueError('Checkpoint in %s was made with different '
+                                 'battery parameters' % state_dir)
+        if state.get('interval_hours', interval_hours) != interval_hours:
+            raise ValueError('Checkpoint in %s was made with %g hour '
+                             'intervals, not %g' % (state_dir,
+                                                    state['interval_hours'],
+                                                    interval_hours))
+        keep_series = state['keep_series']
+        last_dt = np.datetime64(state['last_dt'], 'ns')
+        # rows at or before the checkpoint were already run
+        start = np.searchsorted(dt, last_dt, side='right')
+
+    new = {'production': data['production'][start:],
+           'consumption': data['consumption'][start:],
+           'interval_hours': interval_hours}
+    n = len(new['production'])
+    state['new_rows'] = n
+    if n == 0:
+        return state
+
+    result = sweep_self_consumption(new, keep_series=keep_series,
+                                    SOC=state['final_SOC'], **params)
+    if keep_series:
+        os.makedirs(state_dir, exist_ok=True)
+        _append(os.path.join(state_dir, 'dt.i8'),
+                dt[start:].view('int64'), state['rows'])
+        for k in range(K):
+            for name in SWEEP_SERIES:
+                _append(os.path.join(state_dir, '%d_%s.f4' % (k, name)),
+                        result['series'][name][k], state['rows'])
+
+    for key in SWEEP_TOTALS:
+        state[key] = state[key] + result[key]
+    state['final_SOC'] = result['final_SOC']
+    state['rows'] = state['rows'] + n
+    state['last_dt'] = str(dt[-1])
+    save_checkpoint(state, state_dir)
+    return state
+
+
+def load_series(state_dir, k=0):
+    """ Memory-mapped results of configuration k saved in the checkpoint.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        'dt' (datetime64[ns]) and the SWEEP_SERIES of configuration k.
+    """
+    state = load_checkpoint(state_dir)
+    if state is None or not state['keep_series']:
+        raise ValueError('No saved series in %s' % state_dir)
+    rows = state['rows']
+    data = {'dt': np.memmap(os.path.join(state_dir, 'dt.i8'), dtype='int64',
+                            mode='r', shape=(rows,)).view('datetime64[ns]')}
+    for name in SWEEP_SERIES:
+        data[name] = np.memmap(os.path.join(state_dir, '%d_%s.f4' % (k, name)),
+                               dtype=np.float32, mode='r', shape=(rows,))
+    return data
+
+
+def update(indir='./data', interval='hourly', state_dir='./checkpoint',
+           **params):
+    """ Load the rows of the exports after the checkpoint (all of them on
+    the first run) and run only those.  params are passed to
+    run_incremental."""
+    state = load_checkpoint(state_dir)
+    if state is None or state['last_dt'] is None:
+        data = get_data(indir, interval, {})
+    else:
+        # only the rows after the checkpoint, found with the coverage index
+        start = np.datetime64(state['last_dt'], 'ns') + np.timedelta64(1, 'ns')
+        data = get_data(indir, interval, {}, start=start)
+    return run_incremental(data, state_dir, **params)
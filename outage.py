@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+Storm or power outage model: if the grid went down at any given hour, how
+many hours could the battery plus solar carry the house (no import)?
+
+Every start hour is answered at once from cumulative sums of the energy
+balance instead of re-running the battery model from each start:
+
+* recharge=False (conservative): solar only offsets the load in the same
+  hour and surplus is not stored.  With D the cumulative sum of the
+  deficits (load - solar), the battery lasts from start s until the first
+  t with D[t] - D[s] > E0[s], a searchsorted on the monotone D.
+* recharge=True: surplus charges the battery up to full.  With S the
+  cumulative net (solar - load) since the start, the battery energy after
+  k hours is S_k + min(E0, usable - max(S_1..S_k)), advanced for all starts
+  together one outage hour at a time (a sliding window of the outage
+  length).  Surplus is assumed to charge without the C-rate limit.
+
+Example
+-------
+    data = run_model(get_data())
+    result = outage_autonomy(data, max_hours=72)
+    table = autonomy_table(data, result, lengths=(4, 12, 24, 48, 72))
+"""
+
+import numpy as np
+import pandas as pd
+
+
+def start_energy(data, use_reserve=False):
+    """
+    Energy in the battery (kWh) at the start of each interval, from the
+    SOC trace of the battery model, and the capacity it can hold.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Model results with SOC (scaled with reserve) and battery parameters.
+    use_reserve : bool
+        Allow the outage to use the reserve held back in normal operation.
+
+    Returns
+    -------
+    E0 : 1-d numpy array
+        Energy available at the start of each interval.  The first interval
+        starts with the model's initial SOC of 100%.
+    capacity : float
+        Most energy the battery can hold.
+    """
+    capacity = float(data['battery_capacity'])
+    reserve = float(data['battery_reserve'])
+    # state at the start of interval i is the SOC at the end of i-1
+    SOC = np.concatenate([[1.0], np.asarray(data['SOC'], dtype=float)[:-1]])
+    if use_reserve:
+        return SOC*capacity, capacity
+    usable = capacity*data['depth_of_discharge']
+    if reserve < 1.0:
+        SOC = (SOC - reserve)/(1.0 - reserve)
+    else:
+        SOC = np.zeros_like(SOC)
+    return np.clip(SOC, 0.0, 1.0)*usable, usable
+
+
+def outage_autonomy(data, max_hours=72, recharge=True, SOC=None,
+                    use_reserve=False):
+    """
+    Hours the battery and solar could carry the load for an outage starting
+    at every interval.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Model results (see start_energy) with production and consumption.
+    max_hours : float
+        Longest outage considered, the result is capped here.
+    recharge : bool
+        Store surplus solar during the outage (see module notes).
+    SOC : float, optional
+        Start every outage at this SOC (0..1 of usable capacity) instead of
+        the model's SOC at that time, e.g. 1.0 for a full battery.
+    use_reserve : bool
+        Allow the outage to use the reserve.
+
+    Returns
+    -------
+    result : dict of 1-d numpy arrays
+        'hours_to_empty' until the first hour the load could not be covered
+        (fractional, np.inf if it lasts max_hours), and 'censored' where the
+        data ends before the outage could fail or reach max_hours.
+    """
+    production = np.nan_to_num(np.asarray(data['production'], dtype=float))
+    consumption = np.nan_to_num(np.asarray(data['consumption'], dtype=float))
+    N = len(production)
+    interval_hours = data.get('interval_hours', 1.0)
+    L = int(np.ceil(max_hours/interval_hours))
+
+    E0, capacity = start_energy(data, use_reserve)
+    if SOC is not None:
+        E0 = np.full((N,), float(SOC)*capacity)
+
+    net = production - consumption
+    if not recharge:
+        # cumulative deficit, D[t] - D[s] is the load not met by solar
+        # over intervals s..t-1
+        D = np.concatenate([[0.0], np.cumsum(np.maximum(-net, 0.0))])
+        s = np.arange(N)
+        # number of whole intervals covered from each start
+        m = np.searchsorted(D, D[:N] + E0, side='right') - 1 - s
+        m = np.minimum(m, N - s)
+        # fraction of the failing interval still covered
+        fail = s + m
+        inside = fail < N
+        used = D[np.minimum(fail, N)] - D[:N]
+        frac = np.zeros((N,))
+        deficit = -net[fail[inside]]
+        frac[inside] = (E0[inside] - used[inside])/deficit
+        steps = np.where(inside, m + frac, np.inf)
+        # covered to the end of the data but for less than max_hours
+        censored = ~inside & (N - s < L)
+    else:
+        C = np.concatenate([[0.0], np.cumsum(net)])
+        steps = np.full((N,), np.inf)
+        alive = np.ones((N,), dtype=bool)
+        S_max = np.full((N,), -np.inf)
+        E_prev = E0.copy()
+        for k in range(1, L+1):
+            end = np.arange(k, N+k)
+            valid = end <= N
+            S = np.where(valid, C[np.minimum(end, N)] - C[:N], 0.0)
+            np.maximum(S_max, S, out=S_max)
+            E = S + np.minimum(E0, capacity - S_max)
+            failed = alive & valid & (E < 0)
+            if failed.any():
+                i = np.flatnonzero(failed)
+                deficit = -net[i + k - 1]
+                steps[i] = k - 1 + E_prev[i]/deficit
+                alive[i] = False
+            E_prev = E
+            if not alive.any():
+                break
+        # not failed when the data ends before max_hours
+        censored = alive & (np.arange(N) + L > N)
+
+    hours = steps*interval_hours
+    hours[hours >= max_hours] = np.inf
+    return {'hours_to_empty': hours, 'censored': censored}
+
+
+def autonomy_matrix(result, lengths):
+    """
+    Start hour x outage length matrix: True where the battery and solar
+    carry the whole outage.  Censored starts are False.
+    """
+    lengths = np.asarray(lengths, dtype=float)
+    hours = np.where(result['censored'], -np.inf, result['hours_to_empty'])
+    return hours[:, None] >= lengths[None, :]
+
+
+def autonomy_table(data, result, lengths=(4, 12, 24, 48, 72), freq='M'):
+    """
+    Percent of outage start hours in each period (month by default) in
+    which the battery and solar carry an outage of each length.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        One row per period, one column per outage length (hours).
+    """
+    covered = autonomy_matrix(result, lengths)
+    ok = ~result['censored']
+    df = pd.DataFrame(100*covered[ok], index=pd.DatetimeIndex(data['dt'])[ok],
+                      columns=['%gh' % l for l in lengths])
+    return df.resample(freq).mean()
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+"""
+Run many battery model scenarios (years of data, battery parameters and the
+only_solar baseline) over a process pool.  The production and consumption
+arrays are put once in shared memory and every worker maps them instead of
+receiving a pickled copy with each scenario.
+
+Example
+-------
+    data = get_data()
+    scenarios = make_scenarios(data, battery_capacity=[10., 20.])
+    results = run_scenarios(data, scenarios, workers=8)
+"""
+
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+import battery_models
+
+# arrays shared with the workers, in row order of the shared block
+SHARED_COLUMNS = ('production', 'consumption')
+# model outputs summed for each scenario
+SUM_COLUMNS = ('production', 'consumption', 'self_consumption',
+               'from_battery', 'import', 'export')
+
+# set in each worker by _init_worker
+_shared = {}
+
+
+def year_slices(dt):
+    """ Index range of each calendar year in a time-sorted dt array.
+
+    Returns
+    -------
+    slices : dict
+        {year: (start, stop)} so that dt[start:stop] are all in that year.
+    """
+    years = pd.DatetimeIndex(dt).year.to_numpy()
+    uniq, start = np.unique(years, return_index=True)
+    stop = np.append(start[1:], len(years))
+    return {int(y): (int(a), int(b)) for y, a, b in zip(uniq, start, stop)}
+
+
+def make_scenarios(data, battery_capacity=(20.0,), battery_reserve=(0.20,),
+                   battery_c_rate=(0.80,), by_year=True, only_solar=True):
+    """ List every combination of year and battery parameters as a scenario.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Container with dt, production and consumption.
+    battery_capacity, battery_reserve, battery_c_rate : sequence of float
+        Battery parameters to combine.
+    by_year : bool
+        One scenario per calendar year in data['dt'], otherwise the whole
+        series as one period named 'all'.
+    only_solar : bool
+        Add the only_solar (no battery) baseline for each period.
+
+    Returns
+    -------
+    scenarios : list of dict
+        Each with 'period', 'start', 'stop', 'model' and battery parameters.
+    """
+    if by_year:
+        periods = year_slices(data['dt'])
+    else:
+        periods = {'all': (0, len(data['dt']))}
+    grid = battery_models.parameter_grid(battery_capacity, battery_reserve,
+                                         battery_c_rate)
+    scenarios = []
+    for period, (start, stop) in periods.items():
+        base = {'period': period, 'start': start, 'stop': stop}
+        if only_solar:
+            scenarios.append(dict(base, model='only_solar',
+                                  battery_capacity=0.0,
+                                  battery_reserve=0.0,
+                                  battery_c_rate=float(grid['battery_c_rate'][0])))
+        for cap, res, rate in zip(grid['battery_capacity'],
+                                  grid['battery_reserve'],
+                                  grid['battery_c_rate']):
+            scenarios.append(dict(base, model='maximize_self_consumption',
+                                  battery_capacity=float(cap),
+                                  battery_reserve=float(res),
+                                  battery_c_rate=float(rate)))
+    return scenarios
+
+
+def _init_worker(name, shape, interval_hours, keep_series):
+    """ Attach the shared input block once per worker process."""
+    shm = shared_memory.SharedMemory(name=name)
+    block = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    # keep a reference to the segment so the buffer stays mapped
+    _shared['shm'] = shm
+    _shared['interval_hours'] = interval_hours
+    _shared['keep_series'] = keep_series
+    for j, column in enumerate(SHARED_COLUMNS):
+        _shared[column] = block[j]
+
+
+def _run_scenario(scenario):
+    """ Run one scenario on the shared arrays (executed in a worker)."""
+    start, stop = scenario['start'], scenario['stop']
+    data = {column: _shared[column][start:stop] for column in SHARED_COLUMNS}
+    data['dt'] = np.arange(start, stop)
+    data['interval_hours'] = _shared['interval_hours']
+    data['battery_capacity'] = scenario['battery_capacity']
+    data['battery_reserve'] = scenario['battery_reserve']
+    data['battery_c_rate'] = scenario['battery_c_rate']
+    data['depth_of_discharge'] = 1 - scenario['battery_reserve']
+    model = getattr(battery_models, scenario['model'])
+    data = model(data)
+
+    result = dict(scenario)
+    for column in SUM_COLUMNS:
+        result[column] = float(np.nansum(data[column]))
+    # no consumption (e.g. a window of missing data) has no percentage,
+    # rather than a ZeroDivisionError that stops the whole pool
+    if result['consumption'] != 0:
+        result['self_consumption_pct'] = 100*result['self_consumption']/result['consumption']
+    else:
+        result['self_consumption_pct'] = np.nan
+    if _shared['keep_series']:
+        result['series'] = {k: data[k] for k in battery_models.SWEEP_SERIES}
+    return result
+
+
+def run_scenarios(data, scenarios, workers=None, chunksize=1,
+                  keep_series=False):
+    """ Run the scenarios over a process pool with shared input arrays.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Container with production and consumption (kWh).
+    scenarios : list of dict
+        As made by make_scenarios.
+    workers : int, optional
+        Number of worker processes, default os.cpu_count().
+    chunksize : int
+        Number of scenarios handed to a worker at a time.  Larger chunks
+        cut scheduling overhead when there are many short scenarios.
+    keep_series : bool
+        Also return the model time series of each scenario.
+
+    Returns
+    -------
+    results : list of dict
+        One per scenario, in the same order as scenarios, with the scenario
+        fields plus the summed energies (kWh) and 'self_consumption_pct'
+        (NaN without consumption).
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    N = len(data['production'])
+    shape = (len(SHARED_COLUMNS), N)
+    shm = shared_memory.SharedMemory(create=True,
+                                     size=max(1, shape[0]*N*8))
+    try:
+        block = np.ndarray(shape, dtype=float, buffer=shm.buf)
+        for j, column in enumerate(SHARED_COLUMNS):
+            block[j] = data[column]
+        # drop the view so the segment can be closed
+        del block
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(shm.name, shape,
+                                           data.get('interval_hours', 1.0),
+                                           keep_series)) as pool:
+            # map yields results in submission order whatever order the
+            # workers finish in
+            results = list(pool.map(_run_scenario, scenarios,
+                                    chunksize=chunksize))
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def results_to_frame(results):
+    """ Summary table of run_scenarios results (series are left out)."""
+    rows = [{k: v for k, v in r.items() if k != 'series'} for r in results]
+    return pd.DataFrame(rows)
@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+"""
+Helpers to keep the interactive plots fast on multi-year or 15 min data:
+min/max-preserving decimation of a series down to the pixel width of an
+axes, and a blit manager that redraws only the changing artists.
+"""
+
+import numpy as np
+
+
+def decimate_minmax(x, y, xmin=None, xmax=None, n_bins=1000):
+    """
+    Reduce a series to the visible range and at most 2*n_bins points.
+
+    The visible samples are split into n_bins runs of (nearly) equal length
+    and the minimum and maximum of each run are kept in time order, so
+    peaks and dips are drawn exactly as with the full series.
+
+    Parameters
+    ----------
+    x : 1-d array, sorted
+        Sample times (datetime64 or numbers).
+    y : 1-d array
+        Values, NaN values are skipped where a run has other values.
+    xmin, xmax : optional
+        Visible range, one sample either side is kept so lines reach the
+        edges of the axes.
+    n_bins : int
+        Number of runs, typically the pixel width of the axes.
+
+    Returns
+    -------
+    x, y : 1-d arrays
+        Decimated series.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y, dtype=float)
+    i, j = 0, len(x)
+    if xmin is not None:
+        i = max(np.searchsorted(x, np.asarray(xmin, dtype=x.dtype), side='left') - 1, 0)
+    if xmax is not None:
+        j = min(np.searchsorted(x, np.asarray(xmax, dtype=x.dtype), side='right') + 1, len(x))
+    x = x[i:j]
+    y = y[i:j]
+    n = len(x)
+    n_bins = max(int(n_bins), 1)
+    if n <= 2*n_bins:
+        return x, y
+
+    # runs of equal length L, padding the last one with values never picked
+    L = -(-n // n_bins)
+    nb = -(-n // L)
+    pad = nb*L - n
+    lo = np.append(np.where(np.isnan(y), np.inf, y), np.full(pad, np.inf))
+    hi = np.append(np.where(np.isnan(y), -np.inf, y), np.full(pad, -np.inf))
+    offset = np.arange(nb)*L
+    imin = lo.reshape(nb, L).argmin(axis=1) + offset
+    imax = hi.reshape(nb, L).argmax(axis=1) + offset
+    # keep both in time order, once when min and max are the same sample
+    idx = np.unique(np.concatenate([imin, imax]))
+    idx = idx[idx < n]
+    return x[idx], y[idx]
+
+
+class BlitManager:
+    """
+    Redraw only a set of animated artists on top of a cached background.
+
+    Call update() when only the artists changed; anything that changes the
+    axes themselves (limits, ticks) needs a full canvas draw, after which
+    the background is captured again on the draw event.
+    """
+
+    def __init__(self, canvas, artists=()):
+        self.canvas = canvas
+        self.background = None
+        self.artists = []
+        for artist in artists:
+            self.add_artist(artist)
+        self.cid = canvas.mpl_connect('draw_event', self.on_draw)
+
+    def add_artist(self, artist):
+        artist.set_animated(True)
+        self.artists.append(artist)
+
+    def on_draw(self, event):
+        """ Capture the background and draw the animated artists on it"""
+        self.background = self.canvas.copy_from_bbox(self.canvas.figure.bbox)
+        self._draw_animated()
+
+    def _draw_animated(self):
+        fig = self.canvas.figure
+        for artist in self.artists:
+            fig.draw_artist(artist)
+
+    def update(self):
+        """ Blit the animated artists, or draw everything if no background"""
+        if self.background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self._draw_animated()
+        self.canvas.blit(self.canvas.figure.bbox)
+        self.canvas.flush_events()
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Built-in instrumentation of the pipeline stages: timed spans with row
+counts, event counters (skipped lines, SOC clamped empty or full, cache
+hits) and, opt-in, the memory high-water mark of each span from
+tracemalloc.  Nothing is recorded until enable() is called; while disabled,
+span() returns one shared do-nothing context, functions decorated with
+profiled() are called straight through and count() returns at once, so the
+hooks in read_data, battery_models and run_plot cost next to nothing.
+Counters are added once per stage from the arrays, never per row.
+
+Example
+-------
+    import profiling
+    profiling.enable(memory=True)
+    data = run_model(get_data())
+    frames = build_frames(data)
+    print(profiling.summary_table())
+    profiling.to_json('profile.json')
+"""
+
+import json
+import time
+import functools
+import tracemalloc
+
+import pandas as pd
+
+_state = {'enabled': False, 'memory': False, 'spans': [], 'counters': {},
+          'stack': []}
+
+
+class _NullSpan:
+    """ Span used while profiling is disabled"""
+    __slots__ = ()
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """ Timed stage, set rows inside the with block when not known before"""
+    __slots__ = ('name', 'rows', 'start', 'seconds', 'depth', 'parent',
+                 'peak', 'child_peak')
+
+    def __init__(self, name, rows=None):
+        self.name = name
+        self.rows = rows
+        self.peak = None
+        self.child_peak = 0
+
+    def __enter__(self):
+        stack = _state['stack']
+        self.depth = len(stack)
+        self.parent = stack[-1].name if stack else None
+        if _state['memory'] and tracemalloc.is_tracing():
+            # keep the peak of the enclosing span before restarting it
+            if stack:
+                parent = stack[-1]
+                parent.child_peak = max(parent.child_peak,
+                                        tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        stack.append(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.seconds = time.perf_counter() - self.start
+        stack = _state['stack']
+        stack.pop()
+        if _state['memory'] and tracemalloc.is_tracing():
+            self.peak = max(self.child_peak, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].child_peak = max(stack[-1].child_peak, self.peak)
+        _state['spans'].append(self)
+        return False
+
+
+def enable(memory=False):
+    """ Start recording spans and counters, with memory high-water marks
+    (tracemalloc, slows allocations down) when memory is True."""
+    _state['enabled'] = True
+    _state['memory'] = memory
+    if memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def disable():
+    """ Stop recording, the records so far are kept"""
+    _state['enabled'] = False
+    if _state['memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['memory'] = False
+
+
+def reset():
+    """ Drop all recorded spans and counters"""
+    _state['spans'] = []
+    _state['counters'] = {}
+    _state['stack'] = []
+
+
+def enabled():
+    """ True while recording, e.g. to skip computing counts otherwise"""
+    return _state['enabled']
+
+
+def span(name, rows=None):
+    """ Context manager timing a stage, see Span"""
+    if not _state['enabled']:
+        return _NULL_SPAN
+    return Span(name, rows)
+
+
+def profiled(name, rows=None):
+    """
+    Decorator running a function in a span.
+
+    rows : callable, optional
+        Row count of the span from the function's return value.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            with Span(name) as s:
+                result = func(*args, **kwargs)
+                if rows is not None:
+                    s.rows = rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """ Add n to the counter name"""
+    if _state['enabled']:
+        _state['counters'][name] = _state['counters'].get(name, 0) + int(n)
+
+
+def report():
+    """
+    Recorded spans and counters.
+
+    Returns
+    -------
+    report : dict
+        'spans', a list of dicts (name, parent, depth, seconds, rows,
+        rows_per_s and peak_mb with memory) in the order they ended, and
+        'counters'.
+    """
+    spans = []
+    for s in _state['spans']:
+        record = {'name': s.name, 'parent': s.parent, 'depth': s.depth,
+                  'seconds': s.seconds, 'rows': s.rows}
+        record['rows_per_s'] = s.rows/s.seconds if s.rows and s.seconds > 0 else None
+        if s.peak is not None:
+            record['peak_mb'] = s.peak/2**20
+        spans.append(record)
+    return {'spans': spans, 'counters': dict(_state['counters'])}
+
+
+def to_json(fn=None):
+    """ report() as a JSON string, also written to fn when given"""
+    text = json.dumps(report(), indent=1)
+    if fn is not None:
+        with open(fn, 'w') as f:
+            f.write(text)
+    return text
+
+
+def summary_table():
+    """
+    Spans summed by name: calls, seconds, rows, rows/s and the largest
+    peak_mb, slowest first.  Counters are added as rows with only 'rows'.
+    """
+    rec = report()
+    spans = pd.DataFrame(rec['spans'], columns=['name', 'seconds', 'rows',
+                                                'peak_mb'])
+    table = spans.groupby('name').agg(calls=('seconds', 'size'),
+                                      seconds=('seconds', 'sum'),
+                                      rows=('rows', 'sum'),
+                                      peak_mb=('peak_mb', 'max'))
+    table['rows_per_s'] = table['rows'].where(table['rows'] > 0)/table['seconds']
+    table = table.sort_values('seconds', ascending=False)
+    counters = pd.DataFrame({'rows': pd.Series(rec['counters'], dtype=float)})
+    counters.index.name = 'name'
+    return pd.concat([table, counters])
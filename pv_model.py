@@ -0,0 +1,290 @@
+# -*- coding: utf-8 -*-
+"""
+Modeled PV production, as an alternative to the measured production of
+the SolarEdge exports: production of a system of any size, tilt and
+azimuth, without a measured history.
+
+For every interval, at its midpoint:
+
+* solar position from the NOAA (Spencer) declination and equation of time
+* clear-sky global horizontal irradiance (Haurwitz), reduced for cloud
+  cover (Kasten-Czeplak) when a weather file is given
+* split into direct and diffuse parts (Erbs) and transposed to the plane of
+  the array (isotropic sky, with ground reflection)
+* DC power of the array with a cell temperature (NOCT) correction, the
+  system losses and an optional inverter limit
+
+All steps are numpy expressions over the whole time axis, so years of
+15 min production are one array pass.  Timestamps are the start of each
+interval in local clock time, as the exports, which follow daylight
+saving (02:00 is missing on the spring-forward days).  The UTC offset of
+every timestamp comes from the IANA timezone of the system, or is the
+fixed utc_offset (standard time all year) when the timezone is None.
+
+PV_SYSTEM is a placeholder, not the system of the exports: set the size,
+location, timezone and orientation of yours before comparing modeled
+with measured production.
+
+Weather CSV
+-----------
+The first column is the time, the others are picked by name (case,
+spaces and units in parentheses ignored): cloud_cover (0..1, or percent
+when above 1), optional temp_air (deg C) and optional ghi (W/m2, used
+instead of the clear-sky model when present).  Values are interpolated
+to the model intervals.
+
+Example
+-------
+    weather = read_weather('./weather.csv')
+    data = modeled_data('2023-01-01', '2024-01-01', 'hourly',
+                        dict(PV_SYSTEM, pv_kw=8.0), weather)
+    data = with_modeled_production(get_data(), PV_SYSTEM, weather)
+"""
+
+import numpy as np
+import pandas as pd
+
+from read_data import INTERVAL_HOURS, find_gaps
+
+# placeholder system: 6.21 kW facing south at an example location, the
+# location and orientation are not those of the measured system
+PV_SYSTEM = {'pv_kw': 6.21,         # DC size (kW)
+             'latitude': 35.0,      # degrees north
+             'longitude': -106.0,   # degrees east
+             'timezone': 'America/Denver',  # IANA name, None: utc_offset
+             'utc_offset': -7.0,    # hours, local standard time
+             'tilt': 25.0,          # degrees from horizontal
+             'azimuth': 180.0,      # degrees clockwise from north
+             'albedo': 0.2,
+             'losses': 0.14,        # wiring, soiling, inverter, mismatch
+             'temp_coeff': -0.004,  # power per deg C of cell temperature
+             'noct': 45.0,          # cell temperature (C) at 800 W/m2, 20 C
+             'ac_kw': None}         # inverter limit (kW), none if None
+
+SOLAR_CONSTANT = 1367.0  # W/m2
+
+# weather columns, by the name the CSV header is reduced to
+WEATHER_COLUMNS = {'cloud_cover': 'cloud_cover', 'cloudcover': 'cloud_cover',
+                   'clouds': 'cloud_cover', 'temp_air': 'temp_air',
+                   'temperature': 'temp_air', 'temp': 'temp_air',
+                   'ghi': 'ghi'}
+
+
+def solar_position(dt, latitude, longitude, utc_offset):
+    """
+    Solar position at local times, utc_offset (hours) a scalar or one
+    offset per time (see utc_offsets).
+
+    Returns
+    -------
+    zenith, azimuth : numpy arrays
+        Degrees, azimuth clockwise from north.
+    """
+    dt = np.asarray(dt, dtype='datetime64[ns]')
+    year = dt.astype('datetime64[Y]')
+    day = (dt - year).astype('timedelta64[s]').astype(float)/86400
+    hour = 24*(day % 1)
+    gamma = 2*np.pi/365*(np.floor(day) + (hour - 12)/24)
+    eot = 229.18*(0.000075 + 0.001868*np.cos(gamma) - 0.032077*np.sin(gamma)
+                  - 0.014615*np.cos(2*gamma) - 0.040849*np.sin(2*gamma))
+    decl = (0.006918 - 0.399912*np.cos(gamma) + 0.070257*np.sin(gamma)
+            - 0.006758*np.cos(2*gamma) + 0.000907*np.sin(2*gamma)
+            - 0.002697*np.cos(3*gamma) + 0.00148*np.sin(3*gamma))
+    # true solar time (minutes) and hour angle
+    solar_minutes = 60*hour + eot + 4*longitude - 60*utc_offset
+    hour_angle = np.radians(solar_minutes/4 - 180)
+    phi = np.radians(latitude)
+    cos_zenith = np.clip(np.sin(phi)*np.sin(decl) +
+                         np.cos(phi)*np.cos(decl)*np.cos(hour_angle), -1, 1)
+    zenith = np.degrees(np.arccos(cos_zenith))
+    azimuth = np.degrees(np.arctan2(np.sin(hour_angle),
+                                    np.cos(hour_angle)*np.sin(phi) -
+                                    np.tan(decl)*np.cos(phi))) + 180
+    return zenith, azimuth
+
+
+def utc_offsets(dt, system):
+    """
+    UTC offset (hours) of local clock times: from the IANA timezone of the
+    system, with daylight saving, or its fixed utc_offset without one.
+    The repeated hour of the fall-back day is taken as standard time.
+    """
+    if system.get('timezone') is None:
+        return system['utc_offset']
+    local = pd.DatetimeIndex(np.asarray(dt, dtype='datetime64[ns]'))
+    aware = local.tz_localize(system['timezone'],
+                              ambiguous=np.zeros((len(local),), dtype=bool),
+                              nonexistent='shift_forward')
+    offset = aware.tz_localize(None).values - aware.tz_convert(None).values
+    return offset.astype('timedelta64[s]').astype(float)/3600
+
+
+def extraterrestrial(dt):
+    """ Irradiance at the top of the atmosphere (W/m2) on a normal surface"""
+    dt = np.asarray(dt, dtype='datetime64[ns]')
+    doy = (dt.astype('datetime64[D]') - dt.astype('datetime64[Y]')).astype(float)
+    return SOLAR_CONSTANT*(1 + 0.033*np.cos(2*np.pi*doy/365))
+
+
+def clear_sky_ghi(zenith):
+    """ Clear-sky global horizontal irradiance (W/m2), Haurwitz model"""
+    cos_zenith = np.cos(np.radians(zenith))
+    ghi = np.zeros_like(cos_zenith)
+    up = cos_zenith > 0
+    ghi[up] = 1098*cos_zenith[up]*np.exp(-0.059/cos_zenith[up])
+    return ghi
+
+
+def cloudy_ghi(ghi_clear, cloud_cover):
+    """ Global horizontal irradiance under a cloud cover fraction (0..1),
+    Kasten-Czeplak"""
+    return ghi_clear*(1 - 0.75*np.clip(cloud_cover, 0, 1)**3.4)
+
+
+def erbs(ghi, zenith, dni_extra):
+    """
+    Direct normal and diffuse horizontal parts of the global horizontal
+    irradiance, Erbs diffuse fraction.
+
+    Returns
+    -------
+    dni, dhi : numpy arrays
+        W/m2.
+    """
+    cos_zenith = np.cos(np.radians(zenith))
+    # low sun: all diffuse, avoids dividing by a cos_zenith near 0
+    up = zenith < 87
+    kt = np.zeros_like(ghi)
+    kt[up] = np.clip(ghi[up]/(dni_extra[up]*cos_zenith[up]), 0, 1)
+    fraction = np.where(kt <= 0.22, 1 - 0.09*kt,
+                        np.where(kt <= 0.8,
+                                 0.9511 - 0.1604*kt + 4.388*kt**2 -
+                                 16.638*kt**3 + 12.336*kt**4,
+                                 0.165))
+    fraction[~up] = 1.0
+    dhi = fraction*ghi
+    dni = np.zeros_like(ghi)
+    dni[up] = (ghi[up] - dhi[up])/cos_zenith[up]
+    return dni, dhi
+
+
+def poa_irradiance(ghi, dni, dhi, zenith, azimuth, tilt, surface_azimuth,
+                   albedo=0.2):
+    """ Irradiance (W/m2) on the plane of the array, isotropic sky"""
+    zen = np.radians(zenith)
+    t = np.radians(tilt)
+    cos_aoi = (np.cos(zen)*np.cos(t) + np.sin(zen)*np.sin(t) *
+               np.cos(np.radians(azimuth - surface_azimuth)))
+    beam = dni*np.clip(cos_aoi, 0, None)
+    sky = dhi*(1 + np.cos(t))/2
+    ground = ghi*albedo*(1 - np.cos(t))/2
+    return beam + sky + ground
+
+
+def read_weather(inFile):
+    """
+    Read a weather CSV (see the module docstring).
+
+    Returns
+    -------
+    weather : dict of 1-d numpy arrays
+        'dt' (datetime64[ns]) and the weather columns found, sorted by time.
+    """
+    df = pd.read_csv(inFile)
+    weather = {'dt': pd.to_datetime(df.iloc[:, 0]).values.astype('datetime64[ns]')}
+    for column in df.columns[1:]:
+        name = column.split('(')[0].strip().lower().replace(' ', '_')
+        if name in WEATHER_COLUMNS:
+            weather[WEATHER_COLUMNS[name]] = df[column].values.astype(float)
+    if 'cloud_cover' not in weather and 'ghi' not in weather:
+        raise ValueError('%s has no cloud_cover or ghi column' % inFile)
+    if 'cloud_cover' in weather and np.nanmax(weather['cloud_cover']) > 1:
+        # percent
+        weather['cloud_cover'] = weather['cloud_cover']/100
+    order = np.argsort(weather['dt'], kind='stable')
+    return {name: values[order] for name, values in weather.items()}
+
+
+def weather_at(weather, dt, name):
+    """ Weather column interpolated to the times dt, None if not in weather"""
+    if weather is None or name not in weather:
+        return None
+    t = weather['dt'].astype('int64').astype(float)
+    values = weather[name]
+    ok = ~np.isnan(values)
+    return np.interp(np.asarray(dt, dtype='datetime64[ns]').astype('int64').astype(float),
+                     t[ok], values[ok])
+
+
+def model_production(dt, interval_hours=1.0, system=PV_SYSTEM, weather=None):
+    """
+    Modeled PV production of the intervals starting at dt.
+
+    Parameters
+    ----------
+    dt : 1-d array of datetime64
+        Start of each interval, local clock time.
+    interval_hours : float
+        Length of the intervals.
+    system : dict
+        PV system, see PV_SYSTEM.
+    weather : dict, optional
+        Weather of read_weather, clear sky without it.
+
+    Returns
+    -------
+    production : 1-d numpy array
+        kWh per interval.
+    """
+    step = np.timedelta64(int(round(interval_hours*3600)), 's')
+    mid = np.asarray(dt, dtype='datetime64[ns]') + step//2
+    zenith, azimuth = solar_position(mid, system['latitude'],
+                                     system['longitude'],
+                                     utc_offsets(mid, system))
+    ghi = weather_at(weather, mid, 'ghi')
+    if ghi is None:
+        ghi = clear_sky_ghi(zenith)
+        cloud_cover = weather_at(weather, mid, 'cloud_cover')
+        if cloud_cover is not None:
+            ghi = cloudy_ghi(ghi, cloud_cover)
+    else:
+        ghi = np.where(zenith < 90, np.clip(ghi, 0, None), 0.0)
+    dni, dhi = erbs(ghi, zenith, extraterrestrial(mid))
+    poa = poa_irradiance(ghi, dni, dhi, zenith, azimuth, system['tilt'],
+                         system['azimuth'], system['albedo'])
+
+    temp_air = weather_at(weather, mid, 'temp_air')
+    if temp_air is None:
+        temp_air = 20.0
+    temp_cell = temp_air + poa/800*(system['noct'] - 20)
+    power = (system['pv_kw']*poa/1000*(1 - system['losses']) *
+             (1 + system['temp_coeff']*(temp_cell - 25)))
+    power = np.clip(power, 0, system['ac_kw'])
+    return power*interval_hours
+
+
+def modeled_data(start, end, interval='hourly', system=PV_SYSTEM,
+                 weather=None):
+    """
+    Modeled production from start up to end, in the dict layout of
+    get_data (without consumption, add a measured or synthetic one before
+    running a battery model).
+    """
+    interval_hours = INTERVAL_HOURS[interval]
+    dt = pd.date_range(start, end, freq=pd.Timedelta(hours=interval_hours),
+                       inclusive='left').values.astype('datetime64[ns]')
+    return {'dt': dt,
+            'production': model_production(dt, interval_hours, system, weather),
+            'interval': interval, 'interval_hours': interval_hours,
+            'gaps': find_gaps(dt, interval_hours)}
+
+
+def with_modeled_production(data, system=PV_SYSTEM, weather=None):
+    """ Copy of a get_data dict with the measured production replaced by
+    modeled production on the same intervals, e.g. to try another array
+    size with the measured consumption."""
+    data = dict(data)
+    data['production'] = model_production(data['dt'],
+                                          data.get('interval_hours', 1.0),
+                                          system, weather)
+    return data
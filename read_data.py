@@ -6,8 +6,11 @@ Created on Sat Jun 15 17:03:22 2024
 """
 
 import os
+import io
 import glob
 import re
+import json
+import hashlib
 
 import time
 import datetime
@@ -15,8 +18,31 @@ import datetime
 import numpy as np
 import pandas as pd
 
+import profiling
+
 REAL_RE_STR = '\\s*(-?\\d(\\.\\d+|)[Ee][+\\-]\\d\\d?|-?(\\d+\\.\\d*|\\d*\\.\\d+)|-?\\d+)\\s*'
 
+# columns of the SolarEdge export picked by header name
+TIME_COLUMN = 'Time'
+CONSUMPTION_COLUMN = 'Consumption Meter E (Wh)'
+PRODUCTION_COLUMN = 'Inv1 Eac (Wh)'
+TIME_FORMAT = '%m/%d/%Y %H:%M'
+
+# length in hours of the samples in each export interval
+INTERVAL_HOURS = {'15 min': 0.25, 'hourly': 1.0, 'daily': 24.0, 'weekly': 168.0}
+
+# parsed columns cached per source file under {indir}/CACHE_DIR
+CACHE_DIR = '.cache'
+CACHE_COLUMNS = ('dt', 'consumption', 'production')
+# format of the cached columns, part of the cache key: raise it whenever the
+# parsed columns or their dtypes change so old entries are not loaded
+CACHE_VERSION = 2
+# coverage index of the exports in {indir}/CACHE_DIR, with the byte offset
+# and timestamp of every COVERAGE_STRIDE-th row of each file
+COVERAGE_FILE = 'coverage.json'
+COVERAGE_STRIDE = 1024
+
+@profiling.profiled('load_data', rows=len)
 def load_data(inFile):
     lines=None
     if os.path.exists(inFile):
@@ -79,6 +105,7 @@ def uniqify(seq):
         result.append(item)
     return result
 
+@profiling.profiled('parse_data_regexp', rows=lambda data: len(data['dt']))
 def parse_data_regexp(lines, data):
     """
     Parse data using Regular Expressions (regexp, or re)
@@ -99,14 +126,16 @@ def parse_data_regexp(lines, data):
     
     # how many samples 
     N = len(lines)
-    data['dt'] = np.array(np.ones((N,), dtype=object)*np.nan)
+    # datetime64 (8 bytes a row) instead of datetime objects, NaT until set
+    data['dt'] = np.full((N,), np.datetime64('NaT'), dtype='datetime64[ns]')
     # data['time'] = np.array(np.ones((N,), dtype=int)*np.nan)
     # default fill to zeros and not NaN 
     data['consumption'] = np.array(np.zeros((N,), dtype=float))
     data['production'] = np.array(np.zeros((N,), dtype=float))
     
-    # sample count
+    # sample count, and lines skipped (counted once, after the loop)
     i = 0
+    skipped = 0
     for line in lines:
         csi = []
         # remove double quotes
@@ -117,6 +146,7 @@ def parse_data_regexp(lines, data):
         sw = re.split(',', line)
         if len(sw)<=0:
             print(' ... skipping line %d -- %s' % (i,line))
+            skipped += 1
             continue
         # parse data float and integers
         for s in sw[1:5]:
@@ -128,7 +158,7 @@ def parse_data_regexp(lines, data):
         # parse the date and time
         sample_dt = scanf_datetime(sw[0], fmt='%m/%d/%Y %H:%M')
         
-        data['dt'][i] = sample_dt # sample datetime
+        data['dt'][i] = np.datetime64(sample_dt, 'ns') # sample datetime
         # data['time'][i] = dt2es(sample_dt) # sample time in epoch seconds
         if len(csi)==4:
             data['consumption'][i] = csi[0]/1000 # Energy consumption (kWh)
@@ -138,11 +168,133 @@ def parse_data_regexp(lines, data):
             i=i+1
         else:
             print(' ... skipping line %d -- %s ' % (i,line))
+            skipped += 1
             continue
+    if skipped:
+        profiling.count('skipped_lines', skipped)
+    # where production is NaN set to zero
+    data['production'][np.isnan(data['production'])]=0
+    return data
+
+@profiling.profiled('parse_data_csv', rows=lambda data: len(data['dt']))
+def parse_data_csv(inFile):
+    """
+    Parse a whole SolarEdge export into typed columns in one pass.
+
+    Columns are picked by header name (CONSUMPTION_COLUMN, PRODUCTION_COLUMN)
+    rather than position, and the '%m/%d/%Y %H:%M' timestamps are converted
+    in one vectorized call.  Quoted values are unquoted by the csv reader.
+    Like parse_data_regexp, a blank consumption stays NaN, a blank
+    production is set to zero, and energy is converted from Wh to kWh.
+    Rows with a timestamp that can not be parsed are skipped.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        'dt' (datetime64), 'consumption' and 'production' (kWh).
+    """
+    try:
+        df = pd.read_csv(inFile,
+                         usecols=[TIME_COLUMN, CONSUMPTION_COLUMN, PRODUCTION_COLUMN],
+                         dtype={TIME_COLUMN: str})
+    except pd.errors.EmptyDataError:
+        print('Empty file: '+ inFile)
+        df = pd.DataFrame({TIME_COLUMN: [], CONSUMPTION_COLUMN: [],
+                           PRODUCTION_COLUMN: []}, dtype=str)
+
+    dt = pd.to_datetime(df[TIME_COLUMN].str.strip(), format=TIME_FORMAT,
+                        errors='coerce')
+    good = dt.notna().to_numpy()
+    if not good.all():
+        profiling.count('skipped_lines', np.count_nonzero(~good))
+        for i in np.flatnonzero(~good):
+            print(' ... skipping line %d -- %s ' % (i, df[TIME_COLUMN].iloc[i]))
+
+    data = {}
+    data['dt'] = dt.to_numpy()[good]
+    for var, column in (('consumption', CONSUMPTION_COLUMN),
+                        ('production', PRODUCTION_COLUMN)):
+        values = df[column]
+        if values.dtype == object:
+            # non-numeric fields become NaN, as with REAL_RE_STR
+            values = pd.to_numeric(values.str.strip(), errors='coerce')
+        data[var] = values.to_numpy(dtype=float)[good]/1000 # Energy (kWh)
     # where production is NaN set to zero
     data['production'][np.isnan(data['production'])]=0
     return data
 
+def file_fingerprint(inFile, content_hash=True):
+    """ Path, size, mtime and (optionally) sha1 of the content of a file"""
+    st = os.stat(inFile)
+    fp = {'path': os.path.abspath(inFile),
+          'size': st.st_size,
+          'mtime_ns': st.st_mtime_ns}
+    if content_hash:
+        h = hashlib.sha1()
+        with open(inFile, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                h.update(block)
+        fp['sha1'] = h.hexdigest()
+    return fp
+
+def parse_data_cached(inFile, cache_dir=None):
+    """
+    parse_data_csv with an on-disk cache of the parsed columns.
+
+    Each source file has one cache entry per CACHE_VERSION, a directory of
+    .npy columns plus the fingerprint (path, size, mtime, content sha1) it
+    was parsed from.
+    An entry is used when size and mtime match, or when only the mtime
+    changed but the content hash is the same; otherwise the file is parsed
+    again and the entry rewritten.  Cached columns are memory-mapped.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        As parse_data_csv, columns are read-only memory maps when cached.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(inFile), CACHE_DIR)
+    fp = file_fingerprint(inFile, content_hash=False)
+    key = hashlib.sha1(('v%d:%s' % (CACHE_VERSION, fp['path'])).encode('utf-8')).hexdigest()
+    entry = os.path.join(cache_dir, key)
+    meta_fn = os.path.join(entry, 'meta.json')
+
+    meta = None
+    if os.path.exists(meta_fn):
+        with open(meta_fn, 'r') as f:
+            meta = json.load(f)
+    if meta is not None and meta['size'] == fp['size']:
+        valid = meta['mtime_ns'] == fp['mtime_ns']
+        if not valid:
+            # touched but maybe not changed, compare content
+            fp = file_fingerprint(inFile)
+            valid = meta.get('sha1') == fp['sha1']
+            if valid:
+                with open(meta_fn, 'w') as f:
+                    json.dump(fp, f)
+        if valid:
+            try:
+                profiling.count('cache_hits')
+                return {var: np.load(os.path.join(entry, var+'.npy'),
+                                     mmap_mode='r')
+                        for var in CACHE_COLUMNS}
+            except (OSError, ValueError):
+                # damaged entry, parse again below
+                pass
+
+    profiling.count('cache_misses')
+    data = parse_data_csv(inFile)
+    if 'sha1' not in fp:
+        fp = file_fingerprint(inFile)
+    os.makedirs(entry, exist_ok=True)
+    for var in CACHE_COLUMNS:
+        np.save(os.path.join(entry, var+'.npy'), data[var])
+    # write the fingerprint last so a partly written entry is never valid
+    with open(meta_fn, 'w') as f:
+        json.dump(fp, f)
+    return data
+
 def to_series(data):
     """ 
     convert the data as nparray to Pandas Dataframe 
@@ -179,14 +331,248 @@ def to_series(data):
     return df
 
     
-def get_data(indir='./data', interval='hourly', data={}):   
+@profiling.profiled('merge_exports', rows=lambda merged: len(merged['dt']))
+def merge_exports(parsed):
+    """
+    Merge parsed exports into one time-sorted series, one row per timestamp.
+
+    Rows are matched on their parsed timestamps, so overlapping exports
+    that differ only in quoting or trailing fields still merge.  When a
+    timestamp is in more than one file the row of the latest file (last
+    in the list) is kept.  Values are gathered file by file into the
+    output arrays, so beside the output only the timestamps are held for
+    all rows.
+
+    Parameters
+    ----------
+    parsed : list of dict of 1-d numpy arrays
+        Output of parse_data_csv (or parse_data_cached) in file order.
+
+    Returns
+    -------
+    data : dict of 1-d numpy arrays
+        'dt', 'consumption' and 'production', plus 'duplicates' (rows
+        dropped) and 'conflicts' (dropped rows whose values differed from
+        the kept row).
+    """
+    sizes = [len(p['dt']) for p in parsed]
+    offsets = np.concatenate([[0], np.cumsum(sizes)]).astype(int)
+    if offsets[-1] == 0:
+        return {'dt': np.array([], dtype='datetime64[ns]'),
+                'consumption': np.array([]), 'production': np.array([]),
+                'duplicates': 0, 'conflicts': 0}
+    ts = np.concatenate([np.asarray(p['dt'], dtype='datetime64[ns]').view('int64')
+                         for p in parsed])
+    # stable sort keeps file order within equal timestamps
+    order = np.argsort(ts, kind='stable')
+    ts = ts[order]
+    last = np.append(ts[1:] != ts[:-1], True)
+    keep = order[last]
+    dropped = order[~last]
+    # the row kept for each dropped row is the last of its run of timestamps
+    winner = keep[np.searchsorted(np.flatnonzero(last), np.flatnonzero(~last))]
+    del order
+
+    def gather(var, rows):
+        """ Values of var at global row numbers rows, file by file"""
+        out = np.empty((len(rows),), dtype=float)
+        f = np.searchsorted(offsets[1:], rows, side='right')
+        for j, p in enumerate(parsed):
+            m = f == j
+            if m.any():
+                out[m] = np.asarray(p[var])[rows[m] - offsets[j]]
+        return out
+
+    data = {'dt': ts[last].view('datetime64[ns]')}
+    conflicts = np.zeros((len(dropped),), dtype=bool)
+    for var in ('consumption', 'production'):
+        data[var] = gather(var, keep)
+        a = gather(var, dropped)
+        b = gather(var, winner)
+        conflicts |= ~((a == b) | (np.isnan(a) & np.isnan(b)))
+    data['duplicates'] = int(len(dropped))
+    data['conflicts'] = int(conflicts.sum())
+    return data
+
+def find_gaps(dt, interval_hours=1.0):
+    """
+    Missing stretches in a time-sorted dt array.
+
+    Returns
+    -------
+    gaps : (n, 2) numpy array of datetime64
+        Last timestamp before and first timestamp after each gap longer
+        than one interval.
+    """
+    dt = np.asarray(dt, dtype='datetime64[ns]')
+    step = np.timedelta64(int(round(interval_hours*3600)), 's')
+    i = np.flatnonzero(np.diff(dt) > step)
+    return np.stack([dt[i], dt[i+1]], axis=1)
+
+def scan_coverage(inFile, stride=COVERAGE_STRIDE):
+    """
+    Coverage of one export: first and last timestamp, row count, and the
+    byte offset and timestamp of every stride-th row.  Only the timestamps
+    of those rows are parsed.
+
+    Returns
+    -------
+    entry : dict
+        'size', 'mtime_ns', 'header' (first line), 'rows', 'first' and
+        'last' (datetime64[ns] as int64, None if no row has a valid time),
+        and 'rows_at', 'offsets', 'times' of the indexed rows, ending with
+        the end of the file.
+    """
+    st = os.stat(inFile)
+    with open(inFile, 'rb') as f:
+        raw = f.read()
+    buf = np.frombuffer(raw, dtype=np.uint8)
+    ends = np.flatnonzero(buf == ord('\n')) + 1
+    starts = np.concatenate([[0], ends[ends < len(raw)]])
+    header = raw[:starts[1]] if len(starts) > 1 else raw
+    starts = starts[1:]
+    rows = len(starts)
+
+    def time_at(i):
+        line = raw[starts[i]:starts[i]+64].split(b',', 1)[0]
+        return line.decode('utf-8', 'replace').strip().strip('"')
+
+    rows_at = np.arange(0, rows, stride)
+    if rows:
+        rows_at = np.append(rows_at, rows-1) if rows_at[-1] != rows-1 else rows_at
+    times = pd.to_datetime(pd.Series([time_at(i) for i in rows_at], dtype=object),
+                           format=TIME_FORMAT, errors='coerce')
+    ns = times.to_numpy(dtype='datetime64[ns]').view('int64')
+    valid = times.notna().to_numpy()
+    entry = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns,
+             'header': header.decode('utf-8'), 'rows': int(rows),
+             'first': int(ns[valid].min()) if valid.any() else None,
+             'last': int(ns[valid].max()) if valid.any() else None}
+    if valid.all() and np.all(np.diff(ns) >= 0):
+        # rows in time order: seek to any indexed row, the last indexed
+        # row is only kept for its timestamp
+        entry['rows_at'] = rows_at[:-1].tolist() if rows > 1 else rows_at.tolist()
+        entry['offsets'] = starts[entry['rows_at']].tolist()
+        entry['times'] = ns[:len(entry['rows_at'])].tolist()
+    else:
+        # unsorted or damaged times: the file is always read whole
+        entry['rows_at'] = [0] if rows else []
+        entry['offsets'] = starts[:1].tolist()
+        entry['times'] = [entry['first']] if rows else []
+    entry['rows_at'].append(int(rows))
+    entry['offsets'].append(len(raw))
+    return entry
+
+def coverage_index(indir='./data', interval='hourly', save=True):
+    """
+    Coverage of every export of an interval in indir, see scan_coverage.
+
+    The index is kept in {indir}/.cache/coverage.json and only new or
+    changed files (size or mtime) are scanned again.
+
+    Returns
+    -------
+    index : dict
+        {file name: entry} in file order.
+    """
+    fn_index = os.path.join(indir, CACHE_DIR, COVERAGE_FILE)
+    saved = {}
+    if os.path.exists(fn_index):
+        try:
+            with open(fn_index, 'r') as f:
+                saved = json.load(f)
+        except ValueError:
+            saved = {}
+    index = {}
+    changed = False
+    for fn in get_filenames(indir, interval):
+        name = os.path.basename(fn)
+        st = os.stat(fn)
+        entry = saved.get(name)
+        if entry is None or entry['size'] != st.st_size or \
+           entry['mtime_ns'] != st.st_mtime_ns:
+            entry = scan_coverage(fn)
+            changed = True
+        index[name] = entry
+    if save and changed:
+        # keep the entries of the other intervals
+        saved.update(index)
+        os.makedirs(os.path.dirname(fn_index), exist_ok=True)
+        with open(fn_index+'.tmp', 'w') as f:
+            json.dump(saved, f)
+        os.replace(fn_index+'.tmp', fn_index)
+    return index
+
+def read_rows(inFile, entry, start=None, end=None):
+    """
+    Parse only the part of an export that can hold times in [start, end),
+    from the byte offsets of its coverage entry.  The result may hold a
+    few rows either side of the range.
+    """
+    times = np.asarray(entry['times'], dtype='int64')
+    n = len(times)
+    i = 0 if start is None else max(np.searchsorted(times, start, side='left') - 1, 0)
+    j = n if end is None else np.searchsorted(times, end, side='left')
+    offsets = entry['offsets']
+    if n == 0 or j <= i:
+        return parse_data_csv(io.StringIO(entry['header']))
+    with open(inFile, 'rb') as f:
+        f.seek(offsets[i])
+        chunk = f.read(offsets[j] - offsets[i])
+    return parse_data_csv(io.BytesIO(entry['header'].encode('utf-8') + chunk))
+
+@profiling.profiled('get_data', rows=lambda data: len(data['dt']))
+def get_data(indir='./data', interval='hourly', data={}, cache=True,
+             start=None, end=None):   
+     """ Read and parse all export files for an interval into data.
+
+     Files are parsed with parse_data_csv and merged on their timestamps
+     with merge_exports: the result is sorted in time with one row per
+     timestamp, and where exports overlap the latest file wins.  With
+     cache, parsed columns are kept in {indir}/.cache and only new or
+     changed files are parsed (see parse_data_cached).  The interval and
+     its length in hours ('interval_hours') are stored with the data for
+     the models and plots, and missing stretches in 'gaps' (see find_gaps).
+
+     With start and/or end only the rows in [start, end) are returned:
+     the coverage index (see coverage_index) picks the files that overlap
+     the range and the byte ranges of their rows, and only those are read
+     (without the parsed-column cache).
+     """
      fns=get_filenames(indir, interval)
-     lines=[]
-     for fn in fns:
-         lines.extend(load_data(fn))
-     # remove any duplicate lines 
-     lines=uniqify(lines)
-     data=parse_data_regexp(lines, data)
+     if start is not None or end is not None:
+         t0 = None if start is None else pd.Timestamp(start).value
+         t1 = None if end is None else pd.Timestamp(end).value
+         index = coverage_index(indir, interval, save=cache)
+         parsed = []
+         for fn in fns:
+             entry = index[os.path.basename(fn)]
+             if entry['first'] is None or \
+                (t1 is not None and entry['first'] >= t1) or \
+                (t0 is not None and entry['last'] < t0):
+                 continue
+             part = read_rows(fn, entry, t0, t1)
+             ns = part['dt'].astype('datetime64[ns]').view('int64')
+             keep = np.ones((len(ns),), dtype=bool)
+             if t0 is not None:
+                 keep &= ns >= t0
+             if t1 is not None:
+                 keep &= ns < t1
+             parsed.append({var: part[var][keep] for var in CACHE_COLUMNS})
+     elif cache:
+         parsed=[parse_data_cached(fn, os.path.join(indir, CACHE_DIR))
+                 for fn in fns]
+     else:
+         parsed=[parse_data_csv(fn) for fn in fns]
+     merged=merge_exports(parsed)
+     del parsed
+     if merged['conflicts'] > 0:
+         print(' ... %d timestamps in more than one file with different '
+               'values, kept the latest file' % merged['conflicts'])
+     data['dt']=merged['dt']
+     data['consumption']=merged['consumption']
+     data['production']=merged['production']
+     data['interval']=interval
+     data['interval_hours']=INTERVAL_HOURS[interval]
+     data['gaps']=find_gaps(data['dt'], data['interval_hours'])
      return data
- 
-
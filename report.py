@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+"""
+Headless batch report of the battery model, e.g. for nightly runs on a
+server.  For each input directory it writes a summary table of all battery
+configurations, tables of energy sums per period and, on request, static
+figures of every period.  matplotlib is only imported when figures are
+rendered.
+
+Example
+-------
+    python report.py --indir ./data --capacity 0 10 20 --reserve 0.2 \\
+        --period month year --figures --outdir ./report
+    python report.py --profile --profile-memory
+    python report.py --model tou_arbitrage --off-peak-rate 0.25 \\
+        --peak-rate 0.50 --peak-hours 16 21
+    python report.py --model tou_arbitrage --tariff ./tou.json
+"""
+
+import os
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from read_data import get_data
+from battery_models import sweep_self_consumption, parameter_grid
+from dispatch import MODELS, MODEL_PARAMS, run_dispatch
+from tariff import tou_tariff, read_tariff
+from run_plot import run_model, build_frames
+
+# report period names -> EnergyIndex frequencies
+PERIODS = {'day': 'D', 'week': 'W', 'month': 'M', 'year': 'Y'}
+
+# number formats of the tables: energies to the Wh, battery parameters
+# (e.g. a standby loss of 0.0005) to 6 significant digits
+FLOAT_FORMAT = '%.3f'
+PARAMETER_FORMAT = '%g'
+
+
+def config_tag(battery_capacity, battery_reserve, battery_c_rate):
+    """ Short name of a battery configuration for file names"""
+    return 'cap%g_res%g_rate%g' % (battery_capacity, battery_reserve,
+                                   battery_c_rate)
+
+
+def summary_table(data, battery_capacity, battery_reserve, battery_c_rate,
+                  model=None, tariff=None):
+    """ Totals of every combination of the battery parameters as a table,
+    from one sweep over the data (of a dispatch model when given)."""
+    grid = parameter_grid(battery_capacity, battery_reserve, battery_c_rate)
+    if model is not None:
+        result = run_dispatch(data, model, tariff=tariff, **grid)
+    else:
+        result = sweep_self_consumption(data, **grid)
+    table = pd.DataFrame({k: v for k, v in result.items()
+                          if np.ndim(v) == 1})
+    table['production'] = np.nansum(data['production'])
+    table['consumption'] = np.nansum(data['consumption'])
+    return table
+
+
+def write_summary(table, fn):
+    """ Save a summary table, the parameter columns with PARAMETER_FORMAT
+    and the totals with FLOAT_FORMAT"""
+    table = table.copy()
+    for name in table.columns.intersection(list(MODEL_PARAMS)):
+        table[name] = [PARAMETER_FORMAT % v for v in table[name]]
+    table.to_csv(fn, index=False, float_format=FLOAT_FORMAT)
+
+
+def period_table(frames, period):
+    """ Energy sums and self-consumption (%) for each period"""
+    table = frames['energy_index'].resample(PERIODS[period])
+    table['self_consumption_pct'] = 100*table['self_consumption']/table['consumption']
+    return table
+
+
+def render_period_figures(data, frames, period, outdir, prefix=''):
+    """
+    Save a static figure of the model results for each period.
+
+    One figure is built and its lines are updated for every period, so
+    rendering many periods costs little more than saving the images.
+
+    Returns
+    -------
+    fns : list of str
+        Names of the image files written.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from plot_tools import decimate_minmax
+
+    hourly = frames['hourly']
+    edges, labels = frames['energy_index'].bin_edges(PERIODS[period])
+    x = hourly.index.values
+
+    fig, axs = plt.subplots(4, 1, figsize=(12, 9), sharex=True,
+                            layout='constrained')
+    styles = (('prod', 'production', 'g.-', 'production'),
+              ('cons', 'consumption', 'r.-', 'consumption'),
+              ('cons', 'self_consumption', 'c-', 'self-consumption'),
+              ('cons', 'from_battery', 'y-', 'from battery'),
+              ('port', 'import', 'r.-', 'import'),
+              ('port', 'export', 'g.-', 'export'),
+              ('SOC', 'SOC', 'y.-', 'State of Charge'))
+    ax = dict(zip(('prod', 'cons', 'port', 'SOC'), axs))
+    lines = {}
+    for name, column, style, label in styles:
+        lines[column], = ax[name].plot([], [], style, label=label,
+                                       linewidth=1, markersize=2)
+    for name, ylabel in (('prod', 'Production (kWh)'),
+                         ('cons', 'Consumption (kWh)'),
+                         ('port', '(kWh)'), ('SOC', 'SOC (%)')):
+        ax[name].set_ylabel(ylabel)
+        ax[name].legend(loc='upper right')
+    ax['SOC'].set_ylim(0, 1)
+    title = '%s, %g kWh, %g%% reserve' % (data['battery_model'],
+                                          data['battery_capacity'],
+                                          100*data['battery_reserve'])
+
+    # lay out once, then keep the axes in place for every period
+    fig.canvas.draw()
+    fig.set_layout_engine('none')
+
+    os.makedirs(outdir, exist_ok=True)
+    fns = []
+    width = axs[0].bbox.width
+    for xmin, xmax, label in zip(edges[:-1], edges[1:], labels):
+        ymax = 0.0
+        for column, line in lines.items():
+            xs, ys = decimate_minmax(x, hourly[column].values, xmin, xmax,
+                                     width)
+            line.set_data(xs, ys)
+            if column != 'SOC' and len(ys):
+                ymax = max(ymax, np.nanmax(ys))
+        for name in ('prod', 'cons', 'port'):
+            ax[name].set_ylim(0, ymax if ymax > 0 else 1)
+        axs[0].set_xlim(xmin, xmax)
+        axs[0].set_title('%s   %s to %s' % (title, xmin.strftime('%Y-%m-%d'),
+                                            xmax.strftime('%Y-%m-%d')))
+        fn = os.path.join(outdir, '%s%s_%s.png' % (prefix, period,
+                                                   label.strftime('%Y-%m-%d')))
+        fig.savefig(fn)
+        fns.append(fn)
+    plt.close(fig)
+    return fns
+
+
+def run_report(indir, outdir, interval='hourly', battery_capacity=(20.0,),
+               battery_reserve=(0.20,), battery_c_rate=(0.80,),
+               periods=('month', 'year'), figures=False, cache=True,
+               model=None, tariff=None):
+    """ Write the summary, period tables and figures of one input directory,
+    with a dispatch model of dispatch.MODELS when given.
+
+    Returns
+    -------
+    fns : list of str
+        Names of all files written.
+    """
+    data = get_data(indir, interval, {}, cache=cache)
+    os.makedirs(outdir, exist_ok=True)
+    fns = []
+
+    fn = os.path.join(outdir, 'summary.csv')
+    write_summary(summary_table(data, battery_capacity, battery_reserve,
+                                battery_c_rate, model, tariff), fn)
+    fns.append(fn)
+
+    grid = parameter_grid(battery_capacity, battery_reserve, battery_c_rate)
+    for cap, res, rate in zip(grid['battery_capacity'],
+                              grid['battery_reserve'],
+                              grid['battery_c_rate']):
+        tag = config_tag(cap, res, rate)
+        run = {k: data[k] for k in ('dt', 'production', 'consumption',
+                                    'interval_hours')}
+        run = run_model(run, battery_capacity=cap, battery_reserve=res,
+                        battery_c_rate=rate, model=model, tariff=tariff)
+        frames = build_frames(run)
+        for period in periods:
+            fn = os.path.join(outdir, '%s_%s.csv' % (tag, period))
+            period_table(frames, period).to_csv(fn, float_format=FLOAT_FORMAT)
+            fns.append(fn)
+            if figures:
+                fns.extend(render_period_figures(
+                    run, frames, period, os.path.join(outdir, 'figures'),
+                    prefix=tag+'_'))
+    return fns
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Headless battery model report: summary tables and '
+                    'static figures per period.')
+    parser.add_argument('--indir', nargs='+', default=['./data'],
+                        help='directories of SolarEdge exports')
+    parser.add_argument('--interval', default='hourly',
+                        help="export interval, 'hourly' or '15 min'")
+    parser.add_argument('--capacity', nargs='+', type=float, default=[20.0],
+                        help='battery capacities (kWh)')
+    parser.add_argument('--reserve', nargs='+', type=float, default=[0.20],
+                        help='reserve factors (0.2 = 20%% reserve)')
+    parser.add_argument('--c-rate', nargs='+', type=float, default=[0.80],
+                        help='charge rates (fraction per hour)')
+    parser.add_argument('--model', choices=sorted(MODELS),
+                        help='dispatch model, the self-consumption model '
+                             'of battery_models by default')
+    parser.add_argument('--tariff',
+                        help='JSON tariff (see tariff.py) giving the TOU '
+                             'periods of the TOU models')
+    parser.add_argument('--off-peak-rate', type=float,
+                        help='off-peak rate ($/kWh) of a two-rate TOU '
+                             'tariff, instead of --tariff')
+    parser.add_argument('--peak-rate', type=float,
+                        help='peak rate ($/kWh) of a two-rate TOU tariff')
+    parser.add_argument('--peak-hours', nargs=2, type=int, default=[16, 21],
+                        help='start and end hour of the peak of the '
+                             'two-rate TOU tariff')
+    parser.add_argument('--period', nargs='+', default=['month', 'year'],
+                        choices=sorted(PERIODS),
+                        help='periods of the tables and figures')
+    parser.add_argument('--outdir', default='./report',
+                        help='output directory, one subdirectory per indir')
+    parser.add_argument('--figures', action='store_true',
+                        help='also render a figure of every period')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='parse all exports again')
+    parser.add_argument('--profile', action='store_true',
+                        help='print the time spent in each stage and save '
+                             'it to profile.json in outdir')
+    parser.add_argument('--profile-memory', action='store_true',
+                        help='with --profile, also the peak memory of each stage')
+    args = parser.parse_args(argv)
+
+    # a tariff only for the models dispatching by TOU period
+    tariff = None
+    if args.model is not None and MODELS[args.model]['needs_period']:
+        if args.tariff is not None:
+            tariff = read_tariff(args.tariff)
+        elif args.off_peak_rate is not None and args.peak_rate is not None:
+            tariff = tou_tariff(args.off_peak_rate, args.peak_rate,
+                                peak_hours=args.peak_hours)
+        else:
+            parser.error('model %s needs --tariff, or --off-peak-rate and '
+                         '--peak-rate' % args.model)
+
+    if args.profile:
+        profiling.enable(memory=args.profile_memory)
+    fns = []
+    for indir in args.indir:
+        name = os.path.basename(os.path.normpath(indir))
+        outdir = args.outdir if len(args.indir) == 1 else os.path.join(args.outdir, name)
+        fns.extend(run_report(indir, outdir, args.interval, args.capacity,
+                              args.reserve, args.c_rate, args.period,
+                              args.figures, not args.no_cache, args.model,
+                              tariff))
+    if args.profile:
+        fn = os.path.join(args.outdir, 'profile.json')
+        profiling.to_json(fn)
+        fns.append(fn)
+        print(profiling.summary_table().to_string())
+    print('Wrote %d files to %s' % (len(fns), args.outdir))
+    return fns
+
+
+if __name__ == '__main__':
+    main()
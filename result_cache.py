@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Memoized model results, so the viewer can re-run the model as the battery
+sliders move and return to a configuration at once.
+
+Results are keyed by a fingerprint of the input data (sha1 of the times,
+production and consumption) plus the battery parameter tuple, and on disk
+by RESULT_VERSION too.  The most recently used results are kept in memory
+(LRU, maxsize entries) and, with a disk_dir, the result block of every run
+is also saved there as .npy, so configurations survive a restart and come
+back from the disk when evicted.
+The disk tier holds at most disk_maxsize files: after each save the least
+recently used ones (by modification time, which a disk hit refreshes) are
+deleted, including those of older data or versions.
+
+Example
+-------
+    cache = ResultCache(maxsize=64, disk_dir='./data/.cache/results',
+                        disk_maxsize=256)
+    result = cache.simulate(dataset, BatteryConfig(20.0, 0.20, 0.80))
+"""
+
+import os
+import hashlib
+from collections import OrderedDict
+
+import numpy as np
+
+import profiling
+from containers import ModelResult, simulate
+
+# version of the model results, part of the disk key: raise it whenever the
+# model (e.g. step_c_rate) or the result block changes so results saved by
+# older code are not loaded
+RESULT_VERSION = 2
+
+
+def data_fingerprint(dataset):
+    """ sha1 of the interval, times, production and consumption of a Dataset"""
+    h = hashlib.sha1(dataset.interval.encode('utf-8'))
+    for arr in (dataset.dt.view('int64'), dataset.production,
+                dataset.consumption):
+        h.update(np.ascontiguousarray(arr).data)
+    return h.hexdigest()
+
+
+class ResultCache:
+    """ LRU cache of ModelResult by data fingerprint and BatteryConfig, with
+    an optional on-disk tier.
+
+    Parameters
+    ----------
+    maxsize : int
+        Results kept in memory.
+    disk_dir : str, optional
+        Directory of the on-disk tier, none when not given.
+    disk_maxsize : int
+        Results kept in the on-disk tier.
+    """
+
+    def __init__(self, maxsize=32, disk_dir=None, disk_maxsize=256):
+        self.maxsize = maxsize
+        self.disk_dir = disk_dir
+        self.disk_maxsize = disk_maxsize
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        # fingerprint of the last dataset, hashed once
+        self._dataset = None
+        self._fingerprint = None
+
+    def fingerprint(self, dataset):
+        if dataset is not self._dataset:
+            self._dataset = dataset
+            self._fingerprint = data_fingerprint(dataset)
+        return self._fingerprint
+
+    def key(self, dataset, config):
+        return (self.fingerprint(dataset), config.as_tuple())
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, 'v%d-%s' % (RESULT_VERSION, key[0]),
+                            'cap%r_res%r_rate%r.npy' % key[1])
+
+    def get(self, dataset, config):
+        """ Cached result of config on dataset, None if not cached"""
+        key = self.key(dataset, config)
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            profiling.count('result_cache_hits')
+            return result
+        if self.disk_dir is not None:
+            fn = self._disk_path(key)
+            if os.path.exists(fn):
+                try:
+                    block = np.load(fn)
+                except (OSError, ValueError):
+                    block = None
+                if block is not None and block.shape[1] == len(dataset):
+                    # recently used, kept the longest when pruning
+                    os.utime(fn)
+                    self.disk_hits += 1
+                    profiling.count('result_cache_disk_hits')
+                    result = ModelResult(dataset, config, block)
+                    self._remember(key, result)
+                    return result
+        return None
+
+    def put(self, dataset, config, result):
+        """ Keep a result in memory, and on disk with a disk_dir"""
+        key = self.key(dataset, config)
+        self._remember(key, result)
+        if self.disk_dir is not None:
+            fn = self._disk_path(key)
+            os.makedirs(os.path.dirname(fn), exist_ok=True)
+            # write then rename so a partly written file is never loaded
+            with open(fn+'.tmp', 'wb') as f:
+                np.save(f, result.block)
+            os.replace(fn+'.tmp', fn)
+            self.prune()
+
+    def _disk_files(self):
+        """ (mtime, path) of the .npy files of the disk tier"""
+        files = []
+        for root, dirs, names in os.walk(self.disk_dir):
+            for name in names:
+                if name.endswith('.npy'):
+                    fn = os.path.join(root, name)
+                    try:
+                        files.append((os.stat(fn).st_mtime_ns, fn))
+                    except OSError:
+                        pass
+        return files
+
+    def prune(self):
+        """ Delete the least recently used files of the disk tier beyond
+        disk_maxsize, and the directories left empty"""
+        if self.disk_dir is None:
+            return
+        files = sorted(self._disk_files())
+        for mtime, fn in files[:max(len(files) - self.disk_maxsize, 0)]:
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            if os.path.isdir(path) and not os.listdir(path):
+                os.rmdir(path)
+
+    def _remember(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def simulate(self, dataset, config):
+        """ simulate(dataset, config), from the cache when possible"""
+        result = self.get(dataset, config)
+        if result is None:
+            self.misses += 1
+            profiling.count('result_cache_misses')
+            result = simulate(dataset, config)
+            self.put(dataset, config, result)
+        return result
+
+    def clear(self):
+        """ Drop the results in memory (the disk tier is kept)"""
+        self.entries.clear()
+
+    def __len__(self):
+        return len(self.entries)
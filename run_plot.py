@@ -3,315 +3,470 @@
 Created on Thu Jun 27 14:30:30 2024
 
 @author: haines
+
+Run the battery model on the exported data and show the results in an
+interactive graph.  The pipeline steps (run_model, build_frames) can be
+used from scripts without matplotlib, which is only imported by
+make_viewer.  See report.py for headless batch reports.
 """
 
 import pandas as pd
+import profiling
 from read_data import get_data
 from battery_models import maximize_self_consumption, only_solar
+from dispatch import dispatch_model
+from energy_index import EnergyIndex
 from datetime import timedelta
 
-data=get_data()
-data['battery_capacity'] = 20.0 # units of kWh
-data['battery_reserve'] = 0.20 # reserve factor (0.2 = 20% reserve)
-data['battery_c_rate'] = 0.80 # C-rate (for LFP 0.5C to 1.0C) how much of capacity charged in one hour
-data['depth_of_discharge'] = 1-data['battery_reserve'] # what fraction of battery can be used
-if data['battery_capacity'] > 0.0:
-    data['battery_model']='Maximize Self-Consumption'
-    data = maximize_self_consumption(data)
-else:
-    data['battery_model']='Only Solar, NO BATTERY'
-    data = only_solar(data)
-
-df = pd.DataFrame({'Datetime': data['dt'], 
-                   'production': data['production'], 
-                   'consumption': data['consumption'],
-                   'self_consumption' : data['self_consumption'],
-                   'from_battery' : data['from_battery'],
-                   'import' : data['import'],
-                   'export' : data['export'],
-                   'SOC' : data['SOC']
-                   })
-df = df.set_index('Datetime')
-
-# use other data frames for using 7d and 30d rolling averages of SOC
-df_soc_7d_roll = df['SOC'].rolling(window=7*24, 
-                                   center=True, 
-                                   min_periods=1).mean()
-df_soc_30d_roll  = df['SOC'].rolling(window=30*24, 
-                                     center=True, 
-                                     min_periods=1).mean()
-
-# list of timesteps for xlimits
-# using pd.date_range to generate list depending on frequency
-first_date = df.index[0]
-last_date = df.index[-1]
-
-oneday = timedelta(days=1)
-oneweek = timedelta(weeks=1)
-oneyear = timedelta(days=365)
-# strange way to get next month by remaining days in the month +1, but works
-onemonth = timedelta(days=last_date.days_in_month-last_date.day+1)
-
-days = pd.date_range(start=first_date, end=last_date+oneday, freq='D')
-weeks = pd.date_range(start=first_date-oneweek, end=last_date+oneweek, freq='W')
-months = pd.date_range(start=first_date, end=last_date+onemonth, freq='MS')
-years = pd.date_range(start=first_date-oneyear, end=last_date+oneyear, freq='Y')
-all_data = pd.date_range(start=first_date, end=last_date+onemonth, periods=2)
-
-df_hourly = df.resample('h').sum()
-df_daily = df.resample('D').sum()
-df_weekly = df.resample('W').sum()
-df_monthly = df.resample('M').sum()
-
-# use other data frames for using 7d and 30d rolling averages of SOC
-df_soc_7d_roll = df_hourly['SOC'].rolling(window=7*24, 
-                                          center=True, 
-                                          min_periods=1).mean()
-df_soc_30d_roll  = df_hourly['SOC'].rolling(window=30*24, 
-                                            center=True, 
-                                            min_periods=1).mean()
-
-plotparams = {'xstep': days,
-              'df' : df_hourly}
-
-# -------------------------------------------------------
-import matplotlib.pyplot as plt
-from matplotlib.widgets import Slider, Button, RadioButtons
-
-fig = plt.figure(figsize=(12, 9))
-fig.set_layout_engine('tight')
-
-# define layout of axes for plots and GUI using subplot_moasic()
-button_mosaic = [["text1","text1","text1","text1"],
-                 ["text1","text1","text1","text1"],
-                 ["text1","text1","text1","text1"],
-                 ["start","prev","next","end"]]
-date_mosaic = [["plottype"],
-               ["plottype"],
-               ['plottype'],
-               ["date_slider"]]
-mosaic = [["prod", button_mosaic],
-          ["cons", "xstep"],
-          ["port", date_mosaic],
-          ["SOC", 'text2']]
-ax = fig.subplot_mosaic(mosaic, 
-                        empty_sentinel="BLANK", 
-                        width_ratios=[5, 1])
-t_left = ax['prod'].set_title('datestr1', loc='left')
-t_right = ax['prod'].set_title('datestr2', loc='right')
-t_middle = ax['prod'].set_title('datestr1')
-
-# Display input params
-# turn off all visual axis
-ax['text1'].set_axis_off()
-ax['text1'].set_title('Battery Input Params')
-text1str = 'Model: {3}\nCapacity: {0} (kWh)\nReserve: {1} (%)\nCharge Rate: {2} (%/hr)'.format(
-    data['battery_capacity'], 
-    data['battery_reserve']*100, 
-    data['battery_c_rate']*100,
-    data['battery_model'])
-
-text1 = ax['text1'].text(0,1,text1str)
-text1.set_verticalalignment('top')
-
-# Data Summary
-ax['text2'].set_axis_off()
-ax['text2'].set_title('Energy Sums for \nTime Range Selected')
-text2str = ''
-text2 = ax['text2'].text(0,1,text2str)
-text2.set_verticalalignment('top')
-
-def update_plots(val):
-    global plotparms, t_left, t_right, t_middle
-    #
-    ax['prod'].clear()
-    ax['cons'].clear()
-    ax['port'].clear()
-    ax['SOC'].clear()
-   
-    label = radio2.value_selected
-    print('xstep:',label)
-    if label=='EACH DAY':
-        plotparams['xstep'] = days
-    elif label=='EACH WEEK':
-        plotparams['xstep'] = weeks
-    elif label=='EACH MONTH':
-        plotparams['xstep'] = months
-    elif label=='EACH YEAR':
-        plotparams['xstep'] = years
-    elif label=='ALL':
-        plotparams['xstep'] = all_data
-
-    label = radio.value_selected
-    print('plottype:',label)
-    if label=='hourly':
-        plotparams['df'] = df_hourly
-    elif label=='daily':
-        plotparams['df'] = df_daily
-    elif label=='weekly':
-        plotparams['df'] = df_weekly
-    elif label=='monthly':
-        plotparams['df'] = df_monthly
-        
-    xstep = plotparams['xstep']
-    df = plotparams['df']
+@profiling.profiled('run_model', rows=lambda data: len(data['dt']))
+def run_model(data, battery_capacity=20.0, battery_reserve=0.20, 
+              battery_c_rate=0.80, model=None, tariff=None):
+    """ Set the battery parameters in data and run the battery model, 
+    only_solar when there is no battery capacity.  model (a name in
+    dispatch.MODELS, with the tariff of the TOU models) runs that dispatch
+    model instead."""
+    data['battery_capacity'] = battery_capacity # units of kWh
+    data['battery_reserve'] = battery_reserve # reserve factor (0.2 = 20% reserve)
+    data['battery_c_rate'] = battery_c_rate # C-rate (for LFP 0.5C to 1.0C) how much of capacity charged in one hour
+    data['depth_of_discharge'] = 1-data['battery_reserve'] # what fraction of battery can be used
+    if model is not None:
+        data = dispatch_model(data, model, tariff)
+    elif data['battery_capacity'] > 0.0:
+        data['battery_model']='Maximize Self-Consumption'
+        data = maximize_self_consumption(data)
+    else:
+        data['battery_model']='Only Solar, NO BATTERY'
+        data = only_solar(data)
+    return data
+
+@profiling.profiled('build_frames', rows=lambda frames: len(frames['hourly']))
+def build_frames(data):
+    """ 
+    Energy sums on different time periods and the time steps used for
+    x-limits, for plots and summaries of the model results.
+
+    Returns
+    -------
+    frames : dict
+        'energy_index' (EnergyIndex), 'hourly', 'daily', 'weekly' and 
+        'monthly' DataFrames, 'soc_7d_roll' and 'soc_30d_roll' Series, and 
+        the time steps 'days', 'weeks', 'months', 'years' and 'all'.
+    """
+    # list of timesteps for xlimits
+    # using pd.date_range to generate list depending on frequency
+    first_date = pd.Timestamp(data['dt'][0])
+    last_date = pd.Timestamp(data['dt'][-1])
+
+    oneday = timedelta(days=1)
+    oneweek = timedelta(weeks=1)
+    oneyear = timedelta(days=365)
+    # strange way to get next month by remaining days in the month +1, but works
+    onemonth = timedelta(days=last_date.days_in_month-last_date.day+1)
+
+    frames = {}
+    frames['days'] = pd.date_range(start=first_date, end=last_date+oneday, freq='D')
+    frames['weeks'] = pd.date_range(start=first_date-oneweek, end=last_date+oneweek, freq='W')
+    frames['months'] = pd.date_range(start=first_date, end=last_date+onemonth, freq='MS')
+    frames['years'] = pd.date_range(start=first_date-oneyear, end=last_date+oneyear, freq='Y')
+    frames['all'] = pd.date_range(start=first_date, end=last_date+onemonth, periods=2)
+
+    # cumulative sums of the energy columns for range totals, and the
+    # hourly, daily, weekly and monthly sums derived from them
+    # (SOC is a state, not an energy, so it is averaged over each bin)
+    with profiling.span('energy_index', len(data['dt'])):
+        energy_index = EnergyIndex(data['dt'], data)
+    frames['energy_index'] = energy_index
+    with profiling.span('resample'):
+        frames['hourly'] = energy_index.resample('h')
+        frames['daily'] = energy_index.resample('D')
+        frames['weekly'] = energy_index.resample('W')
+        frames['monthly'] = energy_index.resample('M')
+
+    # use other data frames for using 7d and 30d rolling averages of SOC
+    # windows by time so they hold whatever the interval of the data
+    frames['soc_7d_roll'] = frames['hourly']['SOC'].rolling(window='7D', 
+                                                            center=True, 
+                                                            min_periods=1).mean()
+    frames['soc_30d_roll'] = frames['hourly']['SOC'].rolling(window='30D', 
+                                                             center=True, 
+                                                             min_periods=1).mean()
+    return frames
+
+def make_viewer(data, frames, rerun=None):
+    """ 
+    Build the interactive graph of the model results.
+
+    With rerun, a function rerun(battery_capacity, battery_reserve,
+    battery_c_rate) returning new (data, frames), sliders for the battery
+    parameters re-run the model and refresh the plots and sums.
+
+    Returns
+    -------
+    viewer : dict
+        The figure, axes, lines and widgets; keep a reference to it so the 
+        widgets stay responsive.
+    """
+    import matplotlib.pyplot as plt
+    import matplotlib.dates as mdates
+    from matplotlib.widgets import Slider, Button, RadioButtons
+    from plot_tools import decimate_minmax, BlitManager
+
+    def set_frames(frames):
+        nonlocal energy_index, df_hourly, df_daily, df_weekly, df_monthly
+        nonlocal df_soc_7d_roll, df_soc_30d_roll
+        energy_index = frames['energy_index']
+        df_hourly = frames['hourly']
+        df_daily = frames['daily']
+        df_weekly = frames['weekly']
+        df_monthly = frames['monthly']
+        df_soc_7d_roll = frames['soc_7d_roll']
+        df_soc_30d_roll = frames['soc_30d_roll']
+
+    energy_index = df_hourly = df_daily = df_weekly = df_monthly = None
+    df_soc_7d_roll = df_soc_30d_roll = None
+    set_frames(frames)
+    days = frames['days']
+    weeks = frames['weeks']
+    months = frames['months']
+    years = frames['years']
+    all_data = frames['all']
+
+    plotparams = {'xstep': days,
+                  'df' : df_hourly}
+
+    fig = plt.figure(figsize=(12, 9))
+    fig.set_layout_engine('tight')
+
+    # define layout of axes for plots and GUI using subplot_moasic()
+    if rerun is None:
+        button_mosaic = [["text1","text1","text1","text1"],
+                         ["text1","text1","text1","text1"],
+                         ["text1","text1","text1","text1"],
+                         ["start","prev","next","end"]]
+    else:
+        # sliders for the battery parameters under the text
+        button_mosaic = [["text1","text1","text1","text1"],
+                         ["text1","text1","text1","text1"],
+                         ["capacity","capacity","capacity","capacity"],
+                         ["reserve","reserve","reserve","reserve"],
+                         ["c_rate","c_rate","c_rate","c_rate"],
+                         ["start","prev","next","end"]]
+    date_mosaic = [["plottype"],
+                   ["plottype"],
+                   ['plottype'],
+                   ["date_slider"]]
+    mosaic = [["prod", button_mosaic],
+              ["cons", "xstep"],
+              ["port", date_mosaic],
+              ["SOC", 'text2']]
+    ax = fig.subplot_mosaic(mosaic, 
+                            empty_sentinel="BLANK", 
+                            width_ratios=[5, 1])
+    t_left = ax['prod'].set_title('datestr1', loc='left')
+    t_right = ax['prod'].set_title('datestr2', loc='right')
+    # t_middle = ax['prod'].set_title('datestr1')
 
-    ax['prod'].plot(df['production'], 'g.-', label='production')
-    ymax = df['production'].max()
-    ax['prod'].set_ylim(0, ymax)
+    # Display input params
+    # turn off all visual axis
+    ax['text1'].set_axis_off()
+    ax['text1'].set_title('Battery Input Params')
+    def params_text(data):
+        return 'Model: {3}\nCapacity: {0} (kWh)\nReserve: {1} (%)\nCharge Rate: {2} (%/hr)'.format(
+            data['battery_capacity'], 
+            data['battery_reserve']*100, 
+            data['battery_c_rate']*100,
+            data['battery_model'])
+
+    text1 = ax['text1'].text(0,1,params_text(data))
+    text1.set_verticalalignment('top')
+
+    # Data Summary
+    ax['text2'].set_axis_off()
+    ax['text2'].set_title('Energy Sums for \nTime Range Selected')
+    text2str = ''
+    text2 = ax['text2'].text(0,1,text2str)
+    text2.set_verticalalignment('top')
+
+    # lines are created once and updated with new (decimated) data, so
+    # switching views and stepping through time does not re-plot everything
+    lines = {}
+    lines['production'], = ax['prod'].plot([], [], 'g.-', label='production')
+    lines['consumption'], = ax['cons'].plot([], [], 'r.-', label='consumption')
+    lines['self_consumption'], = ax['cons'].plot([], [], 'c-', label='self-consumption')
+    lines['from_battery'], = ax['cons'].plot([], [], 'y-', label='from battery')
+    lines['import'], = ax['port'].plot([], [], 'r.-', label='import')
+    lines['export'], = ax['port'].plot([], [], 'g.-', label='export')
+    # use hourly data for SOC
+    lines['SOC'], = ax['SOC'].plot([], [], 'y.-', label='State of Charge', 
+                                   linewidth=1,
+                                   markersize=2)
+    lines['SOC_7d'], = ax['SOC'].plot([], [], 'b-', label='7-day rolling mean', 
+                                      linewidth=1,
+                                      markersize=2)
+    lines['SOC_30d'], = ax['SOC'].plot([], [], 'k--', label='30-day rolling mean', 
+                                       linewidth=2)
     ax['prod'].legend()
-
-    ax['cons'].plot(df['consumption'], 'r.-', label='consumption')
-    # ymax = df['consumption'].max()
-    ax['cons'].set_ylim(0,ymax)
-    ax['cons'].plot(df['self_consumption'], 'c-', label='self-consumption')
-    ax['cons'].plot(df['from_battery'], 'y-', label='from battery')
     ax['cons'].legend()
-    
-    ax['port'].plot(df['import'], 'r.-', label='import')
-    # ymax = df['import'].max()
-    ax['port'].set_ylim(0, ymax)
-    ax['port'].plot(df['export'], 'g.-', label='export')
     ax['port'].legend()
-
-    # use hourly data for SOC
-    ax['SOC'].plot(df_hourly['SOC'], 'y.-', label='State of Charge', 
-                   linewidth=1,
-                   markersize=2)
-
-    label = radio2.value_selected
-    if label == 'EACH YEAR' or label == 'ALL':
-        # no line for hourly data
-        ll = ax['SOC'].get_lines()
-        ll = ll[0]
-        ll.set_linestyle('')
-        # plot rolling average data
-        ax['SOC'].plot(df_soc_7d_roll, 'b-', label='7-day rolling mean', 
-                        linewidth=1,
-                        markersize=2)
-        ax['SOC'].plot(df_soc_30d_roll, 'k--', label='30-day rolling mean', 
-                        linewidth=2)
-
-    ax['SOC'].legend()
     ax['SOC'].set_ylim(0, 1)
-
-
-    # add labels back since axes.clear() removes them
-    t_left = ax['prod'].set_title('datestr1', loc='left')
-    t_right = ax['prod'].set_title('datestr2', loc='right')
-    # t_middle = ax['prod'].set_title('datestr1')
     ax['prod'].set_ylabel('Production (kWh)')
     ax['cons'].set_ylabel('Consumption (kWh)')
     ax['port'].set_ylabel('(kWh)')
     ax['SOC'].set_ylabel('SOC (%)')
 
-    sdt.valmax = len(xstep)-1
-    sdt.val=0
-    change_dt(0)
-    
-    # draw and allow to catch up
-    plt.draw()
-    plt.pause(0.01)
-
-def change_dt(val):
-    xstep = plotparams['xstep']
-    xmin = xstep[sdt.val]
-    xmax = xstep[sdt.val+1]
-    xminstr = xmin.strftime('%Y-%m-%d')
-    xmaxstr = xmax.strftime('%Y-%m-%d')
-    t_left.set_text(xminstr)
-    t_right.set_text(xmaxstr)
-    # t_middle.set_text(xmin.strftime('%Y-%m-%d'))
-    ax['prod'].set_xlim(xmin,xmax)
-    ax['cons'].set_xlim(xmin,xmax)
-    ax['port'].set_xlim(xmin,xmax)
-    ax['SOC'].set_xlim(xmin,xmax)
-    # update Energy Sums Summary
-    # df = plotparams['df']
-    df = df_hourly
-    textlist = ['Production: {0: 8.2f} (kWh)\n', 
-                'Consumption: {1: 8.2f} (kWh)\n',
-                'From Battery: {6: 8.2f} (kWh)\n',
-                'Self-consumption: {2: 8.2f} (kWh)\n', 
-                'Self-consumption: {5:.1f} (%)\n\n',
-                'Imported: {3: 8.2f} (kWh)\n',
-                'Exported: {4: 8.2f} (kWh)']
-    textstr = ''.join(textlist).format(
-        df[xminstr:xmaxstr]['production'].sum(),
-        df[xminstr:xmaxstr]['consumption'].sum(),
-        df[xminstr:xmaxstr]['self_consumption'].sum(),
-        df[xminstr:xmaxstr]['import'].sum(), 
-        df[xminstr:xmaxstr]['export'].sum(), 
-        100*(df[xminstr:xmaxstr]['self_consumption'].sum()/df[xminstr:xmaxstr]['consumption'].sum()),
-        df[xminstr:xmaxstr]['from_battery'].sum()
-        )
-    text2.set_text(textstr)
-    
-def prev_dt(val):
-    dtidx = int(sdt.val)
-    if dtidx>0:
+    # line data, date axis limits and text are redrawn by blitting
+    blit = BlitManager(fig.canvas, list(lines.values()) + [t_left, t_right, text1, text2])
+
+    def select_series():
+        """ full series behind each line as numpy arrays, decimated in
+        change_dt"""
+        df = plotparams['df']
+        series = {}
+        for name in ('production', 'consumption', 'self_consumption', 
+                     'from_battery', 'import', 'export'):
+            series[name] = (df.index.values, df[name].values)
+        series['SOC'] = (df_hourly.index.values, df_hourly['SOC'].values)
+        series['SOC_7d'] = (df_soc_7d_roll.index.values, df_soc_7d_roll.values)
+        series['SOC_30d'] = (df_soc_30d_roll.index.values, df_soc_30d_roll.values)
+        plotparams['series'] = series
+
+    @profiling.profiled('update_plots')
+    def update_plots(val):
+        #
+        label = radio2.value_selected
+        print('xstep:',label)
+        if label=='EACH DAY':
+            plotparams['xstep'] = days
+        elif label=='EACH WEEK':
+            plotparams['xstep'] = weeks
+        elif label=='EACH MONTH':
+            plotparams['xstep'] = months
+        elif label=='EACH YEAR':
+            plotparams['xstep'] = years
+        elif label=='ALL':
+            plotparams['xstep'] = all_data
+
+        label = radio.value_selected
+        print('plottype:',label)
+        if label=='hourly':
+            plotparams['df'] = df_hourly
+        elif label=='daily':
+            plotparams['df'] = df_daily
+        elif label=='weekly':
+            plotparams['df'] = df_weekly
+        elif label=='monthly':
+            plotparams['df'] = df_monthly
+            
+        xstep = plotparams['xstep']
+        df = plotparams['df']
+        select_series()
+
+        ymax = df['production'].max()
+        ax['prod'].set_ylim(0, ymax)
+        ax['cons'].set_ylim(0,ymax)
+        ax['port'].set_ylim(0, ymax)
+
+        label = radio2.value_selected
+        rolling = label == 'EACH YEAR' or label == 'ALL'
+        # no line for hourly data, plot rolling average data instead
+        lines['SOC'].set_linestyle('' if rolling else '-')
+        lines['SOC_7d'].set_visible(rolling)
+        lines['SOC_30d'].set_visible(rolling)
+        ax['SOC'].legend(handles=[l for l in 
+                                  (lines['SOC'], lines['SOC_7d'], lines['SOC_30d'])
+                                  if l.get_visible()])
+
+        sdt.valmax = len(xstep)-1
+        sdt.val=0
+        change_dt(0)
+        # y limits and legend changed, so draw everything
+        fig.canvas.draw_idle()
+
+    def change_dt(val):
+        xstep = plotparams['xstep']
+        xmin = xstep[int(sdt.val)]
+        xmax = xstep[int(sdt.val)+1]
+        xminstr = xmin.strftime('%Y-%m-%d')
+        xmaxstr = xmax.strftime('%Y-%m-%d')
+        t_left.set_text(xminstr)
+        t_right.set_text(xmaxstr)
+        # t_middle.set_text(xmin.strftime('%Y-%m-%d'))
+        # only the visible part of each series, min/max-decimated to the pixel
+        # width of its axes
+        for name, line in lines.items():
+            x, y = plotparams['series'][name]
+            x, y = decimate_minmax(x, y, xmin, xmax, line.axes.bbox.width)
+            line.set_data(x, y)
+        # update Energy Sums Summary from the cumulative sums over [xmin, xmax)
+        sums = energy_index.sums(xmin, xmax)
+        textlist = ['Production: {0: 8.2f} (kWh)\n', 
+                    'Consumption: {1: 8.2f} (kWh)\n',
+                    'From Battery: {6: 8.2f} (kWh)\n',
+                    'Self-consumption: {2: 8.2f} (kWh)\n', 
+                    'Self-consumption: {5:.1f} (%)\n\n',
+                    'Imported: {3: 8.2f} (kWh)\n',
+                    'Exported: {4: 8.2f} (kWh)']
+        textstr = ''.join(textlist).format(
+            sums['production'],
+            sums['consumption'],
+            sums['self_consumption'],
+            sums['import'], 
+            sums['export'], 
+            100*(sums['self_consumption']/sums['consumption']),
+            sums['from_battery']
+            )
+        text2.set_text(textstr)
+        
+        xlim = (mdates.date2num(xmin), mdates.date2num(xmax))
+        if ax['prod'].get_xlim() != xlim:
+            # new date range moves the ticks, so the axes need a full draw
+            # (the blit background is captured again on that draw)
+            for name in ('prod', 'cons', 'port', 'SOC'):
+                ax[name].set_xlim(xmin,xmax)
+            fig.canvas.draw_idle()
+        else:
+            blit.update()
+        
+    def change_params(val):
+        """ re-run the model with the slider values, keep the view"""
+        new_data, new_frames = rerun(scap.val, sres.val, srate.val)
+        set_frames(new_frames)
+        label = radio.value_selected
+        plotparams['df'] = {'hourly': df_hourly, 'daily': df_daily,
+                            'weekly': df_weekly, 'monthly': df_monthly}[label]
+        select_series()
+        text1.set_text(params_text(new_data))
+        change_dt(sdt.val)
+
+    def prev_dt(val):
+        dtidx = int(sdt.val)
+        if dtidx>0:
+            sdt.set_val(dtidx-1)
+
+    def next_dt(val):
+        dtidx = int(sdt.val)
+        if dtidx+1<sdt.valmax:
+            sdt.set_val(dtidx+1)
+
+    def start_dt(val):
+        dtidx = int(sdt.valmin)
+        sdt.set_val(dtidx)
+
+    def end_dt(val):
+        dtidx = int(sdt.valmax)
         sdt.set_val(dtidx-1)
+        
+    # setup GUI
+    gui_color='lightgoldenrodyellow'
+    ax['plottype'].set_facecolor(gui_color)
+    ax['plottype'].set_title('Energy (kWh) Sums')
+    ax['xstep'].set_facecolor(gui_color)
+    ax['xstep'].set_title('Time Ranges')
+
+    radio = RadioButtons(
+        ax['plottype'], ('hourly','daily','weekly','monthly'))
+    radio.on_clicked(update_plots)
+
+    radio2 = RadioButtons(
+        ax['xstep'], ('EACH DAY','EACH WEEK','EACH MONTH','EACH YEAR','ALL'))
+    radio2.on_clicked(update_plots)
+
+
+    # Battery parameter sliders, steps so revisited values hit the cache
+    sliders = ()
+    if rerun is not None:
+        scap = Slider(ax['capacity'], 'kWh', valmin=0, valmax=40,
+                      valinit=data['battery_capacity'], valstep=0.5)
+        sres = Slider(ax['reserve'], 'Res', valmin=0, valmax=0.9,
+                      valinit=data['battery_reserve'], valstep=0.05)
+        srate = Slider(ax['c_rate'], 'C', valmin=0.05, valmax=1.0,
+                       valinit=data['battery_c_rate'], valstep=0.05)
+        sliders = (scap, sres, srate)
+        for slider in sliders:
+            # drawn by blitting with the lines instead of a full redraw
+            slider.drawon = False
+            for artist in [slider.poly, slider.valtext] + list(slider.ax.lines):
+                blit.add_artist(artist)
+            slider.on_changed(change_params)
+
+    # Date slider
+    sdt = Slider(ax['date_slider'], '', valmin=0, valmax=31, valinit=0, valfmt='%d')
+    sdt.on_changed(change_dt)
+
+    # Date prev button
+    bdtprev = Button(ax['prev'], '<')
+    bdtprev.on_clicked(prev_dt)
+    # Date next button
+    ax['next'].set_title('Time Range Steps')
+    bdtnext = Button(ax['next'], '>')
+    bdtnext.on_clicked(next_dt)
+    # Date start button
+    bdtstart = Button(ax['start'], '|<')
+    bdtstart.on_clicked(start_dt)
+    # Date end button
+    bdtend = Button(ax['end'], '>|')
+    bdtend.on_clicked(end_dt)
+
+       
+    def init_plot():
+        """ initialize plots, finish setting up, and set slider limits
+        """
+        # global js,jsmap,jsvec,cf1,cf2,cs11,cs12,cs13,cs2
+        dtidx = 0
+
+        sdt.valinit = dtidx
+        sdt.valmin = 0
+        sdt.valmax = len(days)-1
+        
+        update_plots(0)
+        # lay out once, then keep the axes in place instead of redoing the
+        # tight layout on every redraw
+        fig.canvas.draw()
+        fig.set_layout_engine('none')
 
-def next_dt(val):
-    dtidx = int(sdt.val)
-    if dtidx+1<sdt.valmax:
-        sdt.set_val(dtidx+1)
-
-def start_dt(val):
-    dtidx = int(sdt.valmin)
-    sdt.set_val(dtidx)
-
-def end_dt(val):
-    dtidx = int(sdt.valmax)
-    sdt.set_val(dtidx-1)
-    
-# setup GUI
-gui_color='lightgoldenrodyellow'
-ax['plottype'].set_facecolor(gui_color)
-ax['plottype'].set_title('Energy (kWh) Sums')
-ax['xstep'].set_facecolor(gui_color)
-ax['xstep'].set_title('Time Ranges')
-
-radio = RadioButtons(
-    ax['plottype'], ('hourly','daily','weekly','monthly'))
-radio.on_clicked(update_plots)
-
-radio2 = RadioButtons(
-    ax['xstep'], ('EACH DAY','EACH WEEK','EACH MONTH','EACH YEAR','ALL'))
-radio2.on_clicked(update_plots)
-
-
-# Date slider
-sdt = Slider(ax['date_slider'], '', valmin=0, valmax=31, valinit=0, valfmt='%d')
-sdt.on_changed(change_dt)
-
-# Date prev button
-bdtprev = Button(ax['prev'], '<')
-bdtprev.on_clicked(prev_dt)
-# Date next button
-ax['next'].set_title('Time Range Steps')
-bdtnext = Button(ax['next'], '>')
-bdtnext.on_clicked(next_dt)
-# Date start button
-bdtstart = Button(ax['start'], '|<')
-bdtstart.on_clicked(start_dt)
-# Date end button
-bdtend = Button(ax['end'], '>|')
-bdtend.on_clicked(end_dt)
-
-   
-def init_plot():
-    """ initialize plots, finish setting up, and set slider limits
-    """
-    # global js,jsmap,jsvec,cf1,cf2,cs11,cs12,cs13,cs2
-    dtidx = 0
-
-    sdt.valinit = dtidx
-    sdt.valmin = 0
-    sdt.valmax = len(days)-1
-    
-    update_plots(0)
 
+    init_plot()
+    plt.draw()
 
-init_plot()
-plt.draw()
\ No newline at end of file
+    viewer = {'fig': fig, 'ax': ax, 'lines': lines, 'text1': text1,
+              'text2': text2, 'radio': radio, 'radio2': radio2, 'sdt': sdt,
+              'buttons': (bdtstart, bdtprev, bdtnext, bdtend), 'blit': blit,
+              'sliders': sliders, 'update_plots': update_plots,
+              'change_dt': change_dt, 'prev_dt': prev_dt, 'next_dt': next_dt}
+    if rerun is not None:
+        viewer['change_params'] = change_params
+    return viewer
+
+def main(profile=False, cache_dir=None):
+    import matplotlib.pyplot as plt
+    from containers import Dataset, BatteryConfig
+    from result_cache import ResultCache
+
+    # time the pipeline stages (and the redraws while the viewer is open)
+    if profile:
+        profiling.enable()
+    # export interval of the data: 'hourly' or '15 min'
+    interval = 'hourly'
+    dataset=Dataset.load(interval=interval)
+    # model results by battery parameters, on disk too with a cache_dir;
+    # the frames are rebuilt from the cached result, which is cheap
+    cache=ResultCache(maxsize=64, disk_dir=cache_dir)
+
+    def rerun(battery_capacity, battery_reserve, battery_c_rate):
+        result=cache.simulate(dataset, BatteryConfig(battery_capacity,
+                                                     battery_reserve,
+                                                     battery_c_rate))
+        # views of the dataset and result arrays, nothing is copied
+        data=result.as_dict()
+        return data, build_frames(data)
+
+    data, frames=rerun(battery_capacity=20.0, battery_reserve=0.20,
+                       battery_c_rate=0.80)
+    viewer=make_viewer(data, frames, rerun)
+    plt.show()
+    if profile:
+        print(profiling.summary_table().to_string())
+    return viewer
+
+if __name__ == '__main__':
+    viewer = main()
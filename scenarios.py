@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+Monte Carlo scenarios: many synthetic years built from the measured data
+by block bootstrap, to see the spread of a battery's results over weather
+and consumption years rather than the few measured ones.
+
+A synthetic year is 365 days of blocks (whole days, or weeks) drawn at
+random from the measured data.  Each block is drawn from the measured
+blocks starting within window_days of its own day of the year, so January
+is built from Januaries and the seasons stay in place.  Only complete
+blocks (every interval present, starting at midnight) are drawn.
+
+All scenario-years are run through the batch kernel of
+sweep_self_consumption together, one scenario per row, chunk_years rows
+at a time.  The draws come from one seeded numpy Generator and are made
+before any chunk is run, so the scenarios depend on the seed only.
+
+Example
+-------
+    data = get_data()
+    result = run_scenarios(data, battery_capacity=[10., 20.], n_years=2000,
+                           block='week', seed=1)
+    table = scenario_percentiles(result, k=1)
+"""
+
+import numpy as np
+import pandas as pd
+
+import profiling
+from battery_models import sweep_self_consumption
+
+# days in a block
+BLOCK_DAYS = {'day': 1, 'week': 7}
+
+# days in a synthetic year
+YEAR_DAYS = 365
+
+# per scenario-year results of run_scenarios
+SCENARIO_TOTALS = ('production', 'consumption', 'self_consumption',
+                   'from_battery', 'import', 'export', 'self_consumption_pct',
+                   'empty_hours', 'full_hours')
+
+
+def block_pool(data, block='day'):
+    """
+    Complete blocks of the measured data.
+
+    Returns
+    -------
+    pool : dict
+        'start' (sample index of the first interval of each block), 'doy'
+        (day of the year of its first day, 0..365), 'length' (intervals
+        in a block) and 'block_days'.
+    """
+    block_days = BLOCK_DAYS[block]
+    interval_hours = data.get('interval_hours', 1.0)
+    steps_per_day = int(round(24/interval_hours))
+    if steps_per_day < 1 or abs(steps_per_day*interval_hours - 24) > 1e-9:
+        raise ValueError('interval of %g hours does not divide a day'
+                         % interval_hours)
+    length = steps_per_day*block_days
+    dt = np.asarray(data['dt'], dtype='datetime64[ns]')
+    production = np.asarray(data['production'], dtype=float)
+    consumption = np.asarray(data['consumption'], dtype=float)
+    n = len(dt)
+
+    day = dt.astype('datetime64[D]')
+    start = np.flatnonzero(dt == day)
+    start = start[start + length <= n]
+    # the block covers its days without a gap
+    step = np.timedelta64(int(round(interval_hours*3600)), 's')
+    complete = dt[start + length - 1] - dt[start] == (length - 1)*step
+    # and has no missing values
+    bad = np.concatenate([[0], np.cumsum(np.isnan(production) |
+                                         np.isnan(consumption))])
+    complete &= bad[start + length] == bad[start]
+    start = start[complete]
+
+    first_day = day[start]
+    doy = (first_day - first_day.astype('datetime64[Y]')).astype(int)
+    return {'start': start, 'doy': doy, 'length': length,
+            'block_days': block_days}
+
+
+def draw_scenarios(pool, n_years=1000, window_days=15, seed=None):
+    """
+    Random blocks of n_years synthetic years.
+
+    Parameters
+    ----------
+    pool : dict
+        Blocks to draw from, see block_pool.
+    n_years : int
+        Synthetic years.
+    window_days : int
+        A block for a day of the year is drawn from measured blocks starting
+        at most this many days (either way, around the year end) from it.
+    seed : int or numpy Generator, optional
+        Seed of the draws.
+
+    Returns
+    -------
+    draws : (n_years, blocks) int numpy array
+        Sample index of the first interval of each block of each year.
+    """
+    rng = np.random.default_rng(seed)
+    n_blocks = -(-YEAR_DAYS//pool['block_days'])
+    draws = np.zeros((n_years, n_blocks), dtype=np.int64)
+    for b in range(n_blocks):
+        target = b*pool['block_days']
+        distance = np.abs(pool['doy'] - target)
+        distance = np.minimum(distance, YEAR_DAYS - distance)
+        candidates = pool['start'][distance <= window_days]
+        if len(candidates) == 0:
+            raise ValueError('no complete %d-day block of the data starts '
+                             'within %d days of day %d of the year, widen '
+                             'window_days' % (pool['block_days'],
+                                              window_days, target + 1))
+        draws[:, b] = candidates[rng.integers(len(candidates), size=n_years)]
+    return draws
+
+
+def scenario_index(draws, pool):
+    """ (years, intervals) sample indices of the synthetic years, cut to
+    YEAR_DAYS days"""
+    n_steps = YEAR_DAYS*pool['length']//pool['block_days']
+    index = draws[:, :, None] + np.arange(pool['length'])
+    return index.reshape(len(draws), -1)[:, :n_steps]
+
+
+@profiling.profiled('run_scenarios')
+def run_scenarios(data, battery_capacity=20.0, battery_reserve=0.20,
+                  battery_c_rate=0.80, n_years=1000, block='day',
+                  window_days=15, seed=None, chunk_years=256, SOC=1.0):
+    """
+    Run the battery model over n_years bootstrapped years.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Measured dt, production and consumption (kWh), and interval_hours.
+    battery_capacity, battery_reserve, battery_c_rate : scalar or 1-d array
+        Battery configurations, broadcast as in sweep_self_consumption.
+        Every configuration is run on the same scenarios.
+    n_years : int
+        Synthetic years.
+    block : str
+        'day' or 'week', the blocks the years are built of.
+    window_days : int
+        Season window of the draws, see draw_scenarios.
+    seed : int, optional
+        Seed of the draws, the same seed gives the same scenarios.
+    chunk_years : int
+        Years built and run at a time, which bounds the memory used.
+    SOC : float
+        SOC (0..1 of usable capacity) at the start of each year.
+
+    Returns
+    -------
+    result : dict of numpy arrays
+        The battery parameters (config,), and (config, year) arrays of the
+        SCENARIO_TOTALS of each synthetic year, 'empty_hours' being the
+        hours with the battery empty.
+    """
+    capacity, reserve, c_rate = np.broadcast_arrays(
+        np.atleast_1d(np.asarray(battery_capacity, dtype=float)),
+        np.atleast_1d(np.asarray(battery_reserve, dtype=float)),
+        np.atleast_1d(np.asarray(battery_c_rate, dtype=float)))
+    K = len(capacity)
+    pool = block_pool(data, block)
+    draws = draw_scenarios(pool, n_years, window_days, seed)
+    production = np.asarray(data['production'], dtype=np.float32)
+    consumption = np.asarray(data['consumption'], dtype=np.float32)
+    interval_hours = data.get('interval_hours', 1.0)
+
+    result = {name: np.zeros((K, n_years)) for name in SCENARIO_TOTALS}
+    for a in range(0, n_years, chunk_years):
+        b = min(a + chunk_years, n_years)
+        index = scenario_index(draws[a:b], pool)
+        chunk = {'production': production[index],
+                 'consumption': consumption[index],
+                 'interval_hours': interval_hours}
+        result['production'][:, a:b] = chunk['production'].sum(axis=1,
+                                                               dtype=float)
+        result['consumption'][:, a:b] = chunk['consumption'].sum(axis=1,
+                                                                 dtype=float)
+        rows = np.ones((b - a,))
+        for k in range(K):
+            # one row of the kernel per scenario-year
+            out = sweep_self_consumption(chunk, capacity[k]*rows,
+                                         reserve[k]*rows, c_rate[k]*rows,
+                                         SOC=SOC)
+            for name in SCENARIO_TOTALS[2:]:
+                result[name][k, a:b] = out[name]
+        del chunk, index
+    profiling.count('scenario_years', n_years*K)
+
+    result['battery_capacity'] = np.array(capacity)
+    result['battery_reserve'] = np.array(reserve)
+    result['battery_c_rate'] = np.array(c_rate)
+    return result
+
+
+def scenario_percentiles(result, q=(5, 25, 50, 75, 95), k=0):
+    """ Percentiles over the scenario-years of configuration k of
+    run_scenarios, one row per SCENARIO_TOTALS, with the mean"""
+    table = pd.DataFrame({'P%g' % p: [np.percentile(result[name][k], p)
+                                      for name in SCENARIO_TOTALS]
+                          for p in q},
+                         index=pd.Index(SCENARIO_TOTALS, name='total'))
+    table['mean'] = [result[name][k].mean() for name in SCENARIO_TOTALS]
+    return table
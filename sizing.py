@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+Battery sizing: the smallest battery_capacity (or battery_c_rate) that
+reaches a target self-consumption or cut in grid import, and the Pareto
+front of capacity vs. import/export.
+
+A bigger battery (or faster charging) never stores less solar, so
+self-consumption rises and import falls with capacity.  The smallest
+capacity meeting a target is found by bisection on that monotonic
+relationship, stopping as soon as the bracket is within tolerance,
+instead of scanning every capacity.
+
+Example
+-------
+    data = get_data()
+    best = smallest_capacity(data, target_self_consumption_pct=85)
+    table = size_battery(data, target_import_reduction=1500,
+                         c_rates=(0.5, 0.8, 1.0))
+    front = pareto_front(data, np.arange(0, 41, 1.0))
+"""
+
+import numpy as np
+import pandas as pd
+
+from battery_models import sweep_self_consumption
+
+
+def evaluate(data, battery_capacity, battery_reserve=0.20, battery_c_rate=0.80):
+    """ Totals of the model for one or more battery configurations (see
+    sweep_self_consumption), with import and export per year added."""
+    result = sweep_self_consumption(data, battery_capacity, battery_reserve,
+                                    battery_c_rate)
+    years = len(data['production'])*data.get('interval_hours', 1.0)/8760
+    result['import_per_year'] = result['import']/years
+    result['export_per_year'] = result['export']/years
+    return result
+
+
+def _target_metric(data, battery_reserve, battery_c_rate,
+                   target_self_consumption_pct, target_import_reduction):
+    """ Function of the configuration that increases with battery size and
+    reaches zero at the target."""
+    if (target_self_consumption_pct is None) == (target_import_reduction is None):
+        raise ValueError('Give one of target_self_consumption_pct or '
+                         'target_import_reduction')
+    if target_self_consumption_pct is not None:
+        def metric(result):
+            return result['self_consumption_pct'] - target_self_consumption_pct
+    else:
+        # import per year without a battery
+        baseline = evaluate(data, 0.0, battery_reserve, battery_c_rate)['import_per_year'][0]
+        def metric(result):
+            return (baseline - result['import_per_year']) - target_import_reduction
+    return metric
+
+
+def _bisect(f, lo, hi, tol, metric_tol, max_iter=60):
+    """
+    Smallest x in [lo, hi] with f(x) >= 0 for f increasing in x.
+
+    Returns (x, value of f at x, number of evaluations); x is None when
+    f(hi) < 0.
+    """
+    f_hi = f(hi)
+    evaluations = 1
+    if f_hi < 0:
+        return None, f_hi, evaluations
+    f_lo = f(lo)
+    evaluations += 1
+    if f_lo >= 0:
+        return lo, f_lo, evaluations
+    for i in range(max_iter):
+        if hi - lo <= tol or f_hi <= metric_tol:
+            # bracket small enough, or already within tolerance of target
+            break
+        mid = 0.5*(lo + hi)
+        f_mid = f(mid)
+        evaluations += 1
+        if f_mid >= 0:
+            hi, f_hi = mid, f_mid
+        else:
+            lo = mid
+    return hi, f_hi, evaluations
+
+
+def smallest_capacity(data, target_self_consumption_pct=None,
+                      target_import_reduction=None, battery_reserve=0.20,
+                      battery_c_rate=0.80, capacity_max=100.0, tol=0.1,
+                      metric_tol=0.0):
+    """
+    Smallest battery_capacity reaching the target.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Container with production and consumption (kWh).
+    target_self_consumption_pct : float, optional
+        Self-consumption (% of consumption) to reach.
+    target_import_reduction : float, optional
+        Cut in grid import (kWh/year) compared to no battery.
+    battery_reserve, battery_c_rate : float
+        Fixed battery parameters.
+    capacity_max : float
+        Largest capacity (kWh) considered.
+    tol : float
+        Capacity tolerance (kWh) of the answer.
+    metric_tol : float
+        Stop early once within this much above the target (in % or kWh/year).
+
+    Returns
+    -------
+    result : dict
+        'battery_capacity' (None if capacity_max does not reach the target),
+        the model totals at that capacity and 'evaluations' of the model.
+    """
+    metric = _target_metric(data, battery_reserve, battery_c_rate,
+                            target_self_consumption_pct, target_import_reduction)
+
+    def f(capacity):
+        return metric(evaluate(data, capacity, battery_reserve,
+                               battery_c_rate))[0]
+
+    capacity, value, evaluations = _bisect(f, 0.0, capacity_max, tol,
+                                           metric_tol)
+    result = {'battery_capacity': capacity, 'battery_reserve': battery_reserve,
+              'battery_c_rate': battery_c_rate, 'evaluations': evaluations,
+              'above_target': value}
+    if capacity is not None:
+        totals = evaluate(data, capacity, battery_reserve, battery_c_rate)
+        for key in ('self_consumption_pct', 'import', 'export',
+                    'import_per_year', 'export_per_year'):
+            result[key] = float(totals[key][0])
+    return result
+
+
+def smallest_c_rate(data, battery_capacity, target_self_consumption_pct=None,
+                    target_import_reduction=None, battery_reserve=0.20,
+                    tol=0.01, metric_tol=0.0):
+    """
+    Smallest battery_c_rate (0..1 per hour) reaching the target for a given
+    battery_capacity, see smallest_capacity for the parameters.
+    """
+    metric = _target_metric(data, battery_reserve, 1.0,
+                            target_self_consumption_pct, target_import_reduction)
+
+    def f(c_rate):
+        return metric(evaluate(data, battery_capacity, battery_reserve,
+                               c_rate))[0]
+
+    c_rate, value, evaluations = _bisect(f, 0.0, 1.0, tol, metric_tol)
+    return {'battery_capacity': battery_capacity,
+            'battery_reserve': battery_reserve, 'battery_c_rate': c_rate,
+            'evaluations': evaluations, 'above_target': value}
+
+
+def size_battery(data, c_rates=(0.5, 0.8, 1.0), **kwargs):
+    """ smallest_capacity for each C-rate as a table, kwargs are passed to
+    smallest_capacity."""
+    rows = [smallest_capacity(data, battery_c_rate=c_rate, **kwargs)
+            for c_rate in c_rates]
+    return pd.DataFrame(rows)
+
+
+def pareto_front(data, battery_capacity, battery_reserve=0.20,
+                 battery_c_rate=0.80):
+    """
+    Capacity vs. import and export for a range of capacities, from one sweep,
+    with the configurations on the Pareto front marked.
+
+    A configuration is on the front when no other has a smaller or equal
+    capacity, import and export with at least one strictly smaller.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        Parameters, totals per year, self-consumption and 'pareto' (bool).
+    """
+    result = evaluate(data, battery_capacity, battery_reserve, battery_c_rate)
+    table = pd.DataFrame({k: result[k] for k in (
+        'battery_capacity', 'battery_reserve', 'battery_c_rate',
+        'import_per_year', 'export_per_year', 'self_consumption_pct')})
+    objectives = table[['battery_capacity', 'import_per_year',
+                        'export_per_year']].to_numpy()
+    # pairwise: does row j dominate row i?
+    le = (objectives[None, :, :] <= objectives[:, None, :]).all(axis=2)
+    lt = (objectives[None, :, :] < objectives[:, None, :]).any(axis=2)
+    table['pareto'] = ~(le & lt).any(axis=1)
+    return table
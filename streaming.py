@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+Step-wise version of maximize_self_consumption for live meter feeds.  The
+battery state (SOC) is kept inside a SelfConsumptionStream and readings of
+(timestamp, production, consumption) are fed one at a time or in small
+batches, with constant memory.  Results are the same as running
+maximize_self_consumption on the whole series.
+
+Example
+-------
+    battery = SelfConsumptionStream(battery_capacity=20.0)
+    for result in stream(readings, battery):
+        print(result['dt'], result['SOC'], result['import'])
+
+    # or from an asyncio source, e.g. lines read from a socket
+    async for result in astream(aparse_lines(reader), battery):
+        ...
+"""
+
+import re
+
+import numpy as np
+
+from battery_models import (_self_consumption_loop, _self_consumption_kernel,
+                            step_c_rate, SWEEP_SERIES)
+from read_data import scanf_datetime, REAL_RE_STR, TIME_FORMAT
+
+
+class SelfConsumptionStream:
+    """ Maximize self-consumption battery model that keeps its own SOC.
+
+    Parameters
+    ----------
+    battery_capacity : float
+        Battery capacity (kWh).
+    battery_reserve : float
+        Reserve factor (0.2 = 20% reserve).
+    battery_c_rate : float
+        Fraction of the remaining capacity charged in one hour.
+    SOC : float
+        Initial state of charge (0..1 of usable capacity), default full.
+    interval_hours : float
+        Length of each reading in hours, e.g. 0.25 for a 15 min feed.
+    """
+    __slots__ = ('battery_capacity', 'battery_reserve', 'battery_c_rate',
+                 'interval_hours', 'usable_capacity', 'c_rate', 'SOC',
+                 'last_dt')
+
+    def __init__(self, battery_capacity=20.0, battery_reserve=0.20,
+                 battery_c_rate=0.80, SOC=1.0, interval_hours=1.0):
+        self.battery_capacity = float(battery_capacity)
+        self.battery_reserve = float(battery_reserve)
+        self.battery_c_rate = float(battery_c_rate)
+        self.interval_hours = float(interval_hours)
+        self.usable_capacity = self.battery_capacity*(1 - self.battery_reserve)
+        # charge fraction per reading
+        self.c_rate = float(step_c_rate(self.battery_c_rate,
+                                        self.interval_hours))
+        self.SOC = float(SOC)
+        self.last_dt = None
+
+    def scaled_soc(self, SOC):
+        """ SOC of usable capacity scaled with reserve, as in the model"""
+        return self.battery_reserve + SOC*(1.0 - self.battery_reserve)
+
+    def step(self, dt, production, consumption):
+        """ Advance one interval and return its results as a dict"""
+        out = [[0.0] for k in range(len(SWEEP_SERIES))]
+        self.SOC = _self_consumption_loop([float(production)],
+                                          [float(consumption)],
+                                          self.usable_capacity,
+                                          self.c_rate, self.SOC, *out)
+        self.last_dt = dt
+        result = {'dt': dt}
+        for name, values in zip(SWEEP_SERIES, out):
+            result[name] = values[0]
+        result['SOC'] = self.scaled_soc(result['SOC'])
+        return result
+
+    def batch(self, dt, production, consumption):
+        """ Advance over a small batch of intervals.
+
+        Returns
+        -------
+        result : dict of 1-d numpy arrays
+            'dt' and the SWEEP_SERIES for each interval of the batch.
+        """
+        production = np.ascontiguousarray(production, dtype=float)
+        consumption = np.ascontiguousarray(consumption, dtype=float)
+        N = len(production)
+        result = {'dt': dt}
+        out = [np.zeros((N,), dtype=float) for k in range(len(SWEEP_SERIES))]
+        self.SOC = _self_consumption_kernel(production, consumption,
+                                            self.usable_capacity,
+                                            self.c_rate, self.SOC, *out)
+        if N > 0:
+            self.last_dt = dt[-1]
+        for name, values in zip(SWEEP_SERIES, out):
+            result[name] = values
+        result['SOC'] = self.scaled_soc(result['SOC'])
+        return result
+
+
+def stream(readings, battery):
+    """ Generator of per-interval results for an iterable of readings.
+
+    readings yields (dt, production, consumption) tuples with energy in kWh.
+    """
+    for dt, production, consumption in readings:
+        yield battery.step(dt, production, consumption)
+
+
+async def astream(readings, battery):
+    """ Async generator of per-interval results for an async iterable of
+    (dt, production, consumption) readings."""
+    async for dt, production, consumption in readings:
+        yield battery.step(dt, production, consumption)
+
+
+def parse_line(line):
+    """
+    Parse one line of a SolarEdge export into a reading.
+
+    Returns (dt, production, consumption) in kWh, with the same rules as
+    parse_data_regexp, or None for the header or a line that can not be
+    parsed.
+    """
+    sw = line.replace('"', '').strip().split(',')
+    if len(sw) < 5:
+        return None
+    dt = scanf_datetime(sw[0], fmt=TIME_FORMAT)
+    if dt is None:
+        return None
+    csi = []
+    for s in sw[1:5]:
+        m = re.search(REAL_RE_STR, s)
+        csi.append(float(m.groups()[0]) if m else np.nan)
+    production = csi[2]/1000
+    if np.isnan(production):
+        production = 0.0
+    return dt, production, csi[0]/1000
+
+
+async def aparse_lines(reader):
+    """ Readings from an asyncio.StreamReader (socket, pipe or file tail)
+    sending SolarEdge export lines; unparseable lines are skipped."""
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        reading = parse_line(line.decode('utf-8', errors='replace'))
+        if reading is not None:
+            yield reading
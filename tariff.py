@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+"""
+Electricity bills of the model results for time-of-use (TOU) tariffs with
+net metering and fixed charges.
+
+Each tariff is compiled to a rate table of (month, day type, hour), 12 x 2
+x 24 slots, for import and export.  The import and export energy are summed
+once per billing period and slot with one bincount over the rows; the bill
+of every tariff is then a matrix product of these (period x slot) sums with
+the (slot x tariff) rate tables, so many tariffs are compared over years of
+data in one pass over the rows.
+
+A tariff is a dict:
+
+    {'name': 'TOU-4-9PM',
+     'import_rate': rate spec ($/kWh),
+     'export_rate': rate spec ($/kWh), ignored with net_metering,
+     'seasons': {'summer': (6, 7, 8, 9), 'winter': (1, 2, 3, 4, 5, 10, 11, 12)},
+     'fixed_charge': 10.0,         # $ per billing period
+     'net_metering': True,         # export credited at the import rate
+     'carryover': True}            # credits carried to the next period
+
+A rate spec is a scalar, 24 hourly rates, a dict {'weekday': ...,
+'weekend': ...} of either, or with seasons a dict {season: ...} of those.
+Only 'import_rate' is required.  read_tariff reads such a dict from a
+JSON file, so scripts (e.g. report.py) take the same tariff as the bills.
+
+Example
+-------
+    data = run_model(get_data())
+    tariffs = [flat_tariff(0.30), tou_tariff(0.25, 0.50, peak_hours=(16, 21))]
+    bills = compute_bills(data, tariffs)
+    table = compare_tariffs(data, tariffs)
+"""
+
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+# slots of the rate tables: 12 months x (weekday, weekend) x 24 hours
+N_SLOTS = 12*2*24
+
+
+def flat_tariff(rate, export_rate=None, fixed_charge=0.0, name=None):
+    """ Tariff with one import rate, net metered unless export_rate is given"""
+    return {'name': name or 'flat %g' % rate, 'import_rate': rate,
+            'export_rate': export_rate if export_rate is not None else rate,
+            'fixed_charge': fixed_charge,
+            'net_metering': export_rate is None, 'carryover': True}
+
+
+def tou_tariff(off_peak, peak, peak_hours=(16, 21), weekend_peak=False,
+               export_rate=None, fixed_charge=0.0, name=None):
+    """ Two-rate TOU tariff with the peak rate from peak_hours[0] up to
+    peak_hours[1] (hour of day), net metered unless export_rate is given."""
+    hourly = np.full((24,), float(off_peak))
+    hourly[peak_hours[0]:peak_hours[1]] = peak
+    rate = {'weekday': hourly.tolist(),
+            'weekend': hourly.tolist() if weekend_peak else float(off_peak)}
+    return {'name': name or 'TOU %g/%g %d-%d' % (off_peak, peak, *peak_hours),
+            'import_rate': rate,
+            'export_rate': export_rate if export_rate is not None else rate,
+            'fixed_charge': fixed_charge,
+            'net_metering': export_rate is None, 'carryover': True}
+
+
+def read_tariff(inFile):
+    """ Tariff dict of a JSON file, named after the file unless it has a
+    'name'; the rates are checked with rate_table."""
+    with open(inFile, 'r') as f:
+        tariff = json.load(f)
+    if not isinstance(tariff, dict) or 'import_rate' not in tariff:
+        raise ValueError('%s is not a tariff with an import_rate' % inFile)
+    tariff.setdefault('name', os.path.splitext(os.path.basename(inFile))[0])
+    rate_table(tariff['import_rate'], tariff.get('seasons'))
+    if 'export_rate' in tariff:
+        rate_table(tariff['export_rate'], tariff.get('seasons'))
+    return tariff
+
+
+def _day_rates(spec):
+    """ (2, 24) weekday/weekend rates of a rate spec without seasons"""
+    if isinstance(spec, dict):
+        return np.stack([_day_rates(spec['weekday'])[0],
+                         _day_rates(spec['weekend'])[1]])
+    rates = np.asarray(spec, dtype=float)
+    if rates.ndim == 0:
+        rates = np.full((24,), float(rates))
+    if rates.shape != (24,):
+        raise ValueError('Hourly rates need 24 values, not %d' % rates.size)
+    return np.stack([rates, rates])
+
+
+def rate_table(spec, seasons=None):
+    """
+    Rates of every (month, day type, hour) slot.
+
+    Parameters
+    ----------
+    spec : rate spec
+        See the module notes.
+    seasons : dict, optional
+        {season: months (1..12)}, the keys of spec when spec is given by
+        season.
+
+    Returns
+    -------
+    table : (12, 2, 24) numpy array
+        Rate by month (0 = January), weekday (0) or weekend (1) and hour.
+    """
+    table = np.full((12, 2, 24), np.nan)
+    if seasons and isinstance(spec, dict) and not {'weekday', 'weekend'} & set(spec):
+        for season, months in seasons.items():
+            for month in months:
+                table[month-1] = _day_rates(spec[season])
+    else:
+        table[:] = _day_rates(spec)
+    if np.isnan(table).any():
+        raise ValueError('Seasons do not cover every month')
+    return table
+
+
+def calendar_slots(dt, holidays=()):
+    """
+    Slot (month, day type, hour) of each timestamp as an index into the
+    flattened rate tables.  Holidays are billed as weekend days.
+    """
+    dt = np.asarray(dt, dtype='datetime64[ns]')
+    days = dt.astype('datetime64[D]')
+    month = dt.astype('datetime64[M]').astype(int) % 12
+    # 1970-01-01 was a Thursday, so Monday is 0
+    weekday = (days.astype(int) + 3) % 7
+    weekend = weekday >= 5
+    if len(holidays):
+        weekend |= np.isin(days, np.asarray(holidays, dtype='datetime64[D]'))
+    hour = ((dt - days)//np.timedelta64(1, 'h')).astype(int)
+    return (month*2 + weekend)*24 + hour
+
+
+def billing_periods(dt, billing_day=1):
+    """
+    Billing period of each timestamp, periods starting on billing_day of
+    each month.
+
+    Returns
+    -------
+    index : 1-d int array
+        Period of each row, 0 for the first period.
+    labels : 1-d datetime64[D] array
+        First day of each period.
+    """
+    dt = np.asarray(dt, dtype='datetime64[ns]')
+    shifted = dt - np.timedelta64(billing_day-1, 'D')
+    month = shifted.astype('datetime64[M]')
+    first = month.min()
+    index = (month - first).astype(int)
+    n = index.max() + 1 if len(index) else 0
+    labels = (first + np.arange(n)).astype('datetime64[D]') + \
+             np.timedelta64(billing_day-1, 'D')
+    return index, labels
+
+
+def compute_bills(data, tariffs, billing_day=1, holidays=()):
+    """
+    Bills of each billing period for each tariff.
+
+    Parameters
+    ----------
+    data : dict of 1-d numpy arrays
+        Model results with dt, import and export (kWh).
+    tariffs : dict or list of dict
+        Tariffs, see the module notes.
+    billing_day : int
+        Day of the month billing periods start.
+    holidays : sequence of dates
+        Days billed at weekend rates.
+
+    Returns
+    -------
+    bills : dict
+        'names' of the tariffs, 'period' (first day of each billing
+        period), 'import' and 'export' (kWh per period), and (period,
+        tariff) arrays of 'energy_charge', 'export_credit', 'fixed_charge',
+        'credit_carried' (credit applied from earlier periods) and 'bill';
+        'total' bill of each tariff.
+    """
+    if isinstance(tariffs, dict):
+        tariffs = [tariffs]
+    dt = data['dt']
+    imported = np.nan_to_num(np.asarray(data['import'], dtype=float))
+    exported = np.nan_to_num(np.asarray(data['export'], dtype=float))
+
+    # energy per (billing period, slot), one pass over the rows
+    period, labels = billing_periods(dt, billing_day)
+    P = len(labels)
+    key = period*N_SLOTS + calendar_slots(dt, holidays)
+    E_import = np.bincount(key, imported, P*N_SLOTS).reshape(P, N_SLOTS)
+    E_export = np.bincount(key, exported, P*N_SLOTS).reshape(P, N_SLOTS)
+
+    # (slot, tariff) rate tables
+    T = len(tariffs)
+    import_rates = np.empty((N_SLOTS, T))
+    export_rates = np.empty((N_SLOTS, T))
+    for j, tariff in enumerate(tariffs):
+        seasons = tariff.get('seasons')
+        import_rates[:, j] = rate_table(tariff['import_rate'], seasons).ravel()
+        if tariff.get('net_metering', True):
+            export_rates[:, j] = import_rates[:, j]
+        else:
+            export_rates[:, j] = rate_table(tariff.get('export_rate', 0.0),
+                                            seasons).ravel()
+
+    energy_charge = E_import @ import_rates
+    export_credit = E_export @ export_rates
+    fixed = np.array([tariff.get('fixed_charge', 0.0) for tariff in tariffs])
+    fixed_charge = np.broadcast_to(fixed, (P, T)).copy()
+    net = energy_charge - export_credit
+
+    # credits left after a period go to the next, the energy part of a
+    # bill never goes below zero with carryover
+    carryover = np.array([tariff.get('carryover', True) for tariff in tariffs])
+    credit_carried = np.zeros((P, T))
+    energy = net.copy()
+    credit = np.zeros((T,))
+    for p in range(P):
+        applied = np.where(carryover, np.minimum(credit, np.maximum(net[p], 0.0)), 0.0)
+        credit_carried[p] = applied
+        balance = net[p] - applied
+        credit = np.where(carryover, credit - applied + np.maximum(-balance, 0.0),
+                          0.0)
+        energy[p] = np.where(carryover, np.maximum(balance, 0.0), balance)
+    bill = energy + fixed_charge
+
+    return {'names': [tariff.get('name', 'tariff %d' % j)
+                      for j, tariff in enumerate(tariffs)],
+            'period': labels,
+            'import': E_import.sum(axis=1), 'export': E_export.sum(axis=1),
+            'energy_charge': energy_charge, 'export_credit': export_credit,
+            'fixed_charge': fixed_charge, 'credit_carried': credit_carried,
+            'bill': bill, 'total': bill.sum(axis=0)}
+
+
+def bills_frame(bills, column='bill'):
+    """ One column of compute_bills as a table, one row per billing period
+    and one column per tariff."""
+    df = pd.DataFrame(bills[column], index=pd.DatetimeIndex(bills['period']),
+                      columns=bills['names'])
+    df.index.name = 'Period'
+    return df
+
+
+def compare_tariffs(data, tariffs, **kwargs):
+    """
+    Totals of each tariff over the data, cheapest first; kwargs are passed
+    to compute_bills.
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        One row per tariff: total bill, energy charge, export credit, fixed
+        charges and mean bill per period.
+    """
+    bills = compute_bills(data, tariffs, **kwargs)
+    table = pd.DataFrame({
+        'total': bills['total'],
+        'energy_charge': bills['energy_charge'].sum(axis=0),
+        'export_credit': bills['export_credit'].sum(axis=0),
+        'fixed_charge': bills['fixed_charge'].sum(axis=0),
+        'mean_bill': bills['bill'].mean(axis=0)},
+        index=pd.Index(bills['names'], name='tariff'))
+    return table.sort_values('total')
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures of the tests.  The modules of the repository are flat at
+its top level, so the top level is put on sys.path here.
+"""
+
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(ROOT, 'data')
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def hourly_data():
+    """ The bundled hourly exports, parsed without the on-disk cache"""
+    from read_data import get_data
+    return get_data(DATA_DIR, 'hourly', {}, cache=False)
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Regression tests of the battery model against the hour-by-hour loop it
+replaced, and of the batched sweep against single runs, on the bundled
+exports in data/.
+"""
+
+import numpy as np
+import pytest
+
+import battery_models
+from battery_models import maximize_self_consumption, only_solar
+
+SERIES = ('SOC', 'self_consumption', 'from_battery', 'import', 'export')
+
+# (battery_capacity, battery_reserve, battery_c_rate)
+CONFIGS = [(0.0, 0.20, 0.80), (5.0, 0.10, 0.50), (13.5, 0.20, 0.80),
+           (20.0, 0.30, 1.00), (40.0, 0.00, 0.25)]
+
+
+def baseline_maximize_self_consumption(data):
+    """ Frozen copy of the original per-hour loop of
+    maximize_self_consumption, the reference of the tests."""
+    N = len(data['dt'])
+    data['SOC'] = np.array(np.ones((N,), dtype=float))
+    data['self_consumption'] = np.array(np.zeros((N,), dtype=float))
+    data['from_battery'] = np.array(np.zeros((N,), dtype=float))
+    data['import'] = np.array(np.zeros((N,), dtype=float))
+    data['export'] = np.array(np.zeros((N,), dtype=float))
+
+    xSOC = np.linspace(0, 1, 100)
+    ySOC = np.linspace(data['battery_reserve'], 1.0, 100)
+
+    usable_capacity = data['battery_capacity']*data['depth_of_discharge']
+    SOC = 1.0
+    for i in range(N):
+        self_consumption = 0.0
+        from_battery = 0.0
+        to_battery = 0.0
+        imported = 0.0
+        exported = 0.0
+
+        available = SOC * usable_capacity
+        generated = data['production'][i]
+        consumed = data['consumption'][i]
+
+        if consumed >= generated:
+            if consumed-generated <= available:
+                from_battery = consumed - generated
+                imported = 0
+            else:
+                from_battery = available
+                imported = consumed - generated - available
+            self_consumption = from_battery + generated
+
+        if generated > consumed:
+            need = (usable_capacity - available)*data['battery_c_rate']
+            if generated - consumed > need:
+                self_consumption = consumed
+                to_battery = need
+                exported = generated - consumed - to_battery
+            else:
+                to_battery = generated - consumed
+            self_consumption = consumed
+
+        if usable_capacity > 0:
+            SOC = (available + to_battery - from_battery) / usable_capacity
+        else:
+            SOC = 0.0
+
+        if SOC >= 1.0:
+            SOC = 1.0
+        elif SOC <= 0.0:
+            SOC = 0.0
+
+        data['SOC'][i] = np.interp(SOC, xSOC, ySOC)
+        data['self_consumption'][i] = self_consumption
+        data['from_battery'][i] = from_battery
+        data['import'][i] = imported
+        data['export'][i] = exported
+    return data
+
+
+def model_input(data, capacity, reserve, c_rate):
+    return {'dt': data['dt'], 'production': data['production'],
+            'consumption': data['consumption'],
+            'battery_capacity': capacity, 'battery_reserve': reserve,
+            'battery_c_rate': c_rate, 'depth_of_discharge': 1 - reserve}
+
+
+def run_both(data, capacity, reserve, c_rate):
+    if capacity > 0:
+        new = maximize_self_consumption(model_input(data, capacity, reserve,
+                                                    c_rate))
+        old = baseline_maximize_self_consumption(
+            model_input(data, capacity, reserve, c_rate))
+    else:
+        new = only_solar(model_input(data, capacity, reserve, c_rate))
+        old = model_input(data, capacity, reserve, c_rate)
+        old['battery_capacity'] = 0.0
+        old['battery_reserve'] = 0.0
+        old = baseline_maximize_self_consumption(old)
+    return new, old
+
+
+def assert_same(new, old):
+    for name in SERIES:
+        np.testing.assert_allclose(new[name], old[name], rtol=0, atol=1e-12,
+                                   err_msg=name)
+
+
+@pytest.fixture(params=['numba', 'python'])
+def kernel(request, monkeypatch):
+    """ Run the tests with the compiled kernel and the plain-Python one"""
+    if request.param == 'numba':
+        if battery_models._self_consumption_jit is None:
+            pytest.skip('numba is not installed')
+    else:
+        monkeypatch.setattr(battery_models, '_self_consumption_jit', None)
+    return request.param
+
+
+@pytest.mark.parametrize('capacity, reserve, c_rate', CONFIGS)
+def test_matches_baseline(hourly_data, kernel, capacity, reserve, c_rate):
+    new, old = run_both(hourly_data, capacity, reserve, c_rate)
+    assert_same(new, old)
+
+
+def test_step_c_rate_does_not_depend_on_interval():
+    for c_rate in (0.25, 0.8, 1.0, 1.5):
+        hourly = battery_models.step_c_rate(c_rate, 1.0)
+        quarter = battery_models.step_c_rate(c_rate, 0.25)
+        # four quarter-hour steps leave the same room as one hourly step
+        assert (1 - quarter)**4 == pytest.approx(1 - hourly, abs=1e-12)
+
+
+@pytest.fixture(params=['numba', 'numpy', 'python'])
+def batch_kernel(request, monkeypatch):
+    """ Run the sweep with the compiled batch kernel, the numpy one and the
+    plain-Python loop"""
+    kernels = {'numba': battery_models._self_consumption_batch,
+               'numpy': battery_models._self_consumption_batch_numpy,
+               'python': battery_models._self_consumption_batch_loop}
+    if request.param == 'numba' and battery_models.njit is None:
+        pytest.skip('numba is not installed')
+    monkeypatch.setattr(battery_models, '_self_consumption_batch',
+                        kernels[request.param])
+    return request.param
+
+
+def test_sweep_matches_single_runs(hourly_data, batch_kernel):
+    grid = battery_models.parameter_grid([0.0, 7.5, 20.0], [0.0, 0.25],
+                                         [0.4, 1.0])
+    result = battery_models.sweep_self_consumption(hourly_data, **grid,
+                                                   keep_series=True)
+    for k, config in enumerate(zip(grid['battery_capacity'],
+                                   grid['battery_reserve'],
+                                   grid['battery_c_rate'])):
+        single = maximize_self_consumption(model_input(hourly_data, *config))
+        for name in SERIES:
+            np.testing.assert_allclose(result['series'][name][k],
+                                       single[name], rtol=1e-6, atol=1e-6,
+                                       err_msg=name)
+            if name != 'SOC':
+                assert result[name][k] == pytest.approx(
+                    np.nansum(single[name]), rel=1e-9)
+        assert result['self_consumption_pct'][k] == pytest.approx(
+            100*np.nansum(single['self_consumption']) /
+            np.nansum(hourly_data['consumption']), rel=1e-9)
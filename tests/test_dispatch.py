@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the dispatch models: the compiled, numpy and Python kernels
+agree, the default preset is the self-consumption model, and the power
+caps, losses and TOU periods hold step by step.
+"""
+
+import numpy as np
+import pytest
+
+import dispatch
+from battery_models import maximize_self_consumption, sweep_self_consumption
+from tariff import tou_tariff
+
+TARIFF = tou_tariff(0.25, 0.50, peak_hours=(16, 21))
+CAPACITY = [0.0, 5.0, 13.5, 20.0]
+
+
+def run(data, model, kernel=None, monkeypatch=None, **params):
+    if kernel is not None:
+        monkeypatch.setitem(dispatch.MODELS[model], 'kernel', kernel)
+    params.setdefault('battery_capacity', CAPACITY)
+    return dispatch.run_dispatch(data, model, keep_series=True,
+                                 tariff=TARIFF, series_dtype=float, **params)
+
+
+def assert_results_close(result, expected, rtol=1e-9):
+    for name in dispatch.DISPATCH_TOTALS + ('final_SOC',):
+        np.testing.assert_allclose(result[name], expected[name], rtol=rtol,
+                                   atol=1e-9, err_msg=name)
+    for name in dispatch.DISPATCH_SERIES:
+        np.testing.assert_allclose(result['series'][name],
+                                   expected['series'][name], rtol=rtol,
+                                   atol=1e-9, err_msg=name)
+
+
+@pytest.mark.parametrize('model', sorted(dispatch.MODELS))
+def test_kernels_agree(hourly_data, monkeypatch, model):
+    expected = run(hourly_data, model, dispatch._dispatch, monkeypatch)
+    result = run(hourly_data, model, dispatch._dispatch_numpy, monkeypatch)
+    assert_results_close(result, expected)
+    # the step-by-step loop, uncompiled, on a shorter stretch
+    part = {name: hourly_data[name][:1500] for name in ('dt', 'production',
+                                                        'consumption')}
+    expected = run(part, model, dispatch._dispatch, monkeypatch)
+    result = run(part, model, dispatch._dispatch_loop, monkeypatch)
+    assert_results_close(result, expected)
+
+
+@pytest.mark.parametrize('capacity,reserve,c_rate',
+                         [(5.0, 0.1, 0.5), (13.5, 0.2, 0.8), (20.0, 0.3, 1.0)])
+def test_default_is_self_consumption(hourly_data, capacity, reserve, c_rate):
+    params = dict(battery_capacity=capacity, battery_reserve=reserve,
+                  battery_c_rate=c_rate)
+    data = {name: hourly_data[name] for name in ('dt', 'production',
+                                                 'consumption')}
+    expected = maximize_self_consumption(dict(data, depth_of_discharge=1 -
+                                              reserve, **params))
+    result = dispatch.dispatch_model(dict(data, **params))
+    for name in ('SOC', 'self_consumption', 'from_battery', 'import',
+                 'export'):
+        np.testing.assert_array_equal(result[name], expected[name],
+                                      err_msg=name)
+    totals = dispatch.run_dispatch(data, **params)
+    swept = sweep_self_consumption(data, capacity, reserve, c_rate)
+    for name in ('self_consumption', 'from_battery', 'import', 'export',
+                 'empty_hours', 'full_hours'):
+        np.testing.assert_allclose(totals[name], swept[name], rtol=1e-12,
+                                   err_msg=name)
+
+
+def test_power_caps(hourly_data):
+    result = run(hourly_data, 'power_limited', max_charge_kw=2.0,
+                 max_discharge_kw=3.0)
+    series = result['series']
+    assert series['to_battery'].max() == pytest.approx(2.0)
+    assert series['from_battery'].max() == pytest.approx(3.0)
+    assert np.all(series['to_battery'] <= 2.0 + 1e-12)
+    assert np.all(series['from_battery'] <= 3.0 + 1e-12)
+
+
+@pytest.mark.parametrize('model', ['power_limited', 'tou_arbitrage',
+                                   'backup_reserve'])
+def test_energy_balance(hourly_data, model):
+    result = run(hourly_data, model, round_trip_efficiency=0.85,
+                 standby_loss=0.001)
+    usable = result['battery_capacity']*(1 - result['battery_reserve'])
+    stored = (result['final_SOC'] - 1.0)*usable
+    balance = (np.nansum(hourly_data['production']) + result['import'] -
+               np.nansum(hourly_data['consumption']) - result['export'] -
+               stored - result['losses'])
+    np.testing.assert_allclose(balance, 0.0, atol=1e-6)
+    assert np.all(result['losses'][1:] > 0)
+    assert result['losses'][0] == 0.0
+
+
+def test_tou_discharges_at_peak_only(hourly_data):
+    result = run(hourly_data, 'tou_arbitrage')
+    period = dispatch.tou_periods(hourly_data['dt'], TARIFF)
+    from_battery = result['series']['from_battery']
+    assert np.all(from_battery[:, period != 2] == 0.0)
+    assert np.all(from_battery[1:, period == 2].sum(axis=1) > 0)
+    assert np.all(result['grid_charge'][1:] > 0)
+    with pytest.raises(ValueError):
+        dispatch.run_dispatch(hourly_data, 'tou_arbitrage')
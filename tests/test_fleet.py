@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of fleet mode: a fleet of one site gives the single-site sweep,
+and a fleet without consumption does not fail.
+"""
+
+import shutil
+
+import numpy as np
+
+import read_data
+from battery_models import sweep_self_consumption
+from conftest import DATA_DIR
+from fleet import build_store, run_fleet, fleet_table
+
+PARAMS = {'battery_capacity': 13.5, 'battery_reserve': 0.2,
+          'battery_c_rate': 0.6}
+
+
+def test_one_site_matches_sweep(tmp_path, hourly_data):
+    site = tmp_path/'site'
+    site.mkdir()
+    for fn in read_data.get_filenames(DATA_DIR, 'hourly'):
+        shutil.copy(fn, site)
+    store = build_store(str(tmp_path/'fleet'), [str(site)], cache=False)
+    result = run_fleet(store, chunk_sites=1, aggregate_series=True, **PARAMS)
+
+    # the store holds float32 energies, on the time axis of the exports
+    # with the missing intervals added
+    index = np.searchsorted(store['dt'], hourly_data['dt'])
+    np.testing.assert_array_equal(store['dt'][index], hourly_data['dt'])
+    data = {name: hourly_data[name].astype(np.float32)
+            for name in ('production', 'consumption')}
+    expected = sweep_self_consumption(data, keep_series=True, **PARAMS)
+    for name in ('self_consumption', 'from_battery', 'import', 'export',
+                 'final_SOC'):
+        np.testing.assert_allclose(result[name], expected[name], rtol=1e-9,
+                                   err_msg=name)
+        if name != 'final_SOC':
+            assert result['aggregate'][name] == result[name][0]
+            np.testing.assert_allclose(result['series'][name][index],
+                                       expected['series'][name][0],
+                                       rtol=1e-6, err_msg=name)
+    assert result['samples'][0] == np.count_nonzero(
+        ~np.isnan(hourly_data['consumption']))
+    assert len(fleet_table(result)) == 1
+
+
+def test_no_consumption():
+    store = {'production': np.zeros((2, 48), dtype=np.float32),
+             'consumption': np.zeros((2, 48), dtype=np.float32),
+             'interval_hours': 1.0}
+    # the per-chunk percentages of the sweep are NaN too
+    with np.errstate(invalid='ignore'):
+        result = run_fleet(store, **PARAMS)
+    assert np.isnan(result['self_consumption_pct']).all()
+    assert np.isnan(result['aggregate']['self_consumption_pct'])
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the incremental mode: updates as exports arrive give the results
+of one run over all the data, and read only the rows after the checkpoint.
+"""
+
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import incremental
+from battery_models import sweep_self_consumption, SWEEP_TOTALS
+from conftest import DATA_DIR
+
+EXPORTS = ('Export CSV hourly 2022.csv', 'Export CSV hourly 2023.csv',
+           'Export CSV hourly 2024.csv')
+PARAMS = {'battery_capacity': [10.0, 20.0], 'battery_reserve': 0.2,
+          'battery_c_rate': 0.8}
+
+
+def test_updates_match_full_run(tmp_path, hourly_data, monkeypatch):
+    indir = tmp_path/'data'
+    indir.mkdir()
+    state_dir = str(tmp_path/'checkpoint')
+    for name in EXPORTS[:2]:
+        shutil.copy(os.path.join(DATA_DIR, name), indir)
+    incremental.update(str(indir), 'hourly', state_dir, **PARAMS)
+
+    shutil.copy(os.path.join(DATA_DIR, EXPORTS[2]), indir)
+    calls = []
+    get_data = incremental.get_data
+
+    def spy(*args, **kwargs):
+        data = get_data(*args, **kwargs)
+        calls.append((kwargs.get('start'), len(data['dt'])))
+        return data
+    monkeypatch.setattr(incremental, 'get_data', spy)
+    state = incremental.update(str(indir), 'hourly', state_dir, **PARAMS)
+
+    # only the rows after the checkpoint were loaded
+    assert calls[0][0] is not None
+    assert calls[0][1] == state['new_rows'] > 0
+
+    full = sweep_self_consumption(hourly_data, **PARAMS)
+    assert state['rows'] == len(hourly_data['dt'])
+    for key in SWEEP_TOTALS:
+        np.testing.assert_allclose(state[key], full[key], rtol=1e-9)
+    np.testing.assert_allclose(state['final_SOC'], full['final_SOC'],
+                               rtol=1e-9)
+    series = incremental.load_series(state_dir, k=1)
+    np.testing.assert_array_equal(series['dt'], hourly_data['dt'])
+
+
+def test_interval_must_match(tmp_path, hourly_data):
+    state_dir = str(tmp_path/'checkpoint')
+    head = {key: hourly_data[key][:100] for key in
+            ('dt', 'production', 'consumption')}
+    incremental.run_incremental(dict(head, interval_hours=1.0), state_dir,
+                                keep_series=False)
+    with pytest.raises(ValueError):
+        incremental.run_incremental(dict(head, interval_hours=0.25),
+                                    state_dir, keep_series=False)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the outage model against a brute-force simulation of an outage
+from every start hour.
+"""
+
+import numpy as np
+import pytest
+
+import outage
+from battery_models import maximize_self_consumption
+
+ROWS = 1500
+MAX_HOURS = 48
+
+
+@pytest.fixture(scope='module')
+def model(hourly_data):
+    data = {'dt': hourly_data['dt'][:ROWS],
+            'production': hourly_data['production'][:ROWS],
+            'consumption': hourly_data['consumption'][:ROWS],
+            'battery_capacity': 10.0, 'battery_reserve': 0.2,
+            'battery_c_rate': 0.8, 'depth_of_discharge': 0.8}
+    return maximize_self_consumption(data)
+
+
+def brute_force(data, start, energy, capacity, recharge, max_hours):
+    """ Hours until the load can not be met from start, np.inf if it lasts
+    max_hours, None if the data ends first."""
+    production = np.nan_to_num(data['production'])
+    consumption = np.nan_to_num(data['consumption'])
+    for k in range(max_hours):
+        i = start + k
+        if i >= len(production):
+            return None
+        net = production[i] - consumption[i]
+        if net < 0:
+            if energy + net < 0:
+                return k + energy/(-net)
+            energy += net
+        elif recharge:
+            energy = min(energy + net, capacity)
+    return np.inf
+
+
+@pytest.mark.parametrize('recharge', [False, True])
+@pytest.mark.parametrize('use_reserve', [False, True])
+def test_matches_brute_force(model, recharge, use_reserve):
+    result = outage.outage_autonomy(model, MAX_HOURS, recharge=recharge,
+                                    use_reserve=use_reserve)
+    E0, capacity = outage.start_energy(model, use_reserve)
+    for s in range(ROWS):
+        expected = brute_force(model, s, E0[s], capacity, recharge, MAX_HOURS)
+        hours = result['hours_to_empty'][s]
+        if expected is None:
+            assert result['censored'][s], s
+        elif np.isinf(expected):
+            assert np.isinf(hours), s
+        else:
+            assert hours == pytest.approx(expected, abs=1e-9), s
+
+
+def test_full_battery(model):
+    full = outage.outage_autonomy(model, MAX_HOURS, SOC=1.0)
+    actual = outage.outage_autonomy(model, MAX_HOURS)
+    # a full battery lasts at least as long as the battery of the model
+    assert np.all(full['hours_to_empty'] >= actual['hours_to_empty'] - 1e-9)
+
+
+def test_autonomy_matrix(model):
+    result = outage.outage_autonomy(model, MAX_HOURS)
+    matrix = outage.autonomy_matrix(result, (4, 12, 24))
+    assert matrix.shape == (ROWS, 3)
+    # carrying a longer outage implies carrying a shorter one
+    assert np.all(matrix[:, 0] >= matrix[:, 1])
+    assert np.all(matrix[:, 1] >= matrix[:, 2])
+    assert not matrix[result['censored']].any()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the modeled PV production: solar noon on the local clock with
+and without daylight saving, and clear-sky bounds.
+"""
+
+import numpy as np
+import pytest
+
+import pv_model
+from pv_model import PV_SYSTEM
+
+
+def minutes(day):
+    start = np.datetime64(day + 'T00:00', 'ns')
+    return start + np.arange(24*60)*np.timedelta64(1, 'm')
+
+
+@pytest.mark.parametrize('day,noon', [('2023-07-01', '13:07'),
+                                      ('2023-01-15', '12:13'),
+                                      ('2024-03-10', '13:15'),
+                                      ('2023-11-05', '11:48')])
+def test_solar_noon(day, noon):
+    dt = minutes(day)
+    zenith, azimuth = pv_model.solar_position(
+        dt, PV_SYSTEM['latitude'], PV_SYSTEM['longitude'],
+        pv_model.utc_offsets(dt, PV_SYSTEM))
+    found = dt[np.argmin(zenith)]
+    assert abs(found - np.datetime64(day + 'T' + noon)) <= np.timedelta64(2, 'm')
+
+
+def test_fixed_offset_is_standard_time():
+    dt = minutes('2023-07-01')
+    system = dict(PV_SYSTEM, timezone=None)
+    np.testing.assert_array_equal(pv_model.utc_offsets(dt, system), -7.0)
+    offsets = pv_model.utc_offsets(dt, PV_SYSTEM)
+    np.testing.assert_array_equal(offsets, -6.0)
+
+
+def test_modeled_peak_follows_daylight_saving(hourly_data):
+    data = pv_model.with_modeled_production(hourly_data, PV_SYSTEM)
+    hour = data['dt'].astype('datetime64[h]').astype(int) % 24
+    month = data['dt'].astype('datetime64[M]').astype(int) % 12 + 1
+    for months, peak in (((6, 7, 8), (12, 13)), ((12, 1), (11, 12))):
+        at = np.isin(month, months)
+        mean = np.bincount(hour[at], data['production'][at], 24)
+        assert set(np.argsort(mean)[-2:]) == set(peak)
+
+
+def test_clear_sky_bounds():
+    data = pv_model.modeled_data('2023-01-01', '2024-01-01', '15 min')
+    step = np.timedelta64(15*60//2, 's')
+    zenith, azimuth = pv_model.solar_position(
+        data['dt'] + step, PV_SYSTEM['latitude'], PV_SYSTEM['longitude'],
+        pv_model.utc_offsets(data['dt'] + step, PV_SYSTEM))
+    ghi = pv_model.clear_sky_ghi(zenith)
+    top = pv_model.extraterrestrial(data['dt'])*np.cos(np.radians(zenith))
+    assert np.all(ghi <= np.clip(top, 0, None))
+    assert ghi.max() > 900
+    production = data['production']
+    assert np.all(production >= 0)
+    # none at night, never above the DC size
+    assert np.all(production[zenith > 90] == 0)
+    assert production.max() <= PV_SYSTEM['pv_kw']*0.25
+    # a year of clear sky gives 1500 to 2500 kWh per kW
+    assert 1500 < production.sum()/PV_SYSTEM['pv_kw'] < 2500
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of reading the SolarEdge exports: the parsed-column cache, the
+merge of overlapping exports, the range reads of the coverage index and
+the pandas parser against the regexp parser.
+"""
+
+import functools
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+import read_data
+from conftest import DATA_DIR
+
+EXPORT = 'Export CSV hourly 2023.csv'
+HEADER = ('Time,Consumption Meter E (Wh),Consumption Meter P (W),'
+          'Inv1 Eac (Wh),Inv1 Pac (W)')
+
+
+def write_export(path, rows):
+    """ Write an export of (time, consumption Wh, production Wh) rows,
+    fields formatted as given (quoted or not)."""
+    with open(path, 'w', newline='') as f:
+        f.write(HEADER + '\r\n')
+        for t, consumption, production in rows:
+            f.write('%s,%s,"0",%s,"0"\r\n' % (t, consumption, production))
+    return str(path)
+
+
+def copy_export(tmp_path, name=EXPORT):
+    shutil.copy(os.path.join(DATA_DIR, name), tmp_path)
+    return os.path.join(tmp_path, name)
+
+
+def test_cache_entry_reused(tmp_path):
+    fn = copy_export(tmp_path)
+    first = read_data.parse_data_cached(fn)
+    cached = read_data.parse_data_cached(fn)
+    assert isinstance(cached['dt'], np.memmap)
+    for var in read_data.CACHE_COLUMNS:
+        np.testing.assert_array_equal(cached[var], first[var])
+
+
+def test_cache_version_invalidates(tmp_path, monkeypatch):
+    fn = copy_export(tmp_path)
+    read_data.parse_data_cached(fn)
+    monkeypatch.setattr(read_data, 'CACHE_VERSION', read_data.CACHE_VERSION + 1)
+    data = read_data.parse_data_cached(fn)
+    # parsed again, not loaded from the entry of the old version
+    assert not isinstance(data['dt'], np.memmap)
+    assert len(os.listdir(os.path.join(tmp_path, read_data.CACHE_DIR))) == 2
+
+
+def test_merge_latest_file_wins(tmp_path):
+    old = write_export(tmp_path/'Export CSV hourly 2023-01-01.csv',
+                       [('01/01/2023 %02d:00' % h, '"1000"', '"0"')
+                        for h in range(6)])
+    new = write_export(tmp_path/'Export CSV hourly 2023-01-02.csv',
+                       [('01/01/2023 %02d:00' % h, '"2000"', '"500"')
+                        for h in range(4, 8)])
+    merged = read_data.merge_exports([read_data.parse_data_csv(old),
+                                      read_data.parse_data_csv(new)])
+    assert len(merged['dt']) == 8
+    assert np.all(np.diff(merged['dt']) == np.timedelta64(1, 'h'))
+    np.testing.assert_array_equal(merged['consumption'], [1, 1, 1, 1, 2, 2, 2, 2])
+    np.testing.assert_array_equal(merged['production'], [0, 0, 0, 0, .5, .5, .5, .5])
+    assert merged['duplicates'] == 2
+    assert merged['conflicts'] == 2
+
+    # get_data merges the files in name order, the same way
+    data = read_data.get_data(str(tmp_path), 'hourly', {}, cache=False)
+    np.testing.assert_array_equal(data['consumption'], merged['consumption'])
+
+
+def test_merge_ignores_quoting(tmp_path):
+    quoted = write_export(tmp_path/'a.csv',
+                          [('01/01/2023 %02d:00' % h, '"1500"', '"250"')
+                           for h in range(3)])
+    bare = write_export(tmp_path/'b.csv',
+                        [(' 01/01/2023 %02d:00' % h, '1500', ' 250')
+                         for h in range(1, 4)])
+    merged = read_data.merge_exports([read_data.parse_data_csv(quoted),
+                                      read_data.parse_data_csv(bare)])
+    assert len(merged['dt']) == 4
+    assert merged['duplicates'] == 2
+    # the same values written differently are not conflicts
+    assert merged['conflicts'] == 0
+    np.testing.assert_array_equal(merged['consumption'], [1.5]*4)
+
+
+def test_gaps(tmp_path):
+    hours = [0, 1, 2, 6, 7, 12]
+    write_export(tmp_path/'Export CSV hourly 2023-01-01.csv',
+                 [('01/01/2023 %02d:00' % h, '"100"', '"0"')
+                  for h in hours])
+    data = read_data.get_data(str(tmp_path), 'hourly', {}, cache=False)
+    gaps = data['gaps'].astype('datetime64[h]').astype(int) % 24
+    np.testing.assert_array_equal(gaps, [[2, 6], [7, 12]])
+    assert len(read_data.find_gaps(data['dt'][:3])) == 0
+
+
+# ranges inside a file, across the 2022/2023 boundary, before the first
+# and after the last row, and open at either end
+RANGES = [('2023-03-05 07:00', '2023-03-09 13:30'),
+          ('2022-12-30 22:00', '2023-01-02 05:00'),
+          ('2000-01-01', '2022-01-03'), ('2024-12-30', '2030-01-01'),
+          (None, '2022-02-01'), ('2024-11-15 12:00', None),
+          ('2023-06-01', '2023-06-01')]
+
+
+@pytest.fixture(scope='module')
+def range_data(tmp_path_factory):
+    """ Copy of the exports with a coverage index of a small stride, and
+    the full load to compare with"""
+    indir = tmp_path_factory.mktemp('range')
+    for fn in read_data.get_filenames(DATA_DIR, 'hourly'):
+        shutil.copy(fn, indir)
+    full = read_data.get_data(str(indir), 'hourly', {}, cache=False)
+    return str(indir), full
+
+
+@pytest.mark.parametrize('start,end', RANGES)
+def test_range_read_matches_slice(range_data, monkeypatch, start, end):
+    indir, full = range_data
+    monkeypatch.setattr(read_data, 'scan_coverage',
+                        functools.partial(read_data.scan_coverage, stride=37))
+    data = read_data.get_data(indir, 'hourly', {}, start=start, end=end)
+    keep = np.ones((len(full['dt']),), dtype=bool)
+    if start is not None:
+        keep &= full['dt'] >= np.datetime64(start)
+    if end is not None:
+        keep &= full['dt'] < np.datetime64(end)
+    for var in ('dt', 'consumption', 'production'):
+        np.testing.assert_array_equal(data[var], full[var][keep])
+
+
+def test_read_rows(tmp_path):
+    fn = copy_export(tmp_path)
+    whole = read_data.parse_data_csv(fn)
+    entry = read_data.scan_coverage(fn, stride=100)
+    assert entry['rows'] == len(whole['dt'])
+    ns = whole['dt'].astype('datetime64[ns]').view('int64')
+    for i, j in [(0, 1), (99, 101), (100, 100), (250, 1000), (8000, len(ns))]:
+        t1 = ns[j] if j < len(ns) else None
+        part = read_data.read_rows(fn, entry, ns[i], t1)
+        # every row of the range, and only whole rows either side
+        got = part['dt'].astype('datetime64[ns]').view('int64')
+        a = np.searchsorted(ns, got[0])
+        np.testing.assert_array_equal(got, ns[a:a+len(got)])
+        assert got[0] <= ns[i] and (t1 is None or got[-1] >= ns[j-1])
+        np.testing.assert_array_equal(part['consumption'],
+                                      whole['consumption'][a:a+len(got)])
+
+
+def test_coverage_reused(tmp_path, monkeypatch):
+    fn = copy_export(tmp_path)
+    first = read_data.coverage_index(str(tmp_path), 'hourly')
+    scanned = []
+    scan = read_data.scan_coverage
+    monkeypatch.setattr(read_data, 'scan_coverage',
+                        lambda fn: scanned.append(fn) or scan(fn))
+    assert read_data.coverage_index(str(tmp_path), 'hourly') == first
+    assert scanned == []
+    # a changed file is scanned again
+    with open(fn, 'a') as f:
+        f.write('12/31/2023 23:30,"1","0","1","0"\r\n')
+    index = read_data.coverage_index(str(tmp_path), 'hourly')
+    assert scanned == [fn]
+    assert index[EXPORT]['rows'] == first[EXPORT]['rows'] + 1
+
+
+def assert_same_parse(fn):
+    expected = read_data.parse_data_regexp(read_data.load_data(fn), {})
+    data = read_data.parse_data_csv(fn)
+    np.testing.assert_array_equal(data['dt'], expected['dt'])
+    # assert_array_equal also requires the NaNs in the same places
+    np.testing.assert_array_equal(data['consumption'], expected['consumption'])
+    np.testing.assert_array_equal(data['production'], expected['production'])
+    return data
+
+
+@pytest.mark.parametrize('name', [EXPORT, 'Export CSV hourly 2022.csv'])
+def test_csv_parser_matches_regexp(name):
+    data = assert_same_parse(os.path.join(DATA_DIR, name))
+    assert len(data['dt']) > 1000
+
+
+def test_csv_parser_matches_regexp_blank_fields(tmp_path):
+    fn = write_export(tmp_path/'Export CSV hourly 2023-01-01.csv',
+                      [('01/01/2023 00:00', '"263"', '""'),
+                       ('01/01/2023 01:00', '""', '"12"'),
+                       ('01/01/2023 02:00', '', ''),
+                       ('01/01/2023 03:00', '271', '" 3.5 "'),
+                       ('01/01/2023 04:00', '"1500"', '"-2"'),
+                       ('01/01/2023 05:00', '"  "', '0')])
+    data = assert_same_parse(fn)
+    assert np.isnan(data['consumption'][[1, 2, 5]]).all()
+    np.testing.assert_array_equal(data['production'],
+                                  [0, 0.012, 0, 0.0035, -0.002, 0])
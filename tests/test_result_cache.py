@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the result cache: LRU eviction in memory, the on-disk tier across
+caches, pruning of the disk tier and the result version.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import result_cache
+from containers import BatteryConfig, Dataset, simulate
+from result_cache import ResultCache
+
+CONFIGS = [BatteryConfig(cap, 0.2, 0.8) for cap in (5.0, 10.0, 15.0)]
+
+
+@pytest.fixture(scope='module')
+def dataset(hourly_data):
+    return Dataset.from_dict({name: hourly_data[name][:2000]
+                              for name in ('dt', 'production',
+                                           'consumption')})
+
+
+def disk_files(disk_dir):
+    return sorted(name for root, dirs, names in os.walk(disk_dir)
+                  for name in names)
+
+
+def test_lru_eviction(dataset):
+    cache = ResultCache(maxsize=2)
+    a, b, c = CONFIGS
+    cache.simulate(dataset, a)
+    cache.simulate(dataset, b)
+    # a is used again, so b is the least recently used
+    assert cache.simulate(dataset, a) is cache.get(dataset, a)
+    cache.simulate(dataset, c)
+    assert len(cache) == 2
+    assert cache.get(dataset, b) is None
+    assert cache.get(dataset, a) is not None
+    assert (cache.hits, cache.misses) == (3, 3)
+
+
+def test_disk_hit_after_restart(dataset, tmp_path):
+    ResultCache(disk_dir=str(tmp_path)).simulate(dataset, CONFIGS[0])
+    cache = ResultCache(disk_dir=str(tmp_path))
+    result = cache.simulate(dataset, CONFIGS[0])
+    assert (cache.disk_hits, cache.misses) == (1, 0)
+    np.testing.assert_array_equal(result.block,
+                                  simulate(dataset, CONFIGS[0]).block)
+
+
+def test_prune_least_recently_used(dataset, tmp_path):
+    cache = ResultCache(maxsize=1, disk_dir=str(tmp_path), disk_maxsize=2)
+    fns = []
+    for t, config in enumerate(CONFIGS[:2]):
+        cache.simulate(dataset, config)
+        fns.append(cache._disk_path(cache.key(dataset, config)))
+        os.utime(fns[-1], ns=(t*10**9, t*10**9))
+    # a disk hit makes the first file the most recently used
+    cache.clear()
+    assert cache.get(dataset, CONFIGS[0]) is not None
+    cache.simulate(dataset, CONFIGS[2])
+    assert disk_files(tmp_path) == ['cap15.0_res0.2_rate0.8.npy',
+                                    'cap5.0_res0.2_rate0.8.npy']
+    cache.disk_maxsize = 0
+    cache.prune()
+    assert os.listdir(tmp_path) == []
+
+
+def test_version_invalidates(dataset, tmp_path, monkeypatch):
+    ResultCache(disk_dir=str(tmp_path)).simulate(dataset, CONFIGS[0])
+    monkeypatch.setattr(result_cache, 'RESULT_VERSION',
+                        result_cache.RESULT_VERSION + 1)
+    cache = ResultCache(disk_dir=str(tmp_path))
+    assert cache.get(dataset, CONFIGS[0]) is None
+    cache.simulate(dataset, CONFIGS[0])
+    assert len(os.listdir(tmp_path)) == 2
@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the Monte Carlo scenarios: complete, calendar-aligned blocks,
+and draws and results that depend on the seed only.
+"""
+
+import numpy as np
+import pytest
+
+import scenarios
+
+
+@pytest.mark.parametrize('block', ['day', 'week'])
+def test_block_pool(hourly_data, block):
+    pool = scenarios.block_pool(hourly_data, block)
+    days = scenarios.BLOCK_DAYS[block]
+    assert pool['length'] == 24*days
+    dt = hourly_data['dt']
+    start = pool['start']
+    assert len(start) > 100
+    # blocks start at midnight and cover their days hour by hour
+    np.testing.assert_array_equal(dt[start], dt[start].astype('datetime64[D]'))
+    index = start[:, None] + np.arange(pool['length'])
+    steps = np.diff(dt[index], axis=1)
+    assert np.all(steps == np.timedelta64(1, 'h'))
+    assert not np.isnan(hourly_data['consumption'][index]).any()
+    doy = (dt[start].astype('datetime64[D]') -
+           dt[start].astype('datetime64[Y]')).astype(int)
+    np.testing.assert_array_equal(pool['doy'], doy)
+
+
+def test_draws_follow_the_calendar(hourly_data):
+    pool = scenarios.block_pool(hourly_data, 'week')
+    window = 10
+    draws = scenarios.draw_scenarios(pool, n_years=50, window_days=window,
+                                     seed=3)
+    assert draws.shape == (50, 53)
+    doy = dict(zip(pool['start'], pool['doy']))
+    for b in range(draws.shape[1]):
+        distance = np.abs(np.array([doy[s] for s in draws[:, b]]) - 7*b)
+        distance = np.minimum(distance, scenarios.YEAR_DAYS - distance)
+        assert np.all(distance <= window)
+    index = scenarios.scenario_index(draws, pool)
+    assert index.shape == (50, scenarios.YEAR_DAYS*24)
+    # each week of a year is one block of consecutive intervals
+    np.testing.assert_array_equal(index[:, 7*24:14*24],
+                                  draws[:, 1:2] + np.arange(7*24))
+
+
+def test_same_seed_same_scenarios(hourly_data):
+    pool = scenarios.block_pool(hourly_data, 'day')
+    first = scenarios.draw_scenarios(pool, n_years=20, seed=7)
+    np.testing.assert_array_equal(
+        scenarios.draw_scenarios(pool, n_years=20, seed=7), first)
+    assert np.any(scenarios.draw_scenarios(pool, n_years=20, seed=8) != first)
+
+    kwargs = dict(battery_capacity=[5.0, 20.0], n_years=20, seed=7)
+    result = scenarios.run_scenarios(hourly_data, **kwargs)
+    # the chunking does not change the scenarios either
+    again = scenarios.run_scenarios(hourly_data, chunk_years=3, **kwargs)
+    for name in scenarios.SCENARIO_TOTALS:
+        assert result[name].shape == (2, 20)
+        np.testing.assert_array_equal(again[name], result[name], err_msg=name)
+    assert np.all(np.diff(result['import'], axis=0) <= 0)
+    assert len(np.unique(result['production'][0])) > 1
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of battery sizing: the bisection answers meet their target and the
+next smaller size does not, and the Pareto front keeps exactly the
+configurations no other dominates.
+"""
+
+import numpy as np
+import pytest
+
+import sizing
+
+
+@pytest.mark.parametrize('target', [{'target_self_consumption_pct': 70.0},
+                                    {'target_self_consumption_pct': 85.0},
+                                    {'target_import_reduction': 1000.0}])
+def test_smallest_capacity(hourly_data, target):
+    tol = 0.1
+    best = sizing.smallest_capacity(hourly_data, tol=tol, **target)
+    capacity = best['battery_capacity']
+    assert 0 < capacity < 100
+    f = sizing._target_metric(hourly_data, 0.20, 0.80,
+                              target.get('target_self_consumption_pct'),
+                              target.get('target_import_reduction'))
+    assert f(sizing.evaluate(hourly_data, capacity))[0] >= 0
+    assert f(sizing.evaluate(hourly_data, capacity - tol))[0] < 0
+    # fewer model runs than a scan at the tolerance
+    assert best['evaluations'] < 20
+
+
+def test_smallest_c_rate(hourly_data):
+    best = sizing.smallest_c_rate(hourly_data, 10.0,
+                                  target_self_consumption_pct=70.0)
+    c_rate = best['battery_c_rate']
+    pct = sizing.evaluate(hourly_data, 10.0, 0.20,
+                          [c_rate, c_rate - 0.01])['self_consumption_pct']
+    assert pct[0] >= 70.0 > pct[1]
+
+
+def test_target_out_of_reach(hourly_data):
+    best = sizing.smallest_capacity(hourly_data,
+                                    target_self_consumption_pct=100.0,
+                                    capacity_max=5.0)
+    assert best['battery_capacity'] is None
+    with pytest.raises(ValueError):
+        sizing.smallest_capacity(hourly_data)
+
+
+def test_pareto_front(hourly_data):
+    capacity = np.repeat([0.0, 5.0, 10.0, 20.0], 3)
+    c_rate = np.tile([0.1, 0.5, 1.0], 4)
+    table = sizing.pareto_front(hourly_data, capacity, 0.20, c_rate)
+    objectives = table[['battery_capacity', 'import_per_year',
+                        'export_per_year']].to_numpy()
+    for i, row in enumerate(objectives):
+        dominated = any(np.all(other <= row) and np.any(other < row)
+                        for other in objectives)
+        assert table['pareto'][i] == (not dominated)
+    # slower charging of the same battery stores less solar
+    assert not table['pareto'][(capacity == 10.0) & (c_rate == 0.1)].any()
+    assert table['pareto'][(capacity == 10.0) & (c_rate == 1.0)].all()
+    assert table['pareto'].sum() < len(table)
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the streaming battery model: readings fed one at a time, in
+batches or as export lines give the results of maximize_self_consumption.
+"""
+
+import os
+import asyncio
+
+import numpy as np
+import pytest
+
+import read_data
+from battery_models import maximize_self_consumption, SWEEP_SERIES
+from conftest import DATA_DIR
+from streaming import (SelfConsumptionStream, stream, astream, parse_line,
+                       aparse_lines)
+
+EXPORT = os.path.join(DATA_DIR, 'Export CSV hourly 2023.csv')
+PARAMS = {'battery_capacity': 13.5, 'battery_reserve': 0.2,
+          'battery_c_rate': 0.6}
+
+
+def expected(data):
+    return maximize_self_consumption(dict(
+        {name: data[name] for name in ('dt', 'production', 'consumption')},
+        depth_of_discharge=1 - PARAMS['battery_reserve'], **PARAMS))
+
+
+def assert_same(results, model):
+    for name in SWEEP_SERIES:
+        np.testing.assert_array_equal(results[name], model[name],
+                                      err_msg=name)
+
+
+def collect(results):
+    results = list(results)
+    return {name: np.array([r[name] for r in results])
+            for name in ('dt',) + SWEEP_SERIES}
+
+
+def test_step(hourly_data):
+    battery = SelfConsumptionStream(**PARAMS)
+    results = collect(stream(zip(hourly_data['dt'], hourly_data['production'],
+                                 hourly_data['consumption']), battery))
+    assert_same(results, expected(hourly_data))
+    assert battery.last_dt == hourly_data['dt'][-1]
+
+
+@pytest.mark.parametrize('size', [1, 7, 500])
+def test_batch(hourly_data, size):
+    battery = SelfConsumptionStream(**PARAMS)
+    parts = []
+    for a in range(0, len(hourly_data['dt']), size):
+        parts.append(battery.batch(hourly_data['dt'][a:a+size],
+                                   hourly_data['production'][a:a+size],
+                                   hourly_data['consumption'][a:a+size]))
+    results = {name: np.concatenate([part[name] for part in parts])
+               for name in SWEEP_SERIES}
+    assert_same(results, expected(hourly_data))
+
+
+def test_parse_line():
+    with open(EXPORT, 'r') as f:
+        lines = f.readlines()
+    assert parse_line(lines[0]) is None
+    data = read_data.parse_data_regexp(lines[1:], {})
+    readings = [parse_line(line) for line in lines]
+    battery = SelfConsumptionStream(**PARAMS)
+    results = collect(stream([r for r in readings if r is not None], battery))
+    np.testing.assert_array_equal(results['dt'].astype('datetime64[ns]'),
+                                  data['dt'])
+    assert_same(results, expected(data))
+
+
+def test_async_lines():
+    with open(EXPORT, 'rb') as f:
+        raw = f.read()
+
+    async def run():
+        reader = asyncio.StreamReader()
+        reader.feed_data(raw)
+        reader.feed_eof()
+        battery = SelfConsumptionStream(**PARAMS)
+        return [r async for r in astream(aparse_lines(reader), battery)]
+
+    results = collect(asyncio.run(run()))
+    data = read_data.parse_data_regexp(read_data.load_data(EXPORT), {})
+    assert_same(results, expected(data))
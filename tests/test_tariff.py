@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+Tests of the TOU bill engine against a row-by-row computation with pandas
+timestamps.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import tariff
+from battery_models import sweep_self_consumption
+
+SEASONS = {'summer': (6, 7, 8, 9), 'winter': (1, 2, 3, 4, 5, 10, 11, 12)}
+HOLIDAYS = ['2023-07-04', '2023-12-25']
+
+
+def brute_rate(spec, seasons, t):
+    """ Rate of a rate spec at timestamp t, looked up directly"""
+    if seasons and isinstance(spec, dict) and not {'weekday', 'weekend'} & set(spec):
+        spec = spec[[s for s, months in seasons.items() if t.month in months][0]]
+    if isinstance(spec, dict):
+        weekend = t.dayofweek >= 5 or t.strftime('%Y-%m-%d') in HOLIDAYS
+        spec = spec['weekend' if weekend else 'weekday']
+    if np.ndim(spec) == 0:
+        return float(spec)
+    return float(spec[t.hour])
+
+
+@pytest.fixture(scope='module')
+def model(hourly_data):
+    result = sweep_self_consumption(hourly_data, 10.0, 0.2, 0.8,
+                                    keep_series=True)
+    return {'dt': hourly_data['dt'],
+            'import': result['series']['import'][0].astype(float),
+            'export': result['series']['export'][0].astype(float)}
+
+
+def tariffs():
+    summer = [0.20]*16 + [0.55]*5 + [0.20]*3
+    winter = [0.18]*17 + [0.35]*4 + [0.18]*3
+    return [tariff.flat_tariff(0.30, fixed_charge=10.0),
+            tariff.tou_tariff(0.25, 0.50, peak_hours=(16, 21),
+                              export_rate=0.05),
+            {'name': 'seasonal', 'seasons': SEASONS,
+             'import_rate': {'summer': {'weekday': summer, 'weekend': 0.20},
+                             'winter': {'weekday': winter, 'weekend': 0.18}},
+             'export_rate': 0.04, 'net_metering': False, 'carryover': False}]
+
+
+def test_calendar_slots(hourly_data):
+    dt = hourly_data['dt'][::7]
+    slots = tariff.calendar_slots(dt, HOLIDAYS)
+    for t, slot in zip(pd.DatetimeIndex(dt), slots):
+        weekend = t.dayofweek >= 5 or t.strftime('%Y-%m-%d') in HOLIDAYS
+        assert slot == ((t.month - 1)*2 + weekend)*24 + t.hour
+
+
+def test_billing_periods(hourly_data):
+    dt = hourly_data['dt']
+    period, labels = tariff.billing_periods(dt, billing_day=15)
+    for t, p in zip(pd.DatetimeIndex(dt[::11]), period[::11]):
+        start = pd.Timestamp(labels[p])
+        assert start.day == 15
+        assert start <= t < start + pd.DateOffset(months=1)
+
+
+def test_bills_match_rows(model):
+    specs = tariffs()
+    bills = tariff.compute_bills(model, specs, billing_day=1,
+                                 holidays=HOLIDAYS)
+    period, labels = tariff.billing_periods(model['dt'], 1)
+    times = pd.DatetimeIndex(model['dt'])
+    for j, spec in enumerate(specs):
+        seasons = spec.get('seasons')
+        import_rate = np.array([brute_rate(spec['import_rate'], seasons, t)
+                                for t in times])
+        if spec.get('net_metering', True):
+            export_rate = import_rate
+        else:
+            export_rate = np.array([brute_rate(spec['export_rate'], seasons, t)
+                                    for t in times])
+        charge = np.bincount(period, np.nan_to_num(model['import'])*import_rate,
+                             len(labels))
+        credit = np.bincount(period, np.nan_to_num(model['export'])*export_rate,
+                             len(labels))
+        np.testing.assert_allclose(bills['energy_charge'][:, j], charge,
+                                   rtol=1e-12, atol=1e-9)
+        np.testing.assert_allclose(bills['export_credit'][:, j], credit,
+                                   rtol=1e-12, atol=1e-9)
+
+        # bill of each period with credits carried period to period
+        carry = 0.0
+        for p in range(len(labels)):
+            net = charge[p] - credit[p]
+            if spec.get('carryover', True):
+                applied = min(carry, max(net, 0.0))
+                carry = carry - applied + max(-(net - applied), 0.0)
+                energy = max(net - applied, 0.0)
+            else:
+                energy = net
+            assert bills['bill'][p, j] == pytest.approx(
+                energy + spec.get('fixed_charge', 0.0), abs=1e-9)
+    np.testing.assert_allclose(bills['total'], bills['bill'].sum(axis=0))
+
+
+def test_seasons_must_cover_year():
+    with pytest.raises(ValueError):
+        tariff.rate_table({'summer': 0.3}, {'summer': (6, 7, 8)})